@@ -1,4 +1,5 @@
 import asyncio
+from contextlib import asynccontextmanager
 from io import BytesIO
 import logging
 import os
@@ -17,7 +18,13 @@ from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.responses import RedirectResponse
 from pydantic import BaseModel, ConfigDict, Field
 
+from predictor.model.cpubudget import cpu_budget_stats
+from predictor.model.http import HttpCacheMiss
 from predictor.model.priceregion import PriceRegion, PriceRegionName
+from predictor.model.ratelimiter import request_budget_stats
+from predictor.model.resilience import circuit_breaker_stats, deadline, time_left
+from predictor.model.training import shutdown_training, training_budget, training_stats
+from predictor.model.workers import LOOP_LAG_THRESHOLD, LoopLagMonitor, run_cpu, worker_stats
 import predictor.model.pricepredictor as pp
 
 
@@ -32,7 +39,19 @@ warnings.filterwarnings(
 
 
 
-app = FastAPI(title="EPEX day-ahead prediction API", description="""
+loop_monitor = LoopLagMonitor(LOOP_LAG_THRESHOLD) if LOOP_LAG_THRESHOLD > 0 else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if loop_monitor is not None:
+        loop_monitor.start()
+    yield
+    if loop_monitor is not None:
+        await loop_monitor.stop()
+    shutdown_training()
+
+
+app = FastAPI(lifespan=lifespan, title="EPEX day-ahead prediction API", description="""
 API can be used free of charge on a fair use premise.
 There are no guarantees on availability or correctnes of the data.
 This is an open source project, feel free to host it yourself. [Source code and docs](https://github.com/b3nn0/EpexPredictor)
@@ -88,9 +107,38 @@ def api_docs():
     return RedirectResponse("/docs")
 
 
+@app.get("/metrics", include_in_schema=False)
+def metrics() -> dict:
+    """
+    Internal counters for monitoring
+    """
+    return {
+        "request_budgets": request_budget_stats(),
+        "circuit_breakers": circuit_breaker_stats(),
+        "workers": worker_stats(),
+        "training": training_stats(),
+        "cpu_budget": cpu_budget_stats(),
+        "event_loop": loop_monitor.stats() if loop_monitor is not None else None,
+        "price_providers": {
+            region.value: {provider: latency.stats() for provider, latency in manager.predictor.pricestore.provider_latency.items()}
+            for region, manager in prices_handler.region_prices.items()
+        },
+        "models": {
+            region.value: manager.predictor.training_stats()
+            for region, manager in prices_handler.region_prices.items()
+        },
+        "datastores": {
+            region.value: {name: store.fetch_stats() for name, store in manager.predictor.datastores().items()}
+            for region, manager in prices_handler.region_prices.items()
+        },
+    }
+
+
 USE_PERSISTENT_TESTDATA = os.getenv("USE_PERSISTENT_TEST_DATA", "false").lower() in ("yes", "true", "t", "1")
 EPEXPREDICTOR_DATADIR = os.getenv("EPEXPREDICTOR_DATADIR")
 TRAINING_DAYS = 120
+# Seconds a /prices request waits for a running data update if it could answer with the previous prediction. 0 = don't wait
+PRICES_DEADLINE = float(os.getenv("EPEXPREDICTOR_PRICES_DEADLINE", "0"))
 DEFAULT_TIMEZONE = "Europe/Berlin"
 
 
@@ -140,11 +188,13 @@ class RegionPriceManager:
     cachedeval : pd.DataFrame
 
     update_lock: asyncio.Lock
+    # running update, shared by all requests that arrive in the meantime
+    update_task: asyncio.Task | None = None
 
     init_lock: asyncio.Lock
     is_loaded: bool = False
 
-    def __init__(self, region: PriceRegion):
+    def __init__(self, region: PriceRegion, training_budget: float | None = None):
         self.init_lock = asyncio.Lock() # ensures only one aio worker will load persistent data on first access
         self.update_lock = asyncio.Lock() # ensures only one aio worker will trigger model update
 
@@ -152,7 +202,7 @@ class RegionPriceManager:
         self.cachedeval = pd.DataFrame()
         self.last_known_price = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
-        self.predictor = pp.PricePredictor(region, storage_dir=EPEXPREDICTOR_DATADIR)
+        self.predictor = pp.PricePredictor(region, storage_dir=EPEXPREDICTOR_DATADIR, training_budget=training_budget)
 
     async def ensure_loaded(self) -> Self:
         async with self.init_lock:
@@ -191,6 +241,14 @@ class RegionPriceManager:
         end_ts = start_ts + timedelta(hours=hours) if hours >= 0 else datetime(2999, 1, 1, tzinfo=tz)
 
         prediction = self.cachedeval if evaluation else self.cachedprices
+        # resampling and building thousands of models for a long range takes a while - don't block other requests meanwhile
+        return await run_cpu(self._format, prediction, start_ts, end_ts, surcharge, tax_percent, unit, hourly, tz, format)
+
+    def _format(self, prediction: pd.DataFrame, start_ts: datetime, end_ts: datetime, surcharge: float, tax_percent: float,
+                unit: PriceUnit, hourly: bool, tz: ZoneInfo, format: OutputFormat) -> PricesModel | PricesModelShort:
+        """
+        Careful: runs in a worker thread. prediction is never modified in place, so that's fine
+        """
         if hourly:
             prediction = prediction.resample("1h").mean()
         
@@ -216,15 +274,35 @@ class RegionPriceManager:
         )
 
 
-    async def update_in_background(self):
-        if self.update_lock.locked() and len(self.cachedprices) > 0:
-            return # don't queue up multiple updates if we already have a filled cache
+    def start_update(self) -> asyncio.Task:
+        """
+        Start update_data_if_needed() unless it is already running. Await the result with asyncio.shield, the update
+        continues if the request waiting for it goes away
+        """
+        if self.update_task is None or self.update_task.done():
+            # the update outlives the request - the request's deadline must not cut off its upstream fetches
+            with deadline(None):
+                self.update_task = asyncio.create_task(self.update_data_if_needed())
+            self.update_task.add_done_callback(self._update_done)
+        return self.update_task
+
+    def _update_done(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"{self.predictor.region.bidding_zone_entsoe}: data update failed: {task.exception()}")
 
-        update_future = self.update_data_if_needed()
+    async def update(self):
+        await asyncio.shield(self.start_update())
+
+    async def update_in_background(self):
+        task = self.start_update()
         if len(self.cachedprices) == 0: # first call, no prices yet -> wait until first update is done
-            await update_future
-        else:
-            asyncio.create_task(update_future)
+            await asyncio.shield(task)
+            return
+
+        # previous prediction available - give the update until the request's deadline, then answer with what we have
+        left = time_left()
+        if left is not None and left > 0:
+            await asyncio.wait([task], timeout=left)
 
 
     async def update_data_if_needed(self):
@@ -238,6 +316,10 @@ class RegionPriceManager:
 
             retrain = False
 
+            if len(self.cachedprices) == 0:
+                # first update of this region - fetch all missing history concurrently instead of range by range during training
+                await self.predictor.backfill(train_start, train_end)
+
             # since we cache the prediction result, the price store is never queried and never updates until next retrain/weather update..
             # Ensure we retrain (and re-fetch horizon) more often if needed
             if self.predictor.pricestore.needs_horizon_revalidation() or self.predictor.gasstore.needs_horizon_revalidation():
@@ -247,9 +329,15 @@ class RegionPriceManager:
             if weather_age > 60 * 60 * 3:  # update forecasted input data every 3 hours
                 start = datetime.now(timezone.utc) - timedelta(days=1)
                 end = datetime.now(timezone.utc) + timedelta(days=8)
-                await self.predictor.refresh_forecasts(start, end)
-                self.last_weather_update = currts
-                retrain = True
+                try:
+                    await self.predictor.refresh_forecasts(start, end)
+                    self.last_weather_update = currts
+                    retrain = True
+                except HttpCacheMiss:
+                    raise
+                except Exception as e:
+                    # keep working with the forecasts we have, retry with the next update
+                    log.warning(f"{self.predictor.region.bidding_zone_entsoe}: failed to refresh forecasts, using last known data: {e}")
 
 
             if self.predictor.last_data_update() > self.last_retrain or retrain:
@@ -279,14 +367,15 @@ class Prices:
                     region: PriceRegionName = PriceRegionName.DE, unit: PriceUnit = PriceUnit.CT_PER_KWH, evaluation: bool = False, hourly: bool = False,
                     timezone: str = DEFAULT_TIMEZONE, format: OutputFormat = OutputFormat.LONG):
         if region not in self.region_prices:
-            self.region_prices[region] = RegionPriceManager(region.to_region())
+            self.region_prices[region] = RegionPriceManager(region.to_region(), training_budget(region.value))
         
         await self.region_prices[region].ensure_loaded()
-        return await self.region_prices[region].prices(hours, surcharge, tax_percent, start_ts, unit, evaluation, hourly, timezone, format)
+        with deadline(PRICES_DEADLINE):
+            return await self.region_prices[region].prices(hours, surcharge, tax_percent, start_ts, unit, evaluation, hourly, timezone, format)
     
     async def get_price_manager(self, region: PriceRegionName):
         if region not in self.region_prices:
-            self.region_prices[region] = RegionPriceManager(region.to_region())
+            self.region_prices[region] = RegionPriceManager(region.to_region(), training_budget(region.value))
         
         await self.region_prices[region].ensure_loaded()
         return self.region_prices[region]
@@ -393,7 +482,7 @@ async def generate_evaluation_plot(
 
     # reuse the same data stores for a unified cache
     pricemanager = await prices_handler.get_price_manager(region)
-    await pricemanager.update_data_if_needed()
+    await pricemanager.update()
     orig_predictor = pricemanager.predictor
     
     predictor = pp.PricePredictor(region.to_region())
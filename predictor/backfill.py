@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+"""
+Fill the data directory with history for the given regions, e.g. before starting the API for the first time
+or after adding a new region:
+
+    EPEXPREDICTOR_DATADIR=./data python -m predictor.backfill --days 120 DE AT
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from predictor.model.pricepredictor import PricePredictor
+from predictor.model.priceregion import PriceRegionName
+
+
+async def backfill_region(region: PriceRegionName, data_dir: str, start: datetime, end: datetime):
+    predictor = await PricePredictor(region.to_region(), data_dir).load_from_persistence()
+    t = time.monotonic()
+    await predictor.backfill(start, end)
+    logging.info(f"{region.value}: backfill done in {time.monotonic() - t:.1f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill historical data for the given regions")
+    parser.add_argument("regions", nargs="*", default=[r.value for r in PriceRegionName], help="Regions to backfill. Default: all")
+    parser.add_argument("--days", type=int, default=120, help="How many days of history to fetch")
+    parser.add_argument("--forecast-days", type=int, default=7, help="How many days into the future to fetch")
+    parser.add_argument("--data-dir", default=os.getenv("EPEXPREDICTOR_DATADIR", "./data"), help="Data directory. Default: $EPEXPREDICTOR_DATADIR")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+        level=logging.INFO
+    )
+
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=args.days)
+    end = now + timedelta(days=args.forecast_days)
+    regions = [PriceRegionName(r) for r in args.regions]
+
+    await asyncio.gather(*[backfill_region(r, args.data_dir, start, end) for r in regions])
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,466 @@
+#!/usr/bin/python3
+"""
+Walk-forward backtest, with the days of all regions spread over a pool of processes instead of one event loop:
+
+    EPEXPREDICTOR_DATADIR=./data python -m predictor.backtest --workers 8 DE AT
+
+Every day from --start on, a model is trained on the --learn-days before it and predicts the next 3 days.
+Prices and gas prices after the training window are hidden, like in a real forecast.
+By default every day is trained from scratch, so days can be tested in any order. With --sequential, the days of a region
+are tested in order by one predictor configured like the service, which carries bins, boosting rounds and (with
+EPEXPREDICTOR_TRAINING_MODE=incremental) its model over to the next day. This is what performance_testing.py runs.
+With --features matrix (the default), each worker joins the data of a region into one feature matrix for the whole
+range and cuts the frames of every iteration out of it, instead of reading the stores with horizon_cutoff every time.
+
+Every finished day is appended to a results file (JSON lines, default backtest.jsonl in the data directory). A restarted
+run skips the days that are in there already, and --report prints the tables from it without training anything.
+"""
+
+import argparse
+import asyncio
+import dataclasses
+import json
+import logging
+import math
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+import pandas as pd
+
+from predictor.model.featurematrix import FullRangeFeatures
+from predictor.model.pricepredictor import PricePredictor, feature_start
+from predictor.model.priceregion import PriceRegionName
+from predictor.model.slotgrid import slot_range, to_slot
+from predictor.model.training import Binning
+
+log = logging.getLogger(__name__)
+
+START = datetime.fromisoformat("2025-05-15T00:00:00Z")
+END = datetime.fromisoformat("2026-05-15T00:00:00Z")
+LEARN_DAYS = 120
+# days predicted after every training, errors are reported per day
+HORIZON_DAYS = 3
+
+
+@dataclasses.dataclass
+class Iteration:
+    """
+    Errors of one day of the backtest: model trained up to learn_end, prediction for the HORIZON_DAYS after it
+    """
+
+    region: str
+    learn_end: datetime
+    # per predicted day
+    mae: list[float]
+    mse: list[float]
+    train_seconds: float
+    predict_seconds: float
+    # the model: days and rows of training data, features and boosting rounds
+    learn_days: int
+    rows: int
+    features: int
+    rounds: int
+    # trained in order by one predictor, see backtest_predictor()
+    sequential: bool = False
+
+    def to_json(self) -> str:
+        return json.dumps(dataclasses.asdict(self) | {"learn_end": self.learn_end.isoformat()})
+
+    @staticmethod
+    def from_json(line: str) -> "Iteration":
+        fields = json.loads(line)
+        return Iteration(**(fields | {"learn_end": datetime.fromisoformat(fields["learn_end"])}))
+
+
+@dataclasses.dataclass
+class Summary:
+    region: str
+    iterations: int
+    # per predicted day. RMSE is the root of the mean of the daily MSEs
+    mae: list[float]
+    rmse: list[float]
+    train_seconds: float
+
+
+def learn_ends(start: datetime, end: datetime) -> list[datetime]:
+    """
+    End of the training window of every iteration: daily from start, as long as the predicted days end before end
+    """
+    days = []
+    learn_end = start
+    while learn_end < end - timedelta(days=HORIZON_DAYS):
+        days.append(learn_end)
+        learn_end += timedelta(days=1)
+    return days
+
+def shards(days: list[datetime], shard_days: int) -> list[list[datetime]]:
+    """
+    Consecutive days, so a worker's feature matrix only moves by a day between iterations
+    """
+    return [days[i:i + shard_days] for i in range(0, len(days), shard_days)]
+
+
+async def prefetch(region: PriceRegionName, data_dir: str, start: datetime, end: datetime):
+    """
+    Fetch everything the backtest needs once. The stores persist what they fetched, so the workers find it in the data
+    directory and don't fetch anything themselves
+    """
+    predictor = await PricePredictor(region.to_region(), data_dir).load_from_persistence()
+    await asyncio.gather(*[store.get_data(start, end) for store in predictor.datastores().values()])
+
+
+def backtest_predictor(region: PriceRegionName, data_dir: str, sequential: bool = False) -> PricePredictor:
+    """
+    Predictor for backtests. Every iteration is a full fit with its own bins and round search, so its result doesn't
+    depend on the days tested before it, or on how the days are split up between workers.
+    sequential: configured like the service instead, for testing all days of a region in order
+    """
+    if sequential:
+        return PricePredictor(region.to_region(), data_dir)
+    predictor = PricePredictor(region.to_region(), data_dir, training_mode="full")
+    predictor.binning = Binning(rebin_days=0)
+    return predictor
+
+async def build_features(predictor: PricePredictor, start: datetime, end: datetime) -> FullRangeFeatures:
+    """
+    Feature matrix of everything the iterations between start and end read
+    """
+    start = feature_start(start)
+    stores = predictor.feature_stores()
+    slots = await asyncio.gather(*[store.get_slots(start, end) for store in stores.values()])
+    return FullRangeFeatures(dict(zip(stores, slots)), *slot_range(start, end))
+
+def cut(features: FullRangeFeatures, actual_start: datetime, end: datetime, cutoff: datetime | None) -> pd.DataFrame:
+    """
+    prepare_dataframe(actual_start, end) from the matrix, with prices and gas prices after cutoff hidden like horizon_cutoff does
+    """
+    first, last = slot_range(feature_start(actual_start), end)
+    return features.frame(first, last, slot_range(actual_start, end)[0], to_slot(cutoff) + 1 if cutoff is not None else None)
+
+def windows(learn_days: int, learn_end: datetime) -> tuple[tuple[datetime, datetime], tuple[datetime, datetime]]:
+    """
+    Training and prediction range of an iteration
+    """
+    return ((learn_end - timedelta(days=learn_days), learn_end - timedelta(minutes=15)), # exclusive last
+            (learn_end, learn_end + timedelta(days=HORIZON_DAYS)))
+
+
+async def run_iteration(region: PriceRegionName, predictor: PricePredictor, learn_days: int, learn_end: datetime,
+                        features: FullRangeFeatures | None = None, sequential: bool = False) -> Iteration:
+    """
+    Train on the learn_days before learn_end and compare the prediction of the following days with the actual prices.
+    Features from the stores, or cut out of features. sequential: continue from the previous day's training
+    """
+    days = [learn_end + timedelta(days=i) for i in range(HORIZON_DAYS + 1)]
+    train, predict = windows(learn_days, learn_end)
+    if not sequential:
+        predictor.rounds = None
+
+    if features is None:
+        # Make sure training/prediction doesn't "cheat" with data that is known during backtesting, but not for actual forecasts
+        predictor.pricestore.horizon_cutoff = learn_end
+        predictor.gasstore.horizon_cutoff = learn_end
+        await predictor.train(*train)
+        started = time.perf_counter()
+        prediction = await predictor.predict(*predict, False)
+        predict_seconds = time.perf_counter() - started
+        predictor.pricestore.horizon_cutoff = None
+        predictor.gasstore.horizon_cutoff = None
+        actual = await predictor.pricestore.get_data(*predict)
+    else:
+        await predictor.fit(cut(features, *train, learn_end))
+        started = time.perf_counter()
+        prediction = await predictor.predict_features(cut(features, *predict, learn_end), False)
+        predict_seconds = time.perf_counter() - started
+        actual = cut(features, *predict, None)
+    assert predictor.predictor is not None and predictor.traindata is not None
+
+    # windows include both ends, like the original performance test
+    errors = [actual.loc[a:b]["price"] - prediction.loc[a:b]["price"] for a, b in zip(days, days[1:])]
+    return Iteration(
+        region=region.value,
+        learn_end=learn_end,
+        mae=[float(e.abs().mean()) for e in errors],
+        mse=[float(e.pow(2).mean()) for e in errors],
+        train_seconds=predictor.last_fit_seconds or 0.0,
+        predict_seconds=predict_seconds,
+        learn_days=learn_days,
+        rows=len(predictor.traindata),
+        features=predictor.predictor.num_feature(),
+        rounds=predictor.predictor.num_trees(),
+        sequential=sequential,
+    )
+
+async def check_leakage(predictor: PricePredictor, features: FullRangeFeatures, learn_days: int, learn_end: datetime):
+    """
+    Make sure the frames cut out of the matrix are exactly what the stores give with horizon_cutoff at learn_end -
+    nothing the forecast couldn't know at that time, and nothing missing. RuntimeError if not
+    """
+    for window in windows(learn_days, learn_end):
+        predictor.pricestore.horizon_cutoff = learn_end
+        predictor.gasstore.horizon_cutoff = learn_end
+        try:
+            expected = await predictor.prepare_dataframe(*window)
+        finally:
+            predictor.pricestore.horizon_cutoff = None
+            predictor.gasstore.horizon_cutoff = None
+        if expected is None or not cut(features, *window, learn_end).equals(expected):
+            raise RuntimeError(f"{predictor.region.bidding_zone_entsoe}: precomputed features of {window[0]} - {window[1]} "
+                               f"differ from the stores with horizon_cutoff {learn_end}")
+
+
+def load_results(path: str) -> list[Iteration]:
+    """
+    Iterations stored in a results file, the last one per region and day. A line cut off by a crash is skipped
+    """
+    results: dict[tuple[str, datetime], Iteration] = {}
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        for n, line in enumerate(f, 1):
+            try:
+                it = Iteration.from_json(line)
+            except (ValueError, TypeError, KeyError):
+                log.warning(f"{path}:{n}: skipping incomplete result")
+                continue
+            results[(it.region, it.learn_end)] = it
+    return list(results.values())
+
+def select(iterations: list[Iteration], regions: list[PriceRegionName], start: datetime, end: datetime) -> list[Iteration]:
+    """
+    Iterations of regions for the days a backtest from start to end tests, sorted by region and day
+    """
+    order = [region.value for region in regions]
+    days = set(learn_ends(start, end))
+    return sorted((it for it in iterations if it.region in order and it.learn_end in days),
+                  key=lambda it: (order.index(it.region), it.learn_end))
+
+def stored_results(path: str, regions: list[PriceRegionName], start: datetime, end: datetime, learn_days: int,
+                   sequential: bool = False) -> list[Iteration]:
+    """
+    The iterations of a backtest with these arguments that are in the results file, for reporting
+    """
+    return [it for it in select(load_results(path), regions, start, end) if it.learn_days == learn_days and it.sequential == sequential]
+
+def end_last_line(path: str):
+    """
+    Make sure the next result starts on a new line, after a crash in the middle of writing one
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+def append_result(path: str, it: Iteration):
+    # one write per line, so lines of concurrent workers don't mix
+    with open(path, "a") as f:
+        f.write(it.to_json() + "\n")
+
+
+async def run_days(region: PriceRegionName, predictor: PricePredictor, learn_days: int, days: list[datetime],
+                   features: FullRangeFeatures | None = None, results: str | None = None, sequential: bool = False) -> list[Iteration]:
+    """
+    Iterations of days, each one appended to the results file as soon as it is done
+    """
+    if features is not None and len(days) > 0:
+        await check_leakage(predictor, features, learn_days, days[0])
+    iterations = []
+    for learn_end in days:
+        it = await run_iteration(region, predictor, learn_days, learn_end, features, sequential)
+        if results is not None:
+            append_result(results, it)
+        iterations.append(it)
+    return iterations
+
+
+# worker process state: its event loop, and per region a predictor and feature matrix that are loaded once and used for all its shards
+_worker_loop: asyncio.AbstractEventLoop | None = None
+_worker_regions: dict[tuple[PriceRegionName, str, bool], tuple[PricePredictor, FullRangeFeatures | None]] = {}
+
+def _init_worker(level: int):
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', level=level)
+
+def run_shard(region: PriceRegionName, data_dir: str, learn_days: int, days: list[datetime],
+              feature_range: tuple[datetime, datetime] | None, results: str | None, sequential: bool = False) -> list[Iteration]:
+    """
+    run_days() in a worker process. feature_range: range of the feature matrix, None to read the stores every iteration
+    """
+    global _worker_loop
+    if _worker_loop is None:
+        _worker_loop = asyncio.new_event_loop()
+
+    async def run() -> list[Iteration]:
+        key = (region, data_dir, sequential)
+        if key not in _worker_regions:
+            predictor = await backtest_predictor(region, data_dir, sequential).load_from_persistence()
+            features = await build_features(predictor, *feature_range) if feature_range is not None else None
+            _worker_regions[key] = (predictor, features)
+        predictor, features = _worker_regions[key]
+        return await run_days(region, predictor, learn_days, days, features, results, sequential)
+    return _worker_loop.run_until_complete(run())
+
+
+@contextmanager
+def split_cores(processes: int) -> Iterator[None]:
+    """
+    Worker processes started in this context share the cores instead of each one using all of them: they inherit the
+    environment, and read their CPU budget and pool size from it. Settings made by the user are kept
+    """
+    split = {"EPEXPREDICTOR_CPU_CORES": str(max(1, (os.cpu_count() or 1) // processes)), "EPEXPREDICTOR_CPU_WORKERS": "1"}
+    added = [name for name in split if name not in os.environ]
+    os.environ.update({name: split[name] for name in added})
+    try:
+        yield
+    finally:
+        for name in added:
+            os.environ.pop(name, None)
+
+
+async def backtest(regions: list[PriceRegionName], data_dir: str, start: datetime = START, end: datetime = END,
+                   learn_days: int = LEARN_DAYS, workers: int = os.cpu_count() or 1, shard_days: int = 30,
+                   precompute: bool = True, results: str | None = None, sequential: bool = False) -> list[Iteration]:
+    """
+    All iterations of all regions, sorted by region and day. Shards of shard_days days run in workers processes.
+    precompute: cut the features out of one matrix per region, see FullRangeFeatures.
+    results: file to append finished iterations to. Days that are in there already are taken from it instead of tested again.
+    sequential: test the days of a region in order in one process, see backtest_predictor()
+    """
+    order = [region.value for region in regions]
+    days = learn_ends(start, end)
+    stored = select(load_results(results), regions, start, end) if results is not None else []
+    if any(it.learn_days != learn_days for it in stored):
+        raise ValueError(f"{results} has results with other training windows than {learn_days} days, use another results file")
+    if any(it.sequential != sequential for it in stored):
+        raise ValueError(f"{results} has results of {'independent' if sequential else 'sequential'} days, use another results file")
+    done = {(it.region, it.learn_end) for it in stored}
+    if sequential:
+        # every day depends on the ones before it: regions with days missing are tested again from the start
+        stored = [it for it in stored if all((it.region, day) in done for day in days)]
+        done = {(it.region, it.learn_end) for it in stored}
+    if results is not None:
+        end_last_line(results)
+    if len(done) > 0:
+        log.info(f"{len(done)} iterations done already, see {results}")
+
+    learn_start = start - timedelta(days=learn_days)
+    todo = [region for region in regions if any((region.value, day) not in done for day in days)]
+    await asyncio.gather(*[prefetch(region, data_dir, learn_start, end) for region in todo])
+    feature_range = (learn_start, end) if precompute else None
+
+    # regions interleaved, so all of them make progress
+    if sequential:
+        shard_days = max(len(days), 1)
+    parts = {region: shards([day for day in days if (region.value, day) not in done], shard_days) for region in todo}
+    jobs = [(region, part[i]) for i in range(max((len(part) for part in parts.values()), default=0))
+            for region, part in parts.items() if i < len(part)]
+    total = sum(len(part) for _, part in jobs)
+    tested: list[Iteration] = []
+    loop = asyncio.get_running_loop()
+    started = time.monotonic()
+    with split_cores(max(1, min(workers, len(jobs)))), \
+            ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                initializer=_init_worker, initargs=(logging.getLogger().getEffectiveLevel(),)) as pool:
+        futures = [loop.run_in_executor(pool, run_shard, region, data_dir, learn_days, part, feature_range, results, sequential)
+                   for region, part in jobs]
+        for future in asyncio.as_completed(futures):
+            tested += await future
+            elapsed = time.monotonic() - started
+            log.info(f"{len(tested)}/{total} iterations done, {len(tested) / elapsed:.2f} iterations/s")
+    if total > 0:
+        elapsed = time.monotonic() - started
+        log.info(f"{total} iterations in {elapsed:.0f}s: {total / elapsed:.2f} iterations/s with {workers} workers")
+
+    iterations = stored + tested
+    iterations.sort(key=lambda it: (order.index(it.region), it.learn_end))
+    return iterations
+
+
+def summarize(iterations: list[Iteration]) -> list[Summary]:
+    """
+    Mean errors per region and predicted day, regions in the order they first appear
+    """
+    by_region: dict[str, list[Iteration]] = defaultdict(list)
+    for it in iterations:
+        by_region[it.region].append(it)
+
+    summaries = []
+    for region, its in by_region.items():
+        n = len(its)
+        summaries.append(Summary(
+            region=region,
+            iterations=n,
+            mae=[sum(it.mae[day] for it in its) / n for day in range(HORIZON_DAYS)],
+            rmse=[math.sqrt(sum(it.mse[day] for it in its) / n) for day in range(HORIZON_DAYS)],
+            train_seconds=sum(it.train_seconds for it in its) / n,
+        ))
+    return summaries
+
+def print_report(summaries: list[Summary]):
+    """
+    Errors per predicted day for every region, the 1-day table of the README and all days in one table
+    """
+    for s in summaries:
+        print(f"{s.region}: iterations tested: {s.iterations}")
+        for day in range(HORIZON_DAYS):
+            print(f"{day + 1}d: RMSE={round(s.rmse[day], 2)}, MAE={round(s.mae[day], 2)}")
+        print(f"training: {round(s.train_seconds, 2)}s on average")
+    print()
+    print("Results (1-day ahead prediction):")
+    print("| Region | MAE (ct/kWh) | RMSE (ct/kWh) |")
+    print("|--------|--------------|---------------|")
+    for s in summaries:
+        print(f"| {s.region.ljust(6)} | {str(round(s.mae[0], 2)).ljust(12)} | {str(round(s.rmse[0], 2)).ljust(13)} |")
+    print()
+    days = range(1, HORIZON_DAYS + 1)
+    print("| Region | " + " | ".join(f"{d}d MAE | {d}d RMSE" for d in days) + " | Training (s) |")
+    print("|--------|" + "|".join("--------|---------" for _ in days) + "|--------------|")
+    for s in summaries:
+        errors = " | ".join(f"{str(round(mae, 2)).ljust(6)} | {str(round(rmse, 2)).ljust(7)}" for mae, rmse in zip(s.mae, s.rmse))
+        print(f"| {s.region.ljust(6)} | {errors} | {str(round(s.train_seconds, 2)).ljust(12)} |")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Walk-forward backtest of the given regions")
+    parser.add_argument("regions", nargs="*", default=[r.value for r in PriceRegionName], help="Regions to test. Default: all")
+    parser.add_argument("--start", type=datetime.fromisoformat, default=START, help="First day to predict (ISO date, UTC)")
+    parser.add_argument("--end", type=datetime.fromisoformat, default=END, help="End of the tested range (ISO date, UTC)")
+    parser.add_argument("--learn-days", type=int, default=LEARN_DAYS, help="Days of training data")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes. Default: one per core")
+    parser.add_argument("--shard-days", type=int, default=30, help="Consecutive days a worker tests at once")
+    parser.add_argument("--features", choices=["matrix", "stores"], default="matrix",
+                        help="Cut features out of one precomputed matrix per region, or read the stores every iteration")
+    parser.add_argument("--sequential", action="store_true",
+                        help="Test the days of a region in order, carrying bins, rounds and incremental models over like the service")
+    parser.add_argument("--data-dir", default=os.getenv("EPEXPREDICTOR_DATADIR", "./data"), help="Data directory. Default: $EPEXPREDICTOR_DATADIR")
+    parser.add_argument("--results", help="Results file, finished days are skipped. Default: backtest.jsonl in the data directory")
+    parser.add_argument("--report", action="store_true", help="Only print the tables of the results file, for the given regions, days and training window")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+        level=logging.INFO
+    )
+
+    results = args.results or os.path.join(args.data_dir, "backtest.jsonl")
+    regions = [PriceRegionName(r) for r in args.regions]
+    start, end = (d if d.tzinfo is not None else d.replace(tzinfo=timezone.utc) for d in (args.start, args.end))
+    if args.report:
+        print_report(summarize(stored_results(results, regions, start, end, args.learn_days, args.sequential)))
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(results)), exist_ok=True)
+    iterations = await backtest(regions, args.data_dir, start, end, args.learn_days, args.workers, args.shard_days,
+                                args.features == "matrix", results, args.sequential)
+    print_report(summarize(iterations))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,228 @@
+#!/usr/bin/python3
+"""
+Micro benchmarks for data shaping hot paths, comparing against the previous implementations in tests/legacy.py.
+Run from a checkout of the repository:
+
+    python -m predictor.benchmarks
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from predictor.model.datastore import DataSnapshot, DataStore
+from predictor.model.entsoedatastore import shape_load_forecast
+from predictor.model.featurematrix import FeatureMatrix, FullRangeFeatures
+from predictor.model.gaspricestore import extract_gas_prices
+from predictor.model.priceregion import PriceRegionName
+from predictor.model.pricepredictor import PricePredictor, assemble_features
+from predictor.model.slotgrid import SlotFrame, slot_range, to_slot
+from predictor.model.training import LGB_PARAMS
+from predictor.model.treeinference import FlatForest, compile_forest
+from tests.legacy import assemble_features_concat, daily_load_forecast, parse_gas_prices_regex, shape_load_forecast_rowwise, store_frames
+
+GAS_PAGE = Path(__file__).parent.parent / "tests" / "fixtures" / "bnetza_gaspreise.html"
+
+
+def timeit(func: Callable, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def report(name: str, legacy: float, current: float):
+    print(f"{name:<30} legacy {legacy * 1000:9.1f}ms   current {current * 1000:9.1f}ms   speedup {legacy / current:6.1f}x")
+
+
+def bench_load_shaping(days: int, repeat: int):
+    load = daily_load_forecast(days)
+    pd.testing.assert_series_equal(shape_load_forecast(load), shape_load_forecast_rowwise(load))
+    report(f"load shaping ({days} days)", timeit(lambda: shape_load_forecast_rowwise(load), repeat), timeit(lambda: shape_load_forecast(load), repeat))
+
+
+def bench_gas_extraction(page: Path, repeat: int):
+    html = page.read_text()
+    pd.testing.assert_frame_equal(extract_gas_prices(html), parse_gas_prices_regex(html), check_freq=False)
+    report(f"gas price page ({len(html) // 1024} KiB)", timeit(lambda: parse_gas_prices_regex(html), repeat), timeit(lambda: extract_gas_prices(html), repeat))
+
+
+def bench_feature_assembly(days: int, repeat: int):
+    frames = store_frames(days)
+    # snapshots keep their slot frames, so conversion is not part of the assembly
+    slots = {name: SlotFrame.from_frame(df) for name, df in frames.items()}
+    start = frames["weather"].index[0].to_pydatetime()
+    end = frames["weather"].index[-1].to_pydatetime()
+    actual_start = start + pd.Timedelta(days=14)
+
+    def legacy():
+        return assemble_features_concat(frames["weather"], frames["aux"], frames["entsoe"], frames["gas"], frames["prices"], actual_start)
+
+    def current():
+        first, last = slot_range(start, end)
+        return assemble_features(slots["weather"], slots["aux"], slots["entsoe"], slots["gas"], slots["prices"], first, last, slot_range(actual_start, end)[0])
+
+    pd.testing.assert_frame_equal(current(), legacy(), check_freq=False)
+    report(f"feature assembly ({days} days)", timeit(legacy, repeat), timeit(current, repeat))
+
+
+class MemoryStore(DataStore):
+    """
+    Store without upstream, holds whatever snapshot it is given
+    """
+
+    async def fetch_missing_data(self, start: datetime, end: datetime) -> bool:
+        return False
+
+
+def bench_incremental_features(days: int, repeat: int):
+    frames = store_frames(days)
+    region = PriceRegionName.DE.to_region()
+    stores = {name: MemoryStore(region) for name in frames}
+    for name, store in stores.items():
+        store.data = frames[name]
+    start = frames["weather"].index[0].to_pydatetime()
+    end = frames["weather"].index[-1].to_pydatetime()
+    first, last = slot_range(start, end)
+    output_first = slot_range(start + pd.Timedelta(days=14), end)[0]
+
+    # every training sees a new weather forecast for the last two days. Snapshots are prepared up front, so only
+    # the assembly is timed
+    weather = stores["weather"]
+    forecast = weather.data.index[-1] - pd.Timedelta(days=2)
+    changed = (to_slot(forecast), last)
+    snapshots = []
+    for i in range(2 * repeat + 2):
+        df = weather.data.copy()
+        df.loc[forecast:] += i
+        snapshot = DataSnapshot(weather.snapshot.version + i + 1, df, ((weather.snapshot.version + i + 1, *changed),))
+        snapshot.slots
+        snapshots.append(snapshot)
+    updates = iter(snapshots)
+
+    def read() -> tuple[dict[str, int], dict[str, SlotFrame]]:
+        weather.snapshot = next(updates)
+        return ({name: store.snapshot.version for name, store in stores.items()},
+                {name: store.snapshot.slots.slice(first, last) for name, store in stores.items()})
+
+    def full():
+        _, slots = read()
+        return assemble_features(slots["weather"], slots["aux"], slots["entsoe"], slots["gas"], slots["prices"], first, last, output_first)
+
+    matrix = FeatureMatrix()
+
+    def incremental():
+        return matrix.update(stores, *read(), first, last, output_first)
+
+    incremental()
+    pd.testing.assert_frame_equal(incremental(), assemble_features(*(stores[name].snapshot.slots.slice(first, last) for name in ("weather", "aux", "entsoe", "gas", "prices")), first, last, output_first))
+    report(f"retrain features ({days} days)", timeit(full, repeat), timeit(incremental, repeat))
+
+
+def bench_dataset_binning(days: int, repeat: int):
+    frames = store_frames(days)
+    slots = {name: SlotFrame.from_frame(df) for name, df in frames.items()}
+    first, last = slot_range(frames["weather"].index[0].to_pydatetime(), frames["prices"].index[-1].to_pydatetime())
+    traindata = assemble_features(slots["weather"], slots["aux"], slots["entsoe"], slots["gas"], slots["prices"], first, last, first).dropna()
+    features, labels = traindata.drop(columns=["price"]), traindata["price"]
+    params = LGB_PARAMS | {"num_threads": 1}
+    # bins of the previous day's training
+    reference = lgb.Dataset(features.iloc[:-96], label=labels.iloc[:-96], params=params).construct()
+
+    def binned():
+        return lgb.Dataset(features, label=labels, params=params).construct()
+
+    def with_reference():
+        return lgb.Dataset(features, label=labels, params=params, reference=reference).construct()
+
+    report(f"training dataset ({days} days)", timeit(binned, repeat), timeit(with_reference, repeat))
+
+
+def bench_tree_inference(days: int, repeat: int):
+    frames = store_frames(days)
+    slots = {name: SlotFrame.from_frame(df) for name, df in frames.items()}
+    first, last = slot_range(frames["weather"].index[0].to_pydatetime(), frames["weather"].index[-1].to_pydatetime())
+    features = assemble_features(slots["weather"], slots["aux"], slots["entsoe"], slots["gas"], slots["prices"], first, last, first)
+    traindata = features.dropna()
+    booster = lgb.train(LGB_PARAMS | {"num_threads": 1}, lgb.Dataset(traindata.drop(columns=["price"]), label=traindata["price"]))
+    compiled = asyncio.run(compile_forest(FlatForest.from_booster(booster)))
+    params = features.drop(columns=["price"])
+
+    def legacy():
+        return booster.predict(params, num_threads=1)
+
+    def current():
+        return compiled.predict(params.to_numpy(dtype=np.float64))
+
+    np.testing.assert_array_equal(current(), legacy())
+    report(f"prediction ({days} days)", timeit(legacy, repeat), timeit(current, repeat))
+
+
+def bench_backtest_features(days: int, repeat: int):
+    frames = store_frames(days)
+    predictor = PricePredictor(PriceRegionName.AT.to_region())
+    for name, df in frames.items():
+        store = MemoryStore(predictor.region)
+        store.data = df
+        setattr(predictor, {"weather": "weatherstore", "aux": "auxstore", "entsoe": "entsoestore", "gas": "gasstore", "prices": "pricestore"}[name], store)
+    start = frames["weather"].index[0]
+    learn_days = days - 21
+    # consecutive days like the iterations of a worker: cutoff, training and prediction window
+    iterations = []
+    for i in range(repeat + 1):
+        learn_end = start + pd.Timedelta(days=learn_days + i)
+        iterations.append((learn_end, (learn_end - pd.Timedelta(days=learn_days), learn_end - pd.Timedelta(minutes=15)), (learn_end, learn_end + pd.Timedelta(days=3))))
+
+    async def read_stores(learn_end, train, predict) -> list[pd.DataFrame | None]:
+        predictor.pricestore.horizon_cutoff = predictor.gasstore.horizon_cutoff = learn_end
+        traindata, _ = await predictor.prepare_versioned_dataframe(*train, predictor.trainfeatures)
+        features = await predictor.prepare_dataframe(*predict)
+        predictor.pricestore.horizon_cutoff = predictor.gasstore.horizon_cutoff = None
+        return [traindata, features]
+
+    async def legacy() -> float:
+        best = float("inf")
+        for iteration in iterations[1:]:
+            t = time.perf_counter()
+            await read_stores(*iteration)
+            best = min(best, time.perf_counter() - t)
+        return best
+
+    matrix = FullRangeFeatures({name: SlotFrame.from_frame(df) for name, df in frames.items()}, *slot_range(start, frames["weather"].index[-1]))
+    current_iterations = iter(iterations[1:])
+
+    def current(learn_end, train, predict) -> list[pd.DataFrame]:
+        return [matrix.frame(*slot_range(*window), slot_range(*window)[0], to_slot(learn_end) + 1) for window in (train, predict)]
+
+    for expected, result in zip(asyncio.run(read_stores(*iterations[0])), current(*iterations[0])):
+        pd.testing.assert_frame_equal(result, expected)
+    report(f"backtest features ({learn_days} days)", asyncio.run(legacy()), timeit(lambda: current(*next(current_iterations)), repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run micro benchmarks")
+    parser.add_argument("--days", type=int, default=120, help="Size of the benchmarked range in days")
+    parser.add_argument("--gas-page", type=Path, default=GAS_PAGE, help="Saved copy of the Bundesnetzagentur gas price page")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per benchmark, best one counts")
+    args = parser.parse_args()
+
+    bench_load_shaping(args.days, args.repeat)
+    bench_gas_extraction(args.gas_page, args.repeat)
+    bench_feature_assembly(args.days, args.repeat)
+    bench_incremental_features(args.days, args.repeat)
+    bench_dataset_binning(args.days, args.repeat)
+    bench_tree_inference(args.days, args.repeat)
+    bench_backtest_features(args.days, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,396 @@
+#!/usr/bin/python3
+"""
+Local stand-in for all upstream data sources (energy-charts, Open-Meteo, ENTSO-E, bundesnetzagentur.de), serving synthetic
+data in each provider's wire format. For offline development and load testing of the whole service on one machine:
+
+    python -m predictor.fakeupstream --port 8900 --latency 0.2 --error-rate 0.05
+
+and start the API with the environment variables printed on startup.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import random
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta, timezone
+from typing import Callable
+from xml.sax.saxutils import escape
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pandas as pd
+from aiohttp import web
+from entsoe.mappings import Area
+
+log = logging.getLogger(__name__)
+
+# day-ahead market and gas prices run on CET
+MARKET_TZ = ZoneInfo("Europe/Berlin")
+
+GAS_PAGE_PATH = "/DE/Gasversorgung/aktuelle_gasversorgung/_svg/Gaspreise/Gaspreise.html"
+
+
+@dataclass
+class FakeUpstreamConfig:
+    # seconds added to every response, plus up to jitter seconds
+    latency: float = 0.0
+    jitter: float = 0.0
+    # fraction of requests answered with 503
+    error_rate: float = 0.0
+    # day-ahead prices for tomorrow appear at this local time
+    publication_time: time = time(13, 0)
+    weather_horizon_days: int = 16
+    load_horizon_days: int = 7
+    seed: int = 0
+
+
+def _noise(key: str, slots: np.ndarray, seed: int) -> np.ndarray:
+    """
+    Deterministic pseudo random noise in [-1, 1) per key and time slot, so repeated queries see the same data
+    """
+    h = int.from_bytes(hashlib.sha256(f"{seed}:{key}".encode()).digest()[:4], "little")
+    x = (slots.astype(np.uint64) * np.uint64(2654435761) + np.uint64(h)) % np.uint64(2**32)
+    x = (x ^ (x >> np.uint64(13))) * np.uint64(1274126177) % np.uint64(2**32)
+    return x.astype(np.float64) / 2**31 - 1
+
+
+def _wind(ts: np.ndarray, lat: float, seed: int) -> np.ndarray:
+    """Wind speed in km/h at 80m, ts in epoch seconds"""
+    days = ts / 86400
+    return np.clip(18 + 10 * np.sin(2 * math.pi * days / 3.3 + lat) + 4 * _noise(f"wind{lat}", ts // 900, seed), 0, None)
+
+def _irradiance(ts: np.ndarray) -> np.ndarray:
+    days = ts / 86400
+    season = 0.6 + 0.4 * np.cos(2 * math.pi * (days - 172) / 365.25)
+    return np.clip(700 * season * np.sin(2 * math.pi * (days % 1 - 0.25)), 0, None)
+
+
+def _to_ts(index: pd.DatetimeIndex) -> np.ndarray:
+    return index.as_unit("s").asi8
+
+
+class FakeUpstream:
+    """
+    aiohttp application serving all upstream APIs. All data is generated on the fly from the request time range.
+    """
+
+    config: FakeUpstreamConfig
+    clock: Callable[[], datetime]
+    requests: Counter
+    rng: random.Random
+
+    def __init__(self, config: FakeUpstreamConfig | None = None, clock: Callable[[], datetime] | None = None):
+        self.config = config or FakeUpstreamConfig()
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+        self.requests = Counter()
+        self.rng = random.Random(self.config.seed)
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get("/price", self.energycharts_price)
+        app.router.add_get("/v1/forecast", self.openmeteo_forecast)
+        app.router.add_get("/api", self.entsoe_api)
+        app.router.add_get(GAS_PAGE_PATH, self.gas_page)
+        return app
+
+    @staticmethod
+    def env(base_url: str) -> dict[str, str]:
+        """
+        Environment variables pointing the service to a fake upstream running at base_url
+        """
+        return {
+            "EPEXPREDICTOR_ENERGYCHARTS_URL": base_url,
+            "EPEXPREDICTOR_OPENMETEO_URL": base_url,
+            "EPEXPREDICTOR_OPENMETEO_HISTORY_URL": base_url,
+            "EPEXPREDICTOR_ENTSOE_URL": f"{base_url}/api",
+            "EPEXPREDICTOR_GASPRICE_URL": f"{base_url}{GAS_PAGE_PATH}",
+        }
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.requests[request.path] += 1
+        if self.config.latency > 0 or self.config.jitter > 0:
+            await asyncio.sleep(self.config.latency + self.rng.random() * self.config.jitter)
+        if self.rng.random() < self.config.error_rate:
+            return web.Response(status=503, text="Service Unavailable")
+        return await handler(request)
+
+
+    ##### publication schedule
+
+    def published_until(self) -> datetime:
+        """
+        End of the last day with published day-ahead prices (UTC)
+        """
+        now = self.clock().astimezone(MARKET_TZ)
+        days = 2 if now.time() >= self.config.publication_time else 1
+        return (now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=days)).astimezone(timezone.utc)
+
+    def day_ahead_prices(self, zone: str, start: datetime, end: datetime) -> pd.Series:
+        """
+        15 minute prices in EUR/MWh for [start, end), limited to what is published
+        """
+        end = min(end, self.published_until())
+        index = pd.date_range(pd.Timestamp(start).ceil("15min"), end, freq="15min")
+        index = index[index < end] # inclusive="left" still returns start if start == end
+        if len(index) == 0:
+            return pd.Series(dtype=np.float64)
+        ts = _to_ts(index)
+        hour = ((ts % 86400) / 3600 + 1) % 24 # roughly local time
+        daily = 25 * np.exp(-((hour - 8) ** 2) / 6) + 35 * np.exp(-((hour - 19) ** 2) / 5) - 30 * np.exp(-((hour - 13) ** 2) / 8) * (_irradiance(ts) / 700)
+        prices = 85 + daily - 2.5 * (_wind(ts, 51.0, self.config.seed) - 18) + 8 * _noise(f"price{zone}", ts // 900, self.config.seed)
+        return pd.Series(np.round(prices, 2), index=index)
+
+
+    ##### energy-charts
+
+    async def energycharts_price(self, request: web.Request) -> web.Response:
+        start = datetime.fromisoformat(request.query["start"])
+        end = datetime.fromisoformat(request.query["end"])
+        prices = self.day_ahead_prices(request.query["bzn"], start, end)
+        if len(prices) == 0:
+            return web.json_response({"detail": "no content available"}, status=404)
+        return web.json_response({
+            "license_info": "CC BY 4.0 (creativecommons.org/licenses/by/4.0) from Bundesnetzagentur | SMARD.de",
+            "unix_seconds": _to_ts(prices.index).tolist(),
+            "price": prices.tolist(),
+            "unit": "EUR / MWh",
+            "deprecated": False,
+        })
+
+
+    ##### Open-Meteo
+
+    async def openmeteo_forecast(self, request: web.Request) -> web.Response:
+        lats = [float(x) for x in request.query["latitude"].split(",")]
+        lons = [float(x) for x in request.query["longitude"].split(",")]
+        variables = request.query["minutely_15"].split(",")
+        start = pd.Timestamp(request.query["start_date"], tz="UTC")
+        end = pd.Timestamp(request.query["end_date"], tz="UTC") + timedelta(days=1)
+        index = pd.date_range(start, end, freq="15min", inclusive="left")
+        ts = _to_ts(index)
+        # no forecast beyond the horizon
+        available = ts < (self.clock() + timedelta(days=self.config.weather_horizon_days)).timestamp()
+
+        result = []
+        for lat, lon in zip(lats, lons):
+            days = ts / 86400
+            values = {
+                "wind_speed_80m": _wind(ts, lat, self.config.seed),
+                "temperature_2m": 10 - 8 * np.cos(2 * math.pi * (days - 15) / 365.25) - 4 * np.cos(2 * math.pi * (days % 1 - 0.125)) + 2 * _noise(f"temp{lat}", ts // 3600, self.config.seed),
+                "global_tilted_irradiance": _irradiance(ts),
+                "pressure_msl": 1013 + 12 * np.sin(2 * math.pi * days / 5.1 + lon),
+                "relative_humidity_2m": np.clip(70 + 20 * np.sin(2 * math.pi * days / 2.7 + lat) + 5 * _noise(f"hum{lat}", ts // 3600, self.config.seed), 0, 100),
+            }
+            fc = {
+                "latitude": lat,
+                "longitude": lon,
+                "generationtime_ms": 0.5,
+                "utc_offset_seconds": 0,
+                "timezone": "GMT",
+                "timezone_abbreviation": "GMT",
+                "elevation": 100.0,
+                "minutely_15_units": {"time": "iso8601"},
+                "minutely_15": {"time": index.strftime("%Y-%m-%dT%H:%M").tolist()},
+            }
+            for var in variables:
+                v = np.round(values.get(var, np.zeros(len(ts))), 1)
+                fc["minutely_15"][var] = [float(x) if ok else None for x, ok in zip(v, available)]
+            result.append(fc)
+
+        return web.json_response(result if len(result) > 1 else result[0])
+
+
+    ##### ENTSO-E
+
+    @staticmethod
+    def _area(code: str) -> Area:
+        return next(a for a in Area if a.code == code)
+
+    @staticmethod
+    def _fmt(dt: datetime) -> str:
+        return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%MZ")
+
+    def _acknowledgement(self, reason: str) -> web.Response:
+        now = self._fmt(self.clock())
+        xml = f"""<?xml version="1.0" encoding="utf-8"?>
+<Acknowledgement_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-1:acknowledgementdocument:7:0">
+	<mRID>fake</mRID>
+	<createdDateTime>{now}</createdDateTime>
+	<Reason>
+		<code>999</code>
+		<text>{escape(reason)}</text>
+	</Reason>
+</Acknowledgement_MarketDocument>"""
+        return web.Response(text=xml, content_type="application/xml")
+
+    @staticmethod
+    def _period(start: datetime, end: datetime, resolution: str, value_tag: str, values) -> str:
+        points = "".join(f"\n\t\t\t<Point>\n\t\t\t\t<position>{i + 1}</position>\n\t\t\t\t<{value_tag}>{v}</{value_tag}>\n\t\t\t</Point>" for i, v in enumerate(values))
+        return f"""
+		<Period>
+			<timeInterval>
+				<start>{FakeUpstream._fmt(start)}</start>
+				<end>{FakeUpstream._fmt(end)}</end>
+			</timeInterval>
+			<resolution>{resolution}</resolution>{points}
+		</Period>"""
+
+    async def entsoe_api(self, request: web.Request) -> web.Response:
+        q = request.query
+        if not q.get("securityToken"):
+            return web.Response(status=401, text="<html><body><h1>Unauthorized</h1></body></html>", content_type="text/html")
+        start = datetime.strptime(q["periodStart"], "%Y%m%d%H%M").replace(tzinfo=timezone.utc)
+        end = datetime.strptime(q["periodEnd"], "%Y%m%d%H%M").replace(tzinfo=timezone.utc)
+
+        if q.get("documentType") == "A44":
+            return self._entsoe_prices(self._area(q["in_Domain"]), start, end)
+        if q.get("documentType") == "A65" and q.get("processType") == "A31":
+            return self._entsoe_load(self._area(q["outBiddingZone_Domain"]), start, end)
+        return self._acknowledgement("Unsupported document type for this fake")
+
+    def _local_days(self, area: Area, start: datetime, end: datetime) -> list[tuple[datetime, datetime]]:
+        tz = ZoneInfo(area.tz)
+        day = start.astimezone(tz).replace(hour=0, minute=0, second=0, microsecond=0)
+        days = []
+        while day.astimezone(timezone.utc) < end:
+            nextday = day + timedelta(days=1) # wall time arithmetic -> next local midnight, also across DST changes
+            days.append((day.astimezone(timezone.utc), nextday.astimezone(timezone.utc)))
+            day = nextday
+        return days
+
+    def _entsoe_prices(self, area: Area, start: datetime, end: datetime) -> web.Response:
+        periods = []
+        for dstart, dend in self._local_days(area, start, end):
+            prices = self.day_ahead_prices(area.name, dstart, dend)
+            if len(prices) == 0 or prices.index[-1] < dend - timedelta(minutes=15):
+                continue
+            periods.append(self._period(dstart, dend, "PT15M", "price.amount", prices.tolist()))
+        if len(periods) == 0:
+            return self._acknowledgement(f"No matching data found for Data item Day-ahead Prices [12.1.D] ({area.code}, {area.code}) and interval {start.isoformat()}/{end.isoformat()}.")
+
+        series = "".join(f"""
+	<TimeSeries>
+		<mRID>{i + 1}</mRID>
+		<auction.type>A01</auction.type>
+		<businessType>A62</businessType>
+		<in_Domain.mRID codingScheme="A01">{area.code}</in_Domain.mRID>
+		<out_Domain.mRID codingScheme="A01">{area.code}</out_Domain.mRID>
+		<contract_MarketAgreement.type>A01</contract_MarketAgreement.type>
+		<currency_Unit.name>EUR</currency_Unit.name>
+		<price_Measure_Unit.name>MWH</price_Measure_Unit.name>
+		<curveType>A01</curveType>{period}
+	</TimeSeries>""" for i, period in enumerate(periods))
+        xml = f"""<?xml version="1.0" encoding="utf-8"?>
+<Publication_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-3:publicationdocument:7:3">
+	<mRID>fake</mRID>
+	<revisionNumber>1</revisionNumber>
+	<type>A44</type>
+	<createdDateTime>{self._fmt(self.clock())}</createdDateTime>{series}
+</Publication_MarketDocument>"""
+        return web.Response(text=xml, content_type="application/xml")
+
+    def _entsoe_load(self, area: Area, start: datetime, end: datetime) -> web.Response:
+        horizon = self.clock() + timedelta(days=self.config.load_horizon_days)
+        days = [(s, e) for s, e in self._local_days(area, start, end) if s < horizon]
+        if len(days) == 0:
+            return self._acknowledgement(f"No matching data found for Data item Week-ahead Total Load Forecast [6.1.C] ({area.code}) and interval {start.isoformat()}/{end.isoformat()}.")
+
+        ts = np.array([int(s.timestamp()) for s, _ in days])
+        weekday = np.array([s.astimezone(ZoneInfo(area.tz)).weekday() for s, _ in days])
+        base = 45000 - 6000 * (weekday >= 5) + 5000 * np.cos(2 * math.pi * (ts / 86400 - 15) / 365.25)
+        minload = np.round(base * 0.7 + 1000 * _noise(f"minload{area.code}", ts // 86400, self.config.seed))
+        maxload = np.round(base * 1.25 + 1500 * _noise(f"maxload{area.code}", ts // 86400, self.config.seed))
+
+        series = ""
+        for i, (business_type, values) in enumerate([("A60", minload), ("A61", maxload)]):
+            period = self._period(days[0][0], days[-1][1], "P1D", "quantity", [int(v) for v in values])
+            series += f"""
+	<TimeSeries>
+		<mRID>{i + 1}</mRID>
+		<businessType>{business_type}</businessType>
+		<objectAggregation>A01</objectAggregation>
+		<outBiddingZone_Domain.mRID codingScheme="A01">{area.code}</outBiddingZone_Domain.mRID>
+		<quantity_Measure_Unit.name>MAW</quantity_Measure_Unit.name>
+		<curveType>A01</curveType>{period}
+	</TimeSeries>"""
+        xml = f"""<?xml version="1.0" encoding="utf-8"?>
+<GL_MarketDocument xmlns="urn:iec62325.351:tc57wg16:451-6:generationloaddocument:3:0">
+	<mRID>fake</mRID>
+	<revisionNumber>1</revisionNumber>
+	<type>A65</type>
+	<process.processType>A31</process.processType>
+	<createdDateTime>{self._fmt(self.clock())}</createdDateTime>{series}
+</GL_MarketDocument>"""
+        return web.Response(text=xml, content_type="application/xml")
+
+
+    ##### bundesnetzagentur.de
+
+    def gas_page_html(self) -> str:
+        # prices are published for the previous trading days, futures are not traded on weekends
+        today = self.clock().astimezone(MARKET_TZ).date()
+        days = pd.date_range("2022-01-03", today - timedelta(days=1), freq="D")
+        ts = _to_ts(days)
+        prices = 35 + 10 * np.sin(2 * math.pi * ts / 86400 / 365.25) + 3 * _noise("gas", ts // 86400, self.config.seed)
+        labels = ", ".join(f"'{d:%d.%m.%Y}'" for d in days)
+        dayahead = ", ".join(f"{p:.2f}" for p in prices)
+        future = ", ".join("" if d.weekday() >= 5 else f"{p + 1:.2f}" for d, p in zip(days, prices))
+        return f"""<!DOCTYPE html>
+<html lang="de">
+<head><meta charset="UTF-8"><title>Bundesnetzagentur - Gaspreise</title></head>
+<body>
+    <div class="svgChart" id="myChartId_870302"></div>
+    <script>
+var data_myChartId_870302_export = {{
+    labels: [{labels}],
+    datasets: [{{
+        label: 'THE Day Ahead',
+        data: [{dayahead}]
+    }}, {{
+        label: 'THE Future (M+1)',
+        data: [{future}]
+    }}]
+}};
+    </script>
+</body>
+</html>
+"""
+
+    async def gas_page(self, request: web.Request) -> web.Response:
+        html = self.gas_page_html()
+        etag = f'"{hashlib.sha256(html.encode()).hexdigest()[:16]}"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.Response(text=html, content_type="text/html", headers={"ETag": etag})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake upstream data sources")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many seconds added randomly to each response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503")
+    parser.add_argument("--publication-time", type=time.fromisoformat, default=time(13, 0), help="Local time day-ahead prices for tomorrow appear. Default: 13:00")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s [%(levelname)s] %(name)s: %(message)s', level=logging.INFO)
+
+    config = FakeUpstreamConfig(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, publication_time=args.publication_time, seed=args.seed)
+    base_url = f"http://{args.host}:{args.port}"
+    print("Point the API to this server with:")
+    for k, v in FakeUpstream.env(base_url).items():
+        print(f"export {k}={v}")
+    print("export EPEXPREDICTOR_ENTSOE_API_KEY=fake")
+
+    web.run_app(FakeUpstream(config).app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import statistics
 from datetime import datetime, timedelta, timezone
@@ -9,6 +8,7 @@ from astral import Observer, sun
 
 from .datastore import DataStore
 from .priceregion import PriceRegion
+from .workers import run_cpu
 
 log = logging.getLogger(__name__)
 
@@ -21,12 +21,12 @@ class AuxDataStore(DataStore):
     data : pd.DataFrame
     region : PriceRegion
 
-    update_lock: asyncio.Lock
+    backfill_chunk = timedelta(days=30)
+    backfill_concurrency = 4
 
 
     def __init__(self, region : PriceRegion, storage_dir: str | None = None):
         super().__init__(region)
-        self.update_lock = asyncio.Lock()
 
     @override
     async def fetch_missing_data(self, start: datetime, end: datetime) -> bool:
@@ -36,14 +36,13 @@ class AuxDataStore(DataStore):
 
         async with self.update_lock:
             for rstart, rend in self.gen_missing_date_ranges(start, end):
-                df = await asyncio.to_thread(self._compute_data, rstart, rend)
+                df = await run_cpu(self._compute_data, rstart, rend)
                 if len(df) > 0:
-                    self._update_data(df)
+                    await self.update_data(df)
                     updated = True
 
             if updated:
                 log.info(f"{self.region.bidding_zone_entsoe}: aux data updated")
-                self.data.sort_index(inplace=True)
                 await self.serialize()
             return updated
     
@@ -51,6 +50,10 @@ class AuxDataStore(DataStore):
     def get_next_horizon_revalidation_time(self) -> datetime|None:
         return None
 
+    @override
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+        return await run_cpu(self._compute_data, rstart, rend)
+
     def _compute_data(self, rstart: datetime, rend: datetime) -> pd.DataFrame:
         """
         Careful: will be called in separate thread
@@ -0,0 +1,136 @@
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from .metrics import LatencyStats
+
+# Cores LightGBM may use in total, over all concurrent trainings and predictions
+CPU_CORES = int(os.getenv("EPEXPREDICTOR_CPU_CORES", str(os.cpu_count() or 1)))
+# Threads per prediction. Prediction matrices are small, more threads mostly add overhead
+INFERENCE_THREADS = int(os.getenv("EPEXPREDICTOR_INFERENCE_THREADS", "2"))
+
+
+class CpuBudget:
+    """
+    Hands out thread budgets (LightGBM num_threads) so concurrent jobs don't ask OpenMP for all cores each and
+    oversubscribe the machine. A job gets its share of the free cores, or waits until some are free.
+    Trainings never take the last inference_reserve cores, so predictions don't queue behind a long training
+    """
+
+    cores: int
+    inference_reserve: int
+
+    def __init__(self, cores: int = CPU_CORES, inference_reserve: int = 1):
+        self.cores = max(1, cores)
+        self.inference_reserve = min(inference_reserve, self.cores - 1)
+        self.in_use = 0
+        self.training_in_use = 0
+        # (kind, wanted threads, future for the granted threads), first come first served per kind
+        self.waiters: deque[tuple[str, int, asyncio.Future[int]]] = deque()
+
+        self.wait: dict[str, LatencyStats] = {}
+        self.runtime: dict[str, LatencyStats] = {}
+        self.granted: dict[str, LatencyStats] = {}
+
+
+    @asynccontextmanager
+    async def reserve(self, kind: str, want: int | None = None, parallel: int = 1) -> AsyncIterator[int]:
+        """
+        Reserve threads for a job of the given kind ("training" or "inference") and yield how many it may use.
+        Without want, the job asks for its part of the cores when parallel jobs of its kind run at the same time.
+        A running OpenMP job can't give threads back, so the first one must not take everything
+        """
+        capacity = self.cores - self.inference_reserve if kind == "training" else self.cores
+        want = min(want or max(1, capacity // parallel), self.cores)
+        submitted = time.monotonic()
+        threads = None
+        if not any(k == kind for k, _, _ in self.waiters):
+            threads = self._grant(kind, want, 0)
+        if threads is None:
+            future = asyncio.get_running_loop().create_future()
+            entry = (kind, want, future)
+            self.waiters.append(entry)
+            try:
+                threads = await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release(kind, future.result())
+                elif entry in self.waiters:
+                    self.waiters.remove(entry)
+                raise
+
+        started = time.monotonic()
+        self.wait.setdefault(kind, LatencyStats()).record(started - submitted)
+        self.granted.setdefault(kind, LatencyStats()).record(threads)
+        ok = False
+        try:
+            yield threads
+            ok = True
+        finally:
+            self.runtime.setdefault(kind, LatencyStats()).record(time.monotonic() - started, ok)
+            self._release(kind, threads)
+
+    def _grant(self, kind: str, want: int, pending: int) -> int | None:
+        """
+        Threads for a job now, None if it has to wait. pending: jobs of the same kind queued behind it, they get their share, too
+        """
+        available = self.cores - self.in_use
+        if kind == "training":
+            available = min(available, self.cores - self.inference_reserve - self.training_in_use)
+        if available < 1:
+            return None
+        threads = min(want, max(1, available // (1 + pending)))
+        self.in_use += threads
+        if kind == "training":
+            self.training_in_use += threads
+        return threads
+
+    def _release(self, kind: str, threads: int):
+        self.in_use -= threads
+        if kind == "training":
+            self.training_in_use -= threads
+        self._wake()
+
+    def _wake(self):
+        blocked = set()
+        for entry in list(self.waiters):
+            kind, want, future = entry
+            if kind in blocked:
+                continue
+            if future.done():
+                self.waiters.remove(entry)
+                continue
+            pending = sum(1 for k, _, f in self.waiters if k == kind and not f.done()) - 1
+            threads = self._grant(kind, want, pending)
+            if threads is None:
+                # keep the order within a kind
+                blocked.add(kind)
+                continue
+            self.waiters.remove(entry)
+            future.set_result(threads)
+
+    def stats(self) -> dict:
+        return {
+            "cores": self.cores,
+            "in_use": self.in_use,
+            "waiting": len(self.waiters),
+            "jobs": {
+                kind: {"wait": self.wait[kind].stats(), "runtime": self.runtime.get(kind, LatencyStats()).stats(), "threads": self.granted[kind].stats()}
+                for kind in self.wait
+            },
+        }
+
+
+_budget = CpuBudget()
+
+def reserve_threads(kind: str, want: int | None = None, parallel: int = 1):
+    """
+    Reserve threads from the process-wide budget, use as async context manager
+    """
+    return _budget.reserve(kind, want, parallel)
+
+def cpu_budget_stats() -> dict:
+    return _budget.stats()
@@ -2,22 +2,68 @@ import abc
 import asyncio
 import logging
 import os
-from datetime import datetime, timezone
+from dataclasses import dataclass
+from functools import cached_property
+from datetime import datetime, timedelta, timezone
 from typing import Self
 
 import pandas as pd
 
+from .http import HttpCacheMiss
 from .priceregion import PriceRegion
+from .slotgrid import SlotFrame, slot_range, to_slot
+from .workers import run_cpu
 
 log = logging.getLogger(__name__)
 
+# Slot range standing for "everything may have changed"
+ALL_SLOTS = (-2**62, 2**62)
+# How many versions back DataSnapshot.changed_since can tell what changed
+CHANGELOG_LENGTH = 32
+
+
+@dataclass(frozen=True)
+class DataSnapshot:
+    """
+    One published state of a DataStore's data. Never modified after publishing: writers build a new frame and swap
+    in the next snapshot, so readers can keep using theirs without locking.
+    """
+    version: int
+    data: pd.DataFrame
+    # (version, first slot, last slot) of the most recent changes, oldest first
+    changelog: tuple[tuple[int, int, int], ...] = ()
+
+    def changed_since(self, version: int) -> tuple[int, int] | None:
+        """
+        Slot range [first, last) in which this snapshot may differ from the given older version, None if it doesn't.
+        ALL_SLOTS if that version is too old to tell
+        """
+        if version == self.version:
+            return None
+        changes = [(first, last) for v, first, last in self.changelog if v > version]
+        if version > self.version or len(changes) < self.version - version:
+            return ALL_SLOTS
+        return min(first for first, _ in changes), max(last for _, last in changes)
+
+    @cached_property
+    def slots(self) -> SlotFrame:
+        """
+        The same data as dense arrays on the slot grid, built on first use. Read-only, like everything sliced from it.
+        The pandas frame stays the primary representation: updating the arrays in place would break the snapshots, and
+        converting a year of weather data takes about 2ms, once per version that is actually read
+        """
+        slots = SlotFrame.from_frame(self.data)
+        slots.values.flags.writeable = False
+        slots.rows.flags.writeable = False
+        return slots
+
 
 class DataStore:
     """
     Base class for caching data store with delta-fetching and serialization
     """
 
-    data: pd.DataFrame
+    snapshot: DataSnapshot
     region: PriceRegion
     storage_dir: str|None
     storage_fn_prefix: str|None
@@ -32,19 +78,58 @@ class DataStore:
 
     last_updated: datetime
 
+    update_lock: asyncio.Lock
+
+    # Single-flight: fetches currently running for get_data(), so overlapping callers can join them
+    inflight: list[tuple[datetime, datetime, asyncio.Task]]
+    fetches: int
+    coalesced: int
+
+    # Backfill: split missing history into chunks of this size and fetch up to backfill_concurrency of them in parallel.
+    # range_resolution is the step between two ranges returned by gen_missing_date_ranges
+    backfill_chunk: timedelta = timedelta(days=30)
+    backfill_concurrency: int = 2
+    range_resolution: timedelta = timedelta(minutes=15)
+
     def __init__(self, region : PriceRegion, storage_dir: str|None = None, storage_fn_prefix: str|None = None):
-        self.data = pd.DataFrame()
+        self.snapshot = DataSnapshot(0, pd.DataFrame())
         self.region = region
         self.storage_dir = storage_dir
         self.storage_fn_prefix = storage_fn_prefix
 
         self.last_updated = datetime(1970, 1, 1, tzinfo=timezone.utc)
+        self.update_lock = asyncio.Lock()
+
+        self.inflight = []
+        self.fetches = 0
+        self.coalesced = 0
 
         self.horizon_cutoff = None
         self.known_source_horizon = None
         self.source_horizon_revalitation_ts = None
 
 
+    @property
+    def data(self) -> pd.DataFrame:
+        """
+        Data of the current snapshot. Treat as read-only - assigning publishes a new snapshot
+        """
+        return self.snapshot.data
+
+    @data.setter
+    def data(self, df: pd.DataFrame):
+        self.publish(df, ALL_SLOTS)
+
+    def publish(self, df: pd.DataFrame, changed: tuple[int, int]):
+        """
+        Swap in df as the next snapshot. changed: slot range [first, last) outside of which df equals the current data
+        """
+        current = self.snapshot
+        version = current.version + 1
+        changelog = (current.changelog + ((version, *changed),))[-CHANGELOG_LENGTH:]
+        self.snapshot = DataSnapshot(version, df, changelog)
+
+
     def set_source_horizon(self, horizon: datetime, revalidation_ts: datetime|None):
         self.known_source_horizon = horizon
         self.source_horizon_revalitation_ts = revalidation_ts
@@ -62,22 +147,92 @@ class DataStore:
 
     
     async def get_data(self, start: datetime, end: datetime) -> pd.DataFrame:
+        _, data = await self.get_versioned_data(start, end)
+        return data
+
+    async def get_versioned_data(self, start: datetime, end: datetime) -> tuple[int, pd.DataFrame]:
+        """
+        Like get_data(), but also returns the version of the snapshot the data was taken from.
+        The data is a copy, callers may modify it without touching the published snapshot
+        """
+        snapshot, start, end = await self._read(start, end)
+        return snapshot.version, snapshot.data.loc[start:end].copy()
+
+    async def get_slots(self, start: datetime, end: datetime) -> SlotFrame:
+        _, slots = await self.get_versioned_slots(start, end)
+        return slots
+
+    async def get_versioned_slots(self, start: datetime, end: datetime) -> tuple[int, SlotFrame]:
+        """
+        get_versioned_data() on the slot grid: the slots of [start, end] this store has, as dense arrays
+        """
+        snapshot, start, end = await self._read(start, end)
+        return snapshot.version, snapshot.slots.slice(*slot_range(start, end))
+
+    async def _read(self, start: datetime, end: datetime) -> tuple[DataSnapshot, datetime, datetime]:
+        """
+        Fetch what is missing, then return the current snapshot and the range to read from it
+        """
         start = start.astimezone(timezone.utc)
         end = end.astimezone(timezone.utc)
         start, end = self.apply_horizon(start, end)
 
-        await self.fetch_missing_data(start, end)
+        # only queue behind update_lock if there actually is something to fetch
+        if len(self.gen_missing_date_ranges(start, end)) > 0:
+            await self.fetch_single_flight(start, end)
+
+        self.remember_source_horizon(end)
 
+        if self.horizon_cutoff and self.horizon_cutoff < end:
+            end = self.horizon_cutoff
+        return self.snapshot, start, end
+    
+    async def fetch_single_flight(self, start: datetime, end: datetime) -> bool:
+        """
+        fetch_missing_data(), deduplicated: if a running fetch already covers the range, wait for its result instead of
+        fetching again. Partially overlapping fetches are awaited first, so only what is still missing afterwards is fetched.
+        The shared fetch keeps running if one of its callers is cancelled.
+        """
+        while True:
+            overlapping = [(fstart, fend, task) for fstart, fend, task in self.inflight if fstart <= end and start <= fend]
+            if len(overlapping) == 0:
+                break
+            for fstart, fend, task in overlapping:
+                if fstart <= start and end <= fend:
+                    self.coalesced += 1
+                    return await asyncio.shield(task)
+            await asyncio.wait([task for _, _, task in overlapping])
+
+        task = asyncio.ensure_future(self.fetch_missing_data(start, end))
+        entry = (start, end, task)
+        self.inflight.append(entry)
+        self.fetches += 1
+
+        def done(task: asyncio.Task):
+            self.inflight.remove(entry)
+            if not task.cancelled():
+                task.exception() # don't warn about unretrieved exceptions if all callers are gone
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task)
+
+    def fetch_stats(self) -> dict:
+        return {
+            "fetches": self.fetches,
+            "coalesced": self.coalesced,
+            "inflight": len(self.inflight),
+        }
+
+    def remember_source_horizon(self, end: datetime):
+        """
+        Called after fetching up to end: if the source didn't have data up to there, remember where it ends
+        """
         last_known = self.get_last_known()
         if last_known and last_known < end:
             # source horizon reached - remember/reschedule source query
             self.known_source_horizon = last_known
             self.source_horizon_revalitation_ts = self.get_next_horizon_revalidation_time()
 
-        if self.horizon_cutoff and self.horizon_cutoff < end:
-            end = self.horizon_cutoff
-        return self.data.loc[start:end]
-    
     def needs_horizon_revalidation(self):
         return self.source_horizon_revalitation_ts is not None and datetime.now(timezone.utc) > self.source_horizon_revalitation_ts
 
@@ -89,6 +244,64 @@ class DataStore:
     def get_next_horizon_revalidation_time(self) -> datetime|None:
         pass
 
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+        """
+        Fetch the given range from the upstream source without modifying the store. Used by backfill()
+        """
+        return None
+
+    def gen_backfill_chunks(self, start: datetime, end: datetime) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+        chunks = []
+        for rstart, rend in self.gen_missing_date_ranges(start, end):
+            cstart = rstart
+            while cstart <= rend:
+                cend = min(cstart + self.backfill_chunk, rend)
+                chunks.append((cstart, cend))
+                cstart = cend + self.range_resolution
+        return chunks
+
+    async def backfill(self, start: datetime, end: datetime) -> bool:
+        """
+        Fetch all missing data in the given range in upstream-friendly chunks concurrently,
+        merge everything in one pass and serialize once at the end.
+        Ranges the store has already (e.g. loaded from disk) and ranges beyond the known source horizon are not fetched.
+        """
+        start = start.astimezone(timezone.utc)
+        end = end.astimezone(timezone.utc)
+        start, end = self.apply_horizon(start, end)
+
+        async with self.update_lock:
+            chunks = self.gen_backfill_chunks(start, end)
+            if len(chunks) == 0:
+                return False
+            log.info(f"{self.region.bidding_zone_entsoe}: backfilling {self.storage_fn_prefix} data from {start.isoformat()} to {end.isoformat()} in {len(chunks)} chunks")
+
+            semaphore = asyncio.Semaphore(self.backfill_concurrency)
+            async def fetch(rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+                async with semaphore:
+                    try:
+                        return await self.fetch_range(rstart, rend)
+                    except HttpCacheMiss:
+                        raise
+                    except Exception as e:
+                        log.warning(f"{self.region.bidding_zone_entsoe}: failed to backfill {self.storage_fn_prefix} data from {rstart.isoformat()} to {rend.isoformat()}: {e}")
+                        return None
+
+            results = await asyncio.gather(*[fetch(rstart, rend) for rstart, rend in chunks])
+            frames = [df for df in results if df is not None and len(df) > 0]
+            updated = False
+            if len(frames) > 0:
+                # later chunks win on overlaps, same as sequential updates would
+                merged = pd.concat(frames)
+                merged = merged[~merged.index.duplicated(keep="last")]
+                updated = await self.update_data(merged)
+                if updated:
+                    await self.serialize()
+            if all(df is not None for df in results):
+                # failed chunks don't tell where the source ends
+                self.remember_source_horizon(end)
+            return updated
+
 
     def gen_missing_date_ranges(self, start: datetime, end: datetime) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
         # Full 15-minute grid
@@ -132,23 +345,52 @@ class DataStore:
 
 
     def drop_after(self, dt: datetime):
-        if self.data.empty:
+        if self.data.empty or self.data.index[-1] <= pd.to_datetime(dt, utc=True):
             return
-        self.data = self.data[self.data.index <= pd.to_datetime(dt, utc=True)]
+        self.publish(self.data[self.data.index <= pd.to_datetime(dt, utc=True)], (to_slot(dt), ALL_SLOTS[1]))
 
     def drop_before(self, dt: datetime):
-        if self.data.empty:
+        if self.data.empty or self.data.index[0] >= pd.to_datetime(dt, utc=True):
             return
-        self.data = self.data[self.data.index >= pd.to_datetime(dt, utc=True)]
+        self.publish(self.data[self.data.index >= pd.to_datetime(dt, utc=True)], (ALL_SLOTS[0], to_slot(dt) + 1))
 
     def _update_data(self, df: pd.DataFrame) -> bool:
-        olddata = self.data
-        self.data = df.combine_first(self.data).dropna() # keeps new data from df, fills it with existing data from self
+        """
+        Merge df into a new frame and publish it as the next snapshot if anything changed.
+        No await in here, so nobody can publish in between reading the current snapshot and swapping in the next one
+        """
+        newdata = self._merge(self.data, df)
+        if newdata is not None:
+            self._publish_update(newdata, df)
+        return newdata is not None
+
+    async def update_data(self, df: pd.DataFrame) -> bool:
+        """
+        _update_data() with the merge on a worker thread. If another update got published in the meantime, merge again
+        """
+        while True:
+            current = self.snapshot
+            newdata = await run_cpu(self._merge, current.data, df)
+            if self.snapshot is not current:
+                continue
+            if newdata is not None:
+                self._publish_update(newdata, df)
+            return newdata is not None
+
+    @staticmethod
+    def _merge(olddata: pd.DataFrame, df: pd.DataFrame) -> pd.DataFrame | None:
+        """
+        olddata updated with df, None if that doesn't change anything
+        """
+        newdata = df.combine_first(olddata).dropna().sort_index() # keeps new data from df, fills it with existing data from self
+        if olddata.round(decimals=10).equals(newdata.round(decimals=10)):
+            return None
+        return newdata
 
-        changed = not olddata.round(decimals=10).equals(self.data.round(decimals=10))
-        if changed:
-            self.last_updated = datetime.now(timezone.utc)
-        return changed
+    def _publish_update(self, newdata: pd.DataFrame, df: pd.DataFrame):
+        # rows outside of df's range are taken over from the current data as they are
+        self.publish(newdata, (to_slot(df.index.min()), to_slot(df.index.max()) + 1) if len(df) > 0 else ALL_SLOTS)
+        self.last_updated = datetime.now(timezone.utc)
 
 
     def get_storage_file(self):
@@ -162,30 +404,32 @@ class DataStore:
         fn = self.get_storage_file()
         if fn is not None:
             log.info(f"{self.region.bidding_zone_entsoe}: storing new {self.storage_fn_prefix} data")
+            # snapshots are immutable, so it's safe to write this one from another thread while the next one is built
             await asyncio.to_thread(self.data.to_json, fn, compression='gzip')
     
     async def load(self) -> Self:
         fn = self.get_storage_file()
         if fn is not None and os.path.exists(fn):
             log.info(f"{self.region.bidding_zone_entsoe}: loading persisted {self.storage_fn_prefix} data")
-            self.data = await asyncio.to_thread(pd.read_json, fn, compression='gzip')
+            data = await asyncio.to_thread(pd.read_json, fn, compression='gzip')
 
             # Handle index type: to_json saves DatetimeIndex as epoch milliseconds,
             # which read_json loads as Int64Index. Convert back to DatetimeIndex.
-            if pd.api.types.is_integer_dtype(self.data.index.dtype):
+            if pd.api.types.is_integer_dtype(data.index.dtype):
                 # Index values are epoch milliseconds
-                self.data.index = pd.to_datetime(self.data.index, unit='ms', utc=True)
-            elif isinstance(self.data.index, pd.DatetimeIndex) and self.data.index.tz is None:
+                data.index = pd.to_datetime(data.index, unit='ms', utc=True)
+            elif isinstance(data.index, pd.DatetimeIndex) and data.index.tz is None:
                 # Index is DatetimeIndex but naive, localize to UTC
-                self.data.index = self.data.index.tz_localize("UTC")
-            elif not isinstance(self.data.index, pd.DatetimeIndex):
+                data.index = data.index.tz_localize("UTC")
+            elif not isinstance(data.index, pd.DatetimeIndex):
                 # Unexpected index type - log warning and attempt conversion
-                log.warning(f"{self.region.bidding_zone_entsoe}: Unexpected index type {type(self.data.index).__name__} in persisted data, "
+                log.warning(f"{self.region.bidding_zone_entsoe}: Unexpected index type {type(data.index).__name__} in persisted data, "
                            f"attempting datetime conversion")
-                self.data.index = pd.to_datetime(self.data.index, utc=True)
+                data.index = pd.to_datetime(data.index, utc=True)
 
-            self.data.index.set_names("time", inplace=True)
-            self.data.dropna(inplace=True)
+            data.index.set_names("time", inplace=True)
+            # not published yet, so modifying it in place is fine
+            self.data = data.dropna()
 
             self.last_updated = datetime.fromtimestamp(os.path.getmtime(fn), tz=timezone.utc)
         return self
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from entsoe.mappings import lookup_area
+
+from .http import fetch, range_ttl
+from .workers import run_cpu
+
+log = logging.getLogger(__name__)
+
+ENTSOE_URL = os.getenv("EPEXPREDICTOR_ENTSOE_URL", "https://web-api.tp.entsoe.eu/api")
+
+
+class EntsoeError(Exception):
+    pass
+
+class NoMatchingDataError(EntsoeError):
+    pass
+
+
+@dataclass
+class EntsoeTimeSeries:
+    """
+    One TimeSeries element of a publication document. times are epoch seconds (UTC) of the start of each slot
+    """
+    business_type: str | None
+    resolution: int
+    times: np.ndarray
+    values: np.ndarray
+
+
+_DURATION_RE = re.compile(r"P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?)?")
+
+def _parse_resolution(res: str) -> int:
+    m = _DURATION_RE.fullmatch(res)
+    if m is None:
+        raise EntsoeError(f"unsupported resolution {res}")
+    return int(m.group("days") or 0) * 86400 + int(m.group("hours") or 0) * 3600 + int(m.group("minutes") or 0) * 60
+
+def _parse_ts(ts: str) -> int:
+    return int(datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp())
+
+
+def parse_timeseries(xml: str, value_tag: str) -> list[EntsoeTimeSeries]:
+    """
+    Parse all TimeSeries/Period elements of an ENTSO-E publication document (A44 prices, A65 load)
+    """
+    root = ET.fromstring(xml)
+    # documents are namespaced with their schema version - just ignore it
+    ns = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+
+    if root.tag.endswith("Acknowledgement_MarketDocument"):
+        reason = root.findtext(f".//{ns}Reason/{ns}text") or ""
+        if "No matching data found" in reason:
+            raise NoMatchingDataError(reason)
+        raise EntsoeError(reason)
+
+    result = []
+    for series in root.iter(f"{ns}TimeSeries"):
+        business_type = series.findtext(f"{ns}businessType")
+        curve_type = series.findtext(f"{ns}curveType")
+        for period in series.iter(f"{ns}Period"):
+            start = _parse_ts(period.findtext(f"{ns}timeInterval/{ns}start", ""))
+            end = _parse_ts(period.findtext(f"{ns}timeInterval/{ns}end", ""))
+            resolution = _parse_resolution(period.findtext(f"{ns}resolution", ""))
+
+            points = period.findall(f"{ns}Point")
+            positions = np.fromiter((int(p.findtext(f"{ns}position", "0")) for p in points), dtype=np.int64, count=len(points))
+            values = np.fromiter((float(p.findtext(f"{ns}{value_tag}", "nan")) for p in points), dtype=np.float64, count=len(points))
+
+            if curve_type == "A03":
+                # A03: positions are omitted while the value doesn't change -> repeat the last value
+                slots = (end - start) // resolution
+                full = np.full(slots, np.nan)
+                valid = (positions >= 1) & (positions <= slots)
+                full[positions[valid] - 1] = values[valid]
+                idx = np.where(np.isnan(full), 0, np.arange(slots))
+                np.maximum.accumulate(idx, out=idx)
+                values = full[idx]
+                positions = np.arange(1, slots + 1)
+
+            times = start + (positions - 1) * resolution
+            result.append(EntsoeTimeSeries(business_type, resolution, times, values))
+    return result
+
+
+def _to_series(ts: list[EntsoeTimeSeries], tz: str) -> pd.Series:
+    if len(ts) == 0:
+        return pd.Series(dtype=np.float64, index=pd.DatetimeIndex([], tz=tz))
+    # finest resolution first, so it wins if a zone publishes multiple resolutions for the same time
+    ts = sorted(ts, key=lambda t: t.resolution)
+    times = np.concatenate([t.times for t in ts])
+    values = np.concatenate([t.values for t in ts])
+    series = pd.Series(values, index=pd.to_datetime(times, unit="s", utc=True).tz_convert(tz))
+    series = series[~series.index.duplicated(keep="first")]
+    return series.sort_index()
+
+
+class EntsoeClient:
+    """
+    Minimal asyncio client for the ENTSO-E transparency platform REST API.
+    Only supports the document types we need: day-ahead prices (A44) and week-ahead load forecast (A65/A31).
+    Like entsoe-py, results are indexed in the local time of the bidding zone
+    """
+
+    api_key: str
+    url: str
+    timeout: float
+
+    # cache TTL of responses for recent data (see http.range_ttl)
+    price_cache_ttl = timedelta(minutes=5)
+    load_cache_ttl = timedelta(hours=1)
+
+    def __init__(self, api_key: str, url: str | None = None, timeout: float = 30):
+        self.api_key = api_key
+        self.url = url or ENTSOE_URL
+        self.timeout = timeout
+
+    @staticmethod
+    def _format_ts(dt: datetime) -> str:
+        return dt.astimezone(timezone.utc).strftime("%Y%m%d%H00")
+
+    async def _request(self, params: dict[str, str], start: datetime, end: datetime, ttl: timedelta) -> str:
+        params = params | {
+            "securityToken": self.api_key,
+            "periodStart": self._format_ts(start),
+            "periodEnd": self._format_ts(end),
+        }
+        resp = await fetch(self.url, params=params, timeout=self.timeout, ttl=range_ttl(end, ttl))
+        if resp.status >= 400 and "Acknowledgement_MarketDocument" not in resp.text:
+            raise EntsoeError(f"HTTP {resp.status}: {resp.text[:200]}")
+        return resp.text
+
+    async def query_day_ahead_prices(self, zone: str, start: datetime, end: datetime) -> pd.Series:
+        """
+        Day-ahead prices in EUR/MWh
+        """
+        area = lookup_area(zone)
+        params = {
+            "documentType": "A44",
+            "in_Domain": area.code,
+            "out_Domain": area.code,
+            "contract_MarketAgreement.type": "A01",
+        }
+        if area.name in ["DE_LU", "AT"]:
+            # only the SDAC auction, not the additional local auctions
+            params["classificationSequence_AttributeInstanceComponent.position"] = "1"
+
+        xml = await self._request(params, start, end, self.price_cache_ttl)
+        series = await run_cpu(parse_timeseries, xml, "price.amount")
+        return _to_series(series, area.tz)[start:end]
+
+    async def query_load_forecast(self, zone: str, start: datetime, end: datetime, process_type: str = "A31") -> pd.DataFrame:
+        """
+        Load forecast. For week-ahead forecasts (A31), returns columns "Min Forecasted Load" and "Max Forecasted Load"
+        """
+        area = lookup_area(zone)
+        params = {
+            "documentType": "A65",
+            "processType": process_type,
+            "outBiddingZone_Domain": area.code,
+        }
+
+        # load forecasts are limited to one month per request
+        windows = []
+        wstart = start
+        while wstart < end:
+            wend = min(wstart + timedelta(days=31), end)
+            windows.append((wstart, wend))
+            wstart = wend
+
+        async def query(wstart: datetime, wend: datetime) -> list[EntsoeTimeSeries]:
+            try:
+                xml = await self._request(params, wstart, wend, self.load_cache_ttl)
+                return await run_cpu(parse_timeseries, xml, "quantity")
+            except NoMatchingDataError:
+                return []
+
+        series = [ts for result in await asyncio.gather(*[query(s, e) for s, e in windows]) for ts in result]
+        if len(series) == 0:
+            raise NoMatchingDataError(f"no load forecast for {zone} from {start.isoformat()} to {end.isoformat()}")
+
+        if process_type in ("A01", "A16"):
+            df = pd.DataFrame({"Forecasted Load" if process_type == "A01" else "Actual Load": _to_series(series, area.tz)})
+        else:
+            # A60 = minimum, A61 = maximum
+            df = pd.DataFrame({
+                "Min Forecasted Load": _to_series([ts for ts in series if ts.business_type == "A60"], area.tz),
+                "Max Forecasted Load": _to_series([ts for ts in series if ts.business_type == "A61"], area.tz),
+            })
+        return df[start:end]
@@ -1,17 +1,43 @@
-import asyncio
 import logging
 from datetime import datetime, timedelta, timezone
-from math import nan
 import os
 
-from entsoe import entsoe
+import numpy as np
 import pandas as pd
 
 from .datastore import DataStore
+from .entsoeclient import EntsoeClient
+from .http import HttpCacheMiss
 from .priceregion import PriceRegion
 
 log = logging.getLogger(__name__)
 
+
+def shape_load_forecast(load_forecast: pd.DataFrame) -> pd.Series:
+    """
+    Turn the daily min/max load forecast into a 15 minute load curve.
+    Max load is typically observed for morning/evening peaks, min load at night, so we place
+    anchor points at those times (local time of the index) and interpolate in between.
+    """
+    load_forecast = load_forecast.resample("15min").ffill()
+    assert isinstance(load_forecast.index, pd.DatetimeIndex)
+
+    hour = load_forecast.index.hour
+    minute = load_forecast.index.minute
+    maxload = load_forecast["Max Forecasted Load"].to_numpy(dtype=np.float64)
+    minload = load_forecast["Min Forecasted Load"].to_numpy(dtype=np.float64)
+
+    load = np.full(len(load_forecast), np.nan)
+    peak = ((hour == 11) & (minute == 30)) | ((hour == 19) & (minute == 0))
+    load[peak] = maxload[peak]
+    afternoon = (hour == 14) & (minute == 30)
+    load[afternoon] = (3 * maxload[afternoon] + minload[afternoon]) / 4.0
+    night = (hour == 3) & (minute == 0)
+    load[night] = minload[night]
+
+    return pd.Series(load, index=load_forecast.index, name="load").interpolate(method="cubic").dropna()
+
+
 class EntsoeDataStore(DataStore):
     """
     Fetches additional forecast data from Entso-E (if API key is configured)
@@ -22,14 +48,15 @@ class EntsoeDataStore(DataStore):
     storage_dir : str|None
     entsoe_api_key : str|None
 
-    update_lock: asyncio.Lock
-    
+    # ENTSO-E only serves one month of load forecasts per request
+    backfill_chunk = timedelta(days=28)
+    backfill_concurrency = 2
+
 
     def __init__(self, region : PriceRegion, storage_dir=None):
         super().__init__(region, storage_dir, "entsoe_v1")
         if not self.region.use_entsoe_load_forecast:
             self.data = self.data.drop(self.data.index)
-        self.update_lock = asyncio.Lock()
         self.entsoe_api_key = os.getenv("EPEXPREDICTOR_ENTSOE_API_KEY", None)
         if self.entsoe_api_key is None or len(self.entsoe_api_key) == 0:
             self.entsoe_api_key = None
@@ -52,58 +79,42 @@ class EntsoeDataStore(DataStore):
             
             return updated
 
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+        if self.entsoe_api_key is None or not self.region.use_entsoe_load_forecast:
+            return None
+
+        log.info(f"{self.region.bidding_zone_entsoe}: Fetching Entso-E data from {rstart.isoformat()} to {rend.isoformat()}")
+        client = EntsoeClient(self.entsoe_api_key)
+
+        # Entso-E api always seems to cut things a bit short... and it gives us a bit of buffer for interpolation
+        qstart = rstart - timedelta(days=2)
+        qend = rend + timedelta(days=2)
+
+        # A31 = daily data, week-forecast
+        # Columns "Max Forecasted Load" and "Min Forecasted Load"
+        # index in local time of the bidding zone, where the anchor times are
+        load_forecast = await client.query_load_forecast(self.region.bidding_zone_entsoe, qstart, qend, process_type="A31")
+        load_hourly = shape_load_forecast(load_forecast)
+        load_hourly.index = load_hourly.index.tz_convert("UTC")
+
+        return pd.DataFrame(load_hourly)
+
     async def refresh_range(self, rstart: datetime, rend: datetime) -> bool:
         if self.entsoe_api_key is None or not self.region.use_entsoe_load_forecast:
             return False
 
-        log.info(f"{self.region.bidding_zone_entsoe}: Fetching Entso-E data from {rstart.isoformat()} to {rend.isoformat()}")
         updated = False
 
         try:
-            client = entsoe.EntsoePandasClient(api_key=self.entsoe_api_key)
-
-            # Entso-E api always seems to cut things a bit short... and it gives us a bit of buffer for interpolation
-            qstart = rstart - timedelta(days=2)
-            qend = rend + timedelta(days=2)
-
-            # A31 = daily data, week-forecast
-            # Columns "Max Forecasted Load" and "Min Forecasted Load"
-            load_forecast = await asyncio.to_thread(client.query_load_forecast, self.region.bidding_zone_entsoe, start=pd.to_datetime(qstart), end=pd.to_datetime(qend), process_type="A31")
-            load_forecast = load_forecast.resample("15min").ffill()
-            assert isinstance(load_forecast.index, pd.DatetimeIndex)
-
-            # Max load is typically observed for morning/evening peaks, min load at night
-            def resample_load_to_hourly(row):
-                assert isinstance(row.name, pd.Timestamp)
-                maxload = row["Max Forecasted Load"]
-                minload = row["Min Forecasted Load"]
-                if row.name.hour == 11 and row.name.minute == 30:
-                    return maxload
-                elif row.name.hour == 19 and row.name.minute == 0:
-                    return maxload
-                elif row.name.hour == 14 and row.name.minute == 30:
-                    return (3 * maxload + minload) / 4.0
-                elif row.name.hour == 3 and row.name.minute == 0:
-                    return minload
-                return nan
-
-            load_hourly = load_forecast.apply(resample_load_to_hourly, axis=1)
-            load_hourly = load_hourly.interpolate(method='cubic').dropna()
-            load_hourly.name = "load"
-
-            assert isinstance(load_hourly.index, pd.DatetimeIndex)
-            load_hourly.index = load_hourly.index.tz_convert("UTC")
-
-            hourly_df = pd.DataFrame(load_hourly)
-
-            
-            if len(hourly_df) > 0:
-                updated = self._update_data(hourly_df)
+            hourly_df = await self.fetch_range(rstart, rend)
+            if hourly_df is not None and len(hourly_df) > 0:
+                updated = await self.update_data(hourly_df)
             if updated:
                 log.info(f"{self.region.bidding_zone_entsoe}: Entso-E data updated")
-                self.data.sort_index(inplace=True)
                 await self.serialize()
             return updated
+        except HttpCacheMiss:
+            raise
         except Exception as e:
             log.error(f"{self.region.bidding_zone_entsoe}: Failed to fetch Entso-E load forecast data: {e}. Forecast quality might be degraded")
             return False
@@ -0,0 +1,313 @@
+import numpy as np
+import pandas as pd
+
+from .datastore import DataStore
+from .slotgrid import SlotFrame, ffill, slot_index
+
+
+class FeatureMatrix:
+    """
+    Rolling feature matrix of one predictor, the incremental version of assemble_features().
+    Keeps the joined store data of the last window on the slot grid. On the next update only the slots that are new in
+    the window, that the stores report as changed since the versions used last time, or that a store now shows more or
+    less of (horizon_cutoff) are copied again - usually a few hours of forecasts at the end. Slots that leave the window
+    are dropped.
+    """
+
+    # store data of slots [first, last), column-major, gas already forward filled along the weather rows
+    first: int
+    last: int
+    values: np.ndarray
+    # slots with data, per store, and their union without gas
+    masks: dict[str, np.ndarray]
+    rows: np.ndarray
+    # raw gas prices and their forward fill over weather rows, also set for non-weather rows
+    gas: np.ndarray
+    carry: np.ndarray
+
+    # what the matrix was built from
+    stores: dict[str, DataStore]
+    versions: dict[str, int]
+    columns: dict[str, tuple[str, ...]]
+    # slots of the window each store's frame covered. Moves without a new version when a horizon_cutoff changes
+    extents: dict[str, tuple[int, int]]
+
+    def __init__(self):
+        self.first = self.last = 0
+        self.values = np.empty((0, 0), order="F")
+        self.masks = {}
+        self.rows = np.empty(0, dtype=bool)
+        self.gas = self.carry = np.empty((0, 0))
+        self.stores = {}
+        self.versions = {}
+        self.columns = {}
+        self.extents = {}
+        self.cached: tuple[int, pd.DataFrame] | None = None
+
+        self.builds = 0
+        self.patched_slots = 0
+
+
+    def update(self, stores: dict[str, DataStore], versions: dict[str, int], slots: dict[str, SlotFrame],
+               first: int, last: int, output_first: int) -> pd.DataFrame:
+        """
+        Same result as assemble_features() for the given store slots. Keys are weather, aux, entsoe, gas, prices -
+        entsoe and gas are optional.
+        stores and versions say where slots came from, so only what changed since the last call needs to be copied
+        """
+        if "entsoe" in slots and not slots["entsoe"].slice(first, last).rows.any():
+            slots = {name: frame for name, frame in slots.items() if name != "entsoe"}
+        order = [name for name in ("weather", "aux", "entsoe", "gas", "prices") if name in slots]
+        columns = {name: slots[name].columns for name in order}
+
+        overlap = max(first, self.first), min(last, self.last)
+        rebuild = (columns != self.columns or overlap[0] >= overlap[1]
+                   or any(stores[name] is not self.stores.get(name) for name in order))
+        shifted = not rebuild and first != self.first
+        if rebuild:
+            dirty = {name: [(first, last)] for name in order}
+            self._allocate(columns, first, last)
+            self.builds += 1
+        else:
+            dirty = {name: self._changes(name, stores[name], versions[name], first, last)
+                          + self._moved(self.extents[name], self._extent(slots[name], first, last), *overlap) for name in order}
+            if (first, last) != (self.first, self.last):
+                self._shift(first, last)
+                for name in order:
+                    dirty[name] += [(first, overlap[0]), (overlap[1], last)]
+
+        dirty = {name: [(a, b) for a, b in ranges if a < b] for name, ranges in dirty.items()}
+        changed = any(dirty.values())
+        for name, ranges in dirty.items():
+            for a, b in ranges:
+                self._patch(name, slots[name], a, b)
+                self.patched_slots += b - a
+
+        if "gas" in slots:
+            refill = dirty["weather"] + dirty["gas"]
+            if shifted:
+                # the fill starts fresh at the beginning of the window, values carried over from dropped slots go
+                refill.append((first, first))
+                changed = True
+            # in order, so each range starts from an up to date fill before it
+            for a, b in sorted(refill):
+                self._fill_gas(a, b)
+
+        self.stores = dict(stores)
+        self.versions = {name: versions[name] for name in order}
+        self.extents = {name: self._extent(slots[name], first, last) for name in order}
+
+        if not changed and self.cached is not None and self.cached[0] == output_first:
+            return self.cached[1]
+        df = self._output(order, output_first)
+        self.cached = (output_first, df)
+        return df
+
+
+    def _changes(self, name: str, store: DataStore, version: int, first: int, last: int) -> list[tuple[int, int]]:
+        """
+        Slots of the window the store may have changed since the last update
+        """
+        if version == self.versions[name]:
+            return []
+        # the store may already be past version, then this also covers later changes - copying too much is fine
+        changed = store.snapshot.changed_since(self.versions[name])
+        if changed is None:
+            # store went back to the version we know, only happens with stubbed stores
+            changed = (first, last)
+        return [(max(changed[0], first), min(changed[1], last))]
+
+    @staticmethod
+    def _extent(frame: SlotFrame, first: int, last: int) -> tuple[int, int]:
+        return FeatureMatrix._clip((frame.base, frame.end), first, last)
+
+    @staticmethod
+    def _moved(old: tuple[int, int], new: tuple[int, int], first: int, last: int) -> list[tuple[int, int]]:
+        """
+        Slots of [first, last) that a frame covers now but didn't before, or the other way round. The rest of the window
+        is new and copied anyway
+        """
+        (a, b), (c, d) = (FeatureMatrix._clip(extent, first, last) for extent in (old, new))
+        return [(min(a, c), max(a, c)), (min(b, d), max(b, d))]
+
+    @staticmethod
+    def _clip(extent: tuple[int, int], first: int, last: int) -> tuple[int, int]:
+        a, b = max(extent[0], first), min(extent[1], last)
+        return (a, b) if a < b else (first, first)
+
+    def _offsets(self) -> dict[str, int]:
+        offsets = {}
+        col = 0
+        for name, columns in self.columns.items():
+            offsets[name] = col
+            col += len(columns)
+        return offsets
+
+    def _allocate(self, columns: dict[str, tuple[str, ...]], first: int, last: int):
+        n = last - first
+        self.first, self.last = first, last
+        self.columns = columns
+        self.values = np.full((n, sum(len(c) for c in columns.values())), np.nan, order="F")
+        self.masks = {name: np.zeros(n, dtype=bool) for name in columns}
+        self.rows = np.zeros(n, dtype=bool)
+        width = len(columns.get("gas", ()))
+        self.gas = np.full((n, width), np.nan)
+        self.carry = np.full((n, width), np.nan)
+        self.cached = None
+
+    def _shift(self, first: int, last: int):
+        """
+        Move the window, keeping the overlapping slots. This is the only copy proportional to the window size
+        """
+        a, b = max(first, self.first), min(last, self.last)
+        old = (self.first, self.values, self.masks, self.rows, self.gas, self.carry)
+        self._allocate(self.columns, first, last)
+        oldfirst, values, masks, rows, gas, carry = old
+        src, dst = slice(a - oldfirst, b - oldfirst), slice(a - first, b - first)
+        self.values[dst] = values[src]
+        self.rows[dst] = rows[src]
+        self.gas[dst] = gas[src]
+        self.carry[dst] = carry[src]
+        for name, mask in masks.items():
+            self.masks[name][dst] = mask[src]
+
+    def _patch(self, name: str, frame: SlotFrame, a: int, b: int):
+        """
+        Copy slots [a, b) of one store into the window
+        """
+        col = self._offsets()[name]
+        width = len(self.columns[name])
+        i, j = a - self.first, b - self.first
+        self.masks[name][i:j] = frame.row_mask(a, b)
+        if name == "gas":
+            self.gas[i:j] = frame.window(a, b)
+        else:
+            self.values[i:j, col:col + width] = frame.window(a, b)
+            self.rows[i:j] = np.logical_or.reduce([mask[i:j] for n, mask in self.masks.items() if n != "gas"])
+
+    def _fill_gas(self, a: int, b: int):
+        """
+        Redo the forward fill of gas prices for slots [a, b) and as far after it as the changed values carry over
+        """
+        i, j = a - self.first, b - self.first
+        weather = self.masks["weather"]
+        # following slots are affected until the next weather row with its own gas price
+        while j < len(weather):
+            chunk = slice(j, min(len(weather), j + 1024))
+            valid = np.flatnonzero(weather[chunk] & ~np.isnan(self.gas[chunk]).any(axis=1))
+            if len(valid) > 0:
+                j += int(valid[0])
+                break
+            j = chunk.stop
+
+        segment = np.where(weather[i:j, None], self.gas[i:j], np.nan)
+        seed = self.carry[i - 1:i] if i > 0 else np.full((1, self.gas.shape[1]), np.nan)
+        self.carry[i:j] = ffill(np.concatenate([seed, segment]))[1:]
+        col = self._offsets()["gas"]
+        self.values[i:j, col:col + self.gas.shape[1]] = np.where(weather[i:j, None], self.carry[i:j], np.nan)
+
+    def _output(self, order: list[str], output_first: int) -> pd.DataFrame:
+        columns = [c for name in order for c in self.columns[name]]
+        keep = self.rows.copy()
+        keep[:max(0, min(output_first, self.last) - self.first)] = False
+        present = np.flatnonzero(keep)
+        if len(present) == 0:
+            return pd.DataFrame(np.empty((0, len(columns))), index=slot_index(0, 0), columns=columns)
+        i, j = int(present[0]), int(present[-1]) + 1
+        if j - i == len(present):
+            # usually every slot has data, then a plain copy of the rows is a lot cheaper than picking them
+            values = self.values[i:j].copy(order="F")
+            index = slot_index(self.first + i, self.first + j)
+        else:
+            values = self.values[present]
+            index = slot_index(self.first, self.last)[present]
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+class FullRangeFeatures:
+    """
+    The store data of a whole backtest joined on the slot grid once, instead of reading the stores for every iteration.
+    frame() cuts out what assemble_features() gives for a window. A horizon cutoff hides prices and gas prices from a slot
+    on by masking them, like the stores do with horizon_cutoff
+    """
+
+    # slots [first, last), column-major, gas prices not filled
+    first: int
+    last: int
+    values: np.ndarray
+    # slots with data, per store
+    masks: dict[str, np.ndarray]
+    columns: dict[str, tuple[str, ...]]
+    # first column of each store in values
+    offsets: dict[str, int]
+
+    # stores whose data is behind a horizon cutoff
+    CUT = ("prices", "gas")
+
+    def __init__(self, slots: dict[str, SlotFrame], first: int, last: int):
+        """
+        slots like FeatureMatrix.update(), covering [first, last)
+        """
+        order = [name for name in ("weather", "aux", "entsoe", "gas", "prices") if name in slots]
+        self.first, self.last = first, last
+        self.columns = {name: slots[name].columns for name in order}
+        self.values = np.full((last - first, sum(len(c) for c in self.columns.values())), np.nan, order="F")
+        self.masks = {}
+        self.offsets = {}
+        col = 0
+        for name in order:
+            width = len(self.columns[name])
+            self.values[:, col:col + width] = slots[name].window(first, last)
+            self.masks[name] = slots[name].row_mask(first, last)
+            self.offsets[name] = col
+            col += width
+
+    def frame(self, first: int, last: int, output_first: int, hidden_from: int | None = None) -> pd.DataFrame:
+        """
+        assemble_features() of slots [first, last) with output from output_first, with the prices and gas prices of
+        slots >= hidden_from removed. ValueError if the window is not in the matrix
+        """
+        if first < self.first or last > self.last:
+            raise ValueError("window is outside of the precomputed range")
+        i, j = first - self.first, last - self.first
+        masks = {name: mask[i:j] for name, mask in self.masks.items()}
+        if hidden_from is not None:
+            for name in self.CUT:
+                if name in masks:
+                    masks[name] = masks[name].copy()
+                    masks[name][max(0, hidden_from - first):] = False
+        order = list(self.columns)
+        if "entsoe" in masks and not masks["entsoe"].any():
+            order.remove("entsoe")
+        columns = [c for name in order for c in self.columns[name]]
+
+        rows = np.logical_or.reduce([masks[name] for name in order if name != "gas"])
+        rows[:max(0, min(output_first, last) - first)] = False
+        present = np.flatnonzero(rows)
+        if len(present) == 0:
+            return pd.DataFrame(np.empty((0, len(columns))), index=slot_index(0, 0), columns=columns)
+
+        start, end = int(present[0]), int(present[-1]) + 1
+        values = np.empty((end - start, len(columns)), order="F")
+        col = 0
+        for name in order:
+            width = len(self.columns[name])
+            part = self.values[i:j, self.offsets[name]:self.offsets[name] + width]
+            if name == "gas":
+                # forward filled along the weather rows of the window, from its start
+                weather = masks["weather"]
+                filled = np.full(part.shape, np.nan)
+                filled[weather] = ffill(np.where(masks["gas"][:, None], part, np.nan)[weather])
+                values[:, col:col + width] = filled[start:end]
+            elif name in self.CUT:
+                values[:, col:col + width] = np.where(masks[name][start:end, None], part[start:end], np.nan)
+            else:
+                values[:, col:col + width] = part[start:end]
+            col += width
+
+        index = slot_index(first + start, first + end)
+        keep = rows[start:end]
+        if not keep.all():
+            values = values[keep]
+            index = index[keep]
+        return pd.DataFrame(values, index=index, columns=columns, copy=False)
@@ -1,101 +1,302 @@
 import asyncio
-import json
+import glob
+import hashlib
 import logging
-import re
+import os
 from datetime import datetime, timedelta, timezone
-from typing import override
+from typing import Self, override
 
-import aiohttp
+import numpy as np
 import pandas as pd
 
-from .datastore import DataStore
-from .priceregion import PriceRegion
+from .datastore import DataSnapshot, DataStore
+from .http import HttpCacheMiss, fetch
+from .priceregion import PriceRegion, PriceRegionName
+from .workers import run_cpu
 
 log = logging.getLogger(__name__)
 
-class GasPriceStore(DataStore):
+
+_JS_NOISE = str.maketrans("", "", "'\" \t\r\n")
+
+def _js_array(txt: str, start: int) -> str:
     """
-    Fetches and caches natural gas prices from bundesnetzagentur.de. Only German gas prices supported for now, but should serve as a 
-    rough indication for other markets, too.
+    Content of the JS array literal that follows txt[start:], without quotes and whitespace
+    """
+    begin = txt.index("[", start) + 1
+    end = txt.index("]", begin)
+    return txt[begin:end].translate(_JS_NOISE)
+
+
+def _parse_dates(labels: str) -> np.ndarray:
+    """
+    Parse comma separated dd.mm.yyyy labels to datetime64[D]. Malformed dates are NaT
+    """
+    raw = np.frombuffer(labels.encode("ascii", errors="replace"), dtype=np.uint8)
+    if (len(raw) + 1) % 11 != 0:
+        # not fixed width - let pandas figure it out
+        return pd.to_datetime(labels.split(","), format="%d.%m.%Y", errors="coerce").to_numpy().astype("M8[D]")
+
+    chars = np.append(raw, ord(",")).reshape(-1, 11)
+    digits = chars[:, [0, 1, 3, 4, 6, 7, 8, 9]].astype(np.int64) - ord("0")
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1) & (chars[:, 2] == ord(".")) & (chars[:, 5] == ord("."))
+    day = digits[:, 0] * 10 + digits[:, 1]
+    month = digits[:, 2] * 10 + digits[:, 3]
+    year = digits[:, 4] * 1000 + digits[:, 5] * 100 + digits[:, 6] * 10 + digits[:, 7]
+    valid &= (month >= 1) & (month <= 12)
+    months = (np.where(valid, year, 1970) - 1970).astype("M8[Y]").astype("M8[M]") + (np.where(valid, month, 1) - 1).astype("m8[M]")
+    days_in_month = ((months + np.timedelta64(1, "M")).astype("M8[D]") - months.astype("M8[D]")).astype(np.int64)
+    valid &= (day >= 1) & (day <= days_in_month)
+    dates = months.astype("M8[D]") + (np.where(valid, day, 1) - 1).astype("m8[D]")
+    dates[~valid] = np.datetime64("NaT", "D")
+    return dates
+
+
+def extract_gas_prices(txt: str) -> pd.DataFrame | None:
+    """
+    Extract the daily THE Future (M+1) prices from the Bundesnetzagentur page, resampled to 15 minutes.
+    Prices are directly embedded in the HTML as JS chart export objects - locate the one containing the series by plain
+    string search instead of parsing the page.
+    """
+    series_pos = txt.rfind("'THE Future (M+1)'")
+    if series_pos < 0:
+        return None
+    export_pos = txt.rfind("_export", 0, series_pos)
+    if export_pos < 0:
+        return None
+
+    labels = _js_array(txt, txt.index("labels:", export_pos))
+    dates = _parse_dates(labels)
+    # missing days are empty array elements
+    prices = np.array([p if p and p != "null" else "nan" for p in _js_array(txt, txt.index("data:", series_pos)).split(",")], dtype=np.float64)
+    n = min(len(dates), len(prices))
+    dates, prices = dates[:n], prices[:n]
+
+    malformed = np.isnat(dates)
+    if malformed.any():
+        log.warning(f"skipping {malformed.sum()} gas prices with malformed dates: {np.array(labels.split(','))[:n][malformed][:5].tolist()}")
+        dates, prices = dates[~malformed], prices[~malformed]
+
+    df = pd.DataFrame({"gasprice": prices}, index=pd.DatetimeIndex(dates.astype("M8[us]")).tz_localize("UTC"))
+    df = df.dropna()
+    if len(df) == 0:
+        return None
+    df = df[~df.index.duplicated(keep="last")].sort_index()
+    return df.resample('15min').ffill()
+
+
+class GasPriceSource(DataStore):
+    """
+    Process-wide natural gas price data from bundesnetzagentur.de, shared by the GasPriceStore of all regions.
+    The page is revalidated with ETag/If-Modified-Since and only parsed again if it actually changed.
     https://www.bundesnetzagentur.de/DE/Gasversorgung/aktuelle_gasversorgung/_svg/Gaspreise/Gaspreise.html
     """
 
-    data : pd.DataFrame
-    region : PriceRegion
-    storage_dir : str|None
+    url: str = os.getenv("EPEXPREDICTOR_GASPRICE_URL", "https://www.bundesnetzagentur.de/DE/Gasversorgung/aktuelle_gasversorgung/_svg/Gaspreise/Gaspreise.html")
+    http_cache_ttl = timedelta(hours=1)
+    request_timeout = 30
 
-    update_lock: asyncio.Lock
-    
+    etag: str | None
+    last_modified: str | None
+    # sha256 of the last parsed page and its parsed prices
+    page_hash: str | None
+    parsed: pd.DataFrame | None
 
-    def __init__(self, region : PriceRegion, storage_dir=None):
-        super().__init__(region, storage_dir, "gasprices")
-        self.update_lock = asyncio.Lock()
+    loaded: bool
 
+    def __init__(self, storage_dir: str | None = None):
+        super().__init__(PriceRegionName.DE.to_region(), storage_dir, "gasprices")
+        self.etag = None
+        self.last_modified = None
+        self.page_hash = None
+        self.parsed = None
+        self.loaded = False
 
 
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+        """
+        The page only allows downloading all prices at once, the range is ignored
+        """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+
+        log.info(f"Fetching natural gas price data: {self.url}")
+        resp = await fetch(self.url, headers=headers, timeout=self.request_timeout, ttl=self.http_cache_ttl)
+        if resp.status == 304:
+            log.info("natural gas price page not modified")
+            return self.parsed
+        resp.raise_for_status()
+        self.etag = resp.headers.get("ETag")
+        self.last_modified = resp.headers.get("Last-Modified")
+
+        page_hash = hashlib.sha256(resp.text.encode()).hexdigest()
+        if page_hash != self.page_hash:
+            self.parsed = await run_cpu(extract_gas_prices, resp.text)
+            self.page_hash = page_hash
+        return self.parsed
+
+    @override
+    def gen_backfill_chunks(self, start: datetime, end: datetime) -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+        # one download always covers everything
+        return self.gen_missing_date_ranges(start, end)[:1]
+
     async def fetch_missing_data(self, start: datetime, end: datetime) -> bool:
         async with self.update_lock:
-            if not self.region.use_de_nat_gas_price:
-                return False
-
             start = start.astimezone(timezone.utc)
             end = end.astimezone(timezone.utc)
 
             updated = False
 
-            for rstart, rend in self.gen_missing_date_ranges(start, end):
-
-                #tzgerman = PriceRegionName.DE.to_region().get_timezone_info()
-                #qstart = rstart - timedelta(days=5) # sometimes a few days are missing - make sure we always try to cover the requested time range
-                #qend = rend + timedelta(days=5)
-                #start_formatted = qstart.astimezone(tzgerman).strftime("%d.%m.%Y")
-                #end_formatted = qend.astimezone(tzgerman).strftime("%d.%m.%Y")
-
-                #url = f"https://www.bundesnetzagentur.de/_tools/SVG/js2/_functions/json.html?view=json&id=870302&xMin={start_formatted}&xMax={end_formatted}&singleType=1"
-                url = "https://www.bundesnetzagentur.de/DE/Gasversorgung/aktuelle_gasversorgung/_svg/Gaspreise/Gaspreise.html"
-                log.info(f"{self.region.bidding_zone_entsoe}: Fetching natural gas price data: {url}")
-
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as resp:
-                        txt = await resp.text()
-                        try:
-                            # Super ugly: prices are directly embedded in the HTML as JS objects.. ugly hackery to extract the wanted data
-                            pattern = re.compile(r"data_myChartId_.*_export\s*= [\w\W]*?labels: (?P<labels>.*?\])[\w\W]*?THE Future \(M\+1\)[\w\W]*?data: (?P<data>.*?\])")
-                            for match in pattern.finditer(txt):
-                                timestamps = json.loads(match.group("labels").replace("'", "\""))
-                                prices = json.loads(match.group("data").replace(" ,", "null,"))
-
-                            # data = json.loads(txt)
-                            # timestamps = data["labels"]
-                            # prices = data["datasets"][1]["data"]
-                            pricedict = {}
-
-                            for i, t in enumerate(timestamps):
-                                gasprice = prices[i]
-                                if isinstance(gasprice, float): # sometimes "null" ??
-                                    time = pd.to_datetime(datetime.strptime(t, "%d.%m.%Y").replace(tzinfo=timezone.utc))
-                                    pricedict[time] = gasprice
-                            
-                            df = pd.DataFrame.from_dict(pricedict, orient="index", columns=["gasprice"])
-                            df = df.resample('15min').ffill()
-
-                            updated = self._update_data(df) or updated
-                        except Exception as e:
-                            log.warning(f"{self.region.bidding_zone_entsoe}: failed to update gas prices. Probably no data available for given time range - ignoring error: {e}")
-
-                # gen_missing_date_ranges is only used to detect if there is anything missing at all. API only allows downloading all prices at once, so we break
-                # after one iteration
-                break
-                        
-
-        
+            # gen_missing_date_ranges is only used to detect if there is anything missing at all. API only allows downloading all prices at once
+            missing = self.gen_missing_date_ranges(start, end)
+            if len(missing) > 0:
+                try:
+                    df = await self.fetch_range(*missing[0])
+                    if df is not None:
+                        updated = await self.update_data(df)
+                except HttpCacheMiss:
+                    raise
+                except Exception as e:
+                    log.warning(f"failed to update gas prices. Probably no data available for given time range - ignoring error: {e}")
+
             if updated:
-                log.info(f"{self.region.bidding_zone_entsoe}: gas price data updated")
+                log.info("gas price data updated")
                 await self.serialize()
 
             return updated
 
+    @override
+    async def load(self) -> Self:
+        # every region's store asks for it, only load once
+        async with self.update_lock:
+            if not self.loaded:
+                await asyncio.to_thread(self.migrate_region_files)
+                await super().load()
+                self.loaded = True
+        return self
+
+    def migrate_region_files(self):
+        """
+        Before the source was shared, every region persisted its own copy as gasprices_<zone>. Take over the newest one
+        if there is no shared file yet, and delete the others
+        """
+        fn = self.get_storage_file()
+        if fn is None:
+            return
+        old = [f for f in glob.glob(f"{self.storage_dir}/{self.storage_fn_prefix}_*.json.gz") if f != fn]
+        if len(old) == 0:
+            return
+        if not os.path.exists(fn):
+            newest = max(old, key=os.path.getmtime)
+            log.info(f"taking over gas prices from {newest}")
+            os.replace(newest, fn)
+            old.remove(newest)
+        for f in old:
+            log.info(f"removing obsolete gas price file {f}")
+            os.remove(f)
+
+    @override
+    def get_next_horizon_revalidation_time(self) -> datetime | None:
+        return datetime.now(timezone.utc) + timedelta(hours=12)
+
+
+_sources: dict[str | None, GasPriceSource] = {}
+
+def get_gas_price_source(storage_dir: str | None = None) -> GasPriceSource:
+    """
+    Shared gas price source, one per storage directory
+    """
+    source = _sources.get(storage_dir)
+    if source is None:
+        source = _sources[storage_dir] = GasPriceSource(storage_dir)
+    return source
+
+
+class GasPriceStore(DataStore):
+    """
+    Natural gas prices for one region. Only German gas prices supported for now, but should serve as a
+    rough indication for other markets, too.
+    A view of the shared GasPriceSource: data lives in the source, horizon handling is per region.
+    Regions without use_de_nat_gas_price don't create the source at all and stay empty.
+    """
+
+    region : PriceRegion
+    storage_dir : str|None
+    source: GasPriceSource | None
+
+
+    def __init__(self, region : PriceRegion, storage_dir=None):
+        super().__init__(region, storage_dir, None)
+        self.source = get_gas_price_source(storage_dir) if region.use_de_nat_gas_price else None
+
+    # DataStore.__init__ assigns empty defaults before the view is bound to its source - those stay with the view,
+    # like everything of regions without gas prices
+    @property
+    def snapshot(self) -> DataSnapshot:
+        source = self.__dict__.get("source")
+        return source.snapshot if source is not None else self._snapshot
+
+    @snapshot.setter
+    def snapshot(self, snapshot: DataSnapshot):
+        source = self.__dict__.get("source")
+        if source is not None:
+            source.snapshot = snapshot
+        else:
+            self._snapshot = snapshot
+
+    @property
+    def last_updated(self) -> datetime:
+        source = self.__dict__.get("source")
+        return source.last_updated if source is not None else self._last_updated
+
+    @last_updated.setter
+    def last_updated(self, ts: datetime):
+        source = self.__dict__.get("source")
+        if source is not None:
+            source.last_updated = ts
+        else:
+            self._last_updated = ts
+
+
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+        if self.source is None:
+            return None
+        return await self.source.fetch_range(rstart, rend)
+
+    async def fetch_missing_data(self, start: datetime, end: datetime) -> bool:
+        if self.source is None:
+            return False
+        # coalesce with the other regions' requests, too
+        return await self.source.fetch_single_flight(start, end)
+
+    @override
+    async def backfill(self, start: datetime, end: datetime) -> bool:
+        if self.source is None:
+            return False
+        return await self.source.backfill(*self.apply_horizon(start.astimezone(timezone.utc), end.astimezone(timezone.utc)))
+
+    @override
+    def fetch_stats(self) -> dict:
+        if self.source is None:
+            return super().fetch_stats()
+        return self.source.fetch_stats()
+
+    @override
+    async def serialize(self):
+        if self.source is not None:
+            await self.source.serialize()
+
+    @override
+    async def load(self) -> Self:
+        if self.source is not None:
+            await self.source.load()
+        return self
 
     @override
     def get_next_horizon_revalidation_time(self) -> datetime | None:
-        return datetime.now(timezone.utc) + timedelta(hours=12)
\ No newline at end of file
+        if self.source is None:
+            return None
+        return self.source.get_next_horizon_revalidation_time()
@@ -0,0 +1,217 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import aiohttp
+
+from .resilience import DeadlineExceeded, get_circuit_breaker, time_left
+
+log = logging.getLogger(__name__)
+
+# Upper bound of parallel connections to all upstream hosts together
+MAX_CONNECTIONS = 32
+
+# Upstream data older than this doesn't change anymore - cached responses for it never expire
+HISTORY_AGE = timedelta(days=2)
+
+# Query parameters that must never end up in cache keys or files
+SECRET_PARAMS = {"securityToken"}
+
+# Response headers passed on to callers (and kept in the cache)
+RESPONSE_HEADERS = ["Content-Type", "ETag", "Last-Modified", "Retry-After"]
+
+# energy-charts answers 404 for days without prices yet - cache those too, so replays see the same
+CACHEABLE_STATUS = {200, 404}
+
+_session: aiohttp.ClientSession | None = None
+_session_loop: asyncio.AbstractEventLoop | None = None
+
+
+class HttpStatusError(Exception):
+    pass
+
+class HttpCacheMiss(Exception):
+    """
+    Raised in replay mode if a request is not in the cache. Data stores let it through instead of logging it away
+    """
+    pass
+
+
+@dataclass
+class HttpResponse:
+    url: str
+    status: int
+    text: str
+    headers: dict[str, str] = field(default_factory=dict)
+    from_cache: bool = False
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HttpStatusError(f"HTTP {self.status} for {self.url}: {self.text[:200]}")
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Process-wide HTTP connection pool, so upstream connections (and TLS handshakes) are reused across requests and regions.
+    Bound to the running event loop - a new pool is created if the loop changed.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+        _session_loop = loop
+    return _session
+
+
+async def close_session():
+    global _session, _session_loop
+    if _session is not None and not _session.closed and _session_loop is asyncio.get_running_loop():
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+def cache_dir() -> str | None:
+    return os.getenv("EPEXPREDICTOR_HTTP_CACHE_DIR") or None
+
+def cache_mode() -> str:
+    """
+    off: no caching. readwrite: serve fresh responses from the cache, store everything fetched.
+    replay: never touch the network, raise HttpCacheMiss for anything not cached.
+    Defaults to readwrite if a cache dir is configured.
+    """
+    mode = os.getenv("EPEXPREDICTOR_HTTP_CACHE_MODE") or ("readwrite" if cache_dir() is not None else "off")
+    if mode not in ("off", "readwrite", "replay"):
+        raise ValueError(f"invalid EPEXPREDICTOR_HTTP_CACHE_MODE {mode}")
+    if mode != "off" and cache_dir() is None:
+        raise ValueError(f"EPEXPREDICTOR_HTTP_CACHE_MODE={mode} requires EPEXPREDICTOR_HTTP_CACHE_DIR")
+    return mode
+
+
+def range_ttl(end: datetime, recent: timedelta) -> timedelta | None:
+    """
+    Cache TTL for a query of data up to end: history never expires, recent data after the given time
+    """
+    return None if end < datetime.now(timezone.utc) - HISTORY_AGE else recent
+
+
+def normalize_url(url: str, params: dict[str, str] | None = None) -> str:
+    """
+    Canonical form of url + params: lowercase scheme/host, sorted query, secrets removed
+    """
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True) + list((params or {}).items())
+    query = sorted((k, str(v)) for k, v in query if k not in SECRET_PARAMS)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or "/", urlencode(query), ""))
+
+def cache_key(url: str, params: dict[str, str] | None = None) -> str:
+    return hashlib.sha256(normalize_url(url, params).encode()).hexdigest()
+
+
+def _cache_file(key: str) -> str:
+    directory = cache_dir()
+    assert directory is not None
+    return f"{directory}/{key[:2]}/{key}.json.gz"
+
+def _read_cache(key: str) -> dict | None:
+    fn = _cache_file(key)
+    if not os.path.exists(fn):
+        return None
+    with gzip.open(fn, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+def _write_cache(key: str, entry: dict):
+    fn = _cache_file(key)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(entry, f)
+    os.replace(tmp, fn)
+
+
+async def get_cached(url: str, params: dict[str, str] | None = None, ttl: timedelta | None = timedelta(0)) -> HttpResponse | None:
+    """
+    Cached response for the request if it is still fresh (always in replay mode). ttl=None never expires
+    """
+    mode = cache_mode()
+    if mode == "off":
+        return None
+
+    key = cache_key(url, params)
+    entry = await asyncio.to_thread(_read_cache, key)
+    if entry is None:
+        if mode == "replay":
+            msg = f"replay mode: no cached response for {normalize_url(url, params)}"
+            log.error(msg)
+            raise HttpCacheMiss(msg)
+        return None
+
+    if mode != "replay" and ttl is not None and time.time() - entry["fetched"] >= ttl.total_seconds():
+        return None
+    return HttpResponse(entry["url"], entry["status"], entry["text"], entry["headers"], from_cache=True)
+
+
+async def fetch(url: str, params: dict[str, str] | None = None, headers: dict[str, str] | None = None,
+                timeout: float | None = None, ttl: timedelta | None = timedelta(0), lookup: bool = True) -> HttpResponse:
+    """
+    GET url through the shared connection pool and the response cache.
+    Responses are recorded if caching is enabled, but only served from the cache within ttl.
+    ttl=None: never expires, for data that doesn't change anymore
+    lookup=False: the caller already missed with get_cached(), don't read the cache again
+    The request is bounded by the current deadline (see resilience.deadline) and guarded by the host's circuit breaker:
+    network errors and 5xx responses count as failures, CircuitOpenError is raised while the circuit is open.
+    """
+    cached = await get_cached(url, params, ttl) if lookup else None
+    if cached is not None:
+        return cached
+
+    left = time_left()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"deadline exceeded before requesting {normalize_url(url, params)}")
+    deadline_bound = left is not None and (timeout is None or left < timeout)
+    if deadline_bound:
+        timeout = left
+
+    breaker = get_circuit_breaker(urlsplit(url).netloc.lower())
+    breaker.acquire()
+
+    kwargs = {"timeout": aiohttp.ClientTimeout(total=timeout)} if timeout is not None else {}
+    try:
+        async with get_session().get(url, params=params, headers=headers, **kwargs) as resp:
+            response = HttpResponse(
+                normalize_url(url, params),
+                resp.status,
+                await resp.text(),
+                {h: resp.headers[h] for h in RESPONSE_HEADERS if h in resp.headers},
+            )
+    except TimeoutError as e:
+        if deadline_bound:
+            # our own impatience, not the upstream's fault
+            breaker.abandon()
+            raise DeadlineExceeded(f"deadline exceeded while requesting {normalize_url(url, params)}") from e
+        breaker.failure()
+        raise
+    except aiohttp.ClientError:
+        breaker.failure()
+        raise
+    except BaseException:
+        breaker.abandon()
+        raise
+
+    if response.status >= 500:
+        breaker.failure()
+    else:
+        breaker.success()
+
+    if response.status in CACHEABLE_STATUS and cache_mode() == "readwrite":
+        entry = {"url": response.url, "status": response.status, "text": response.text, "headers": response.headers, "fetched": time.time()}
+        await asyncio.to_thread(_write_cache, cache_key(url, params), entry)
+    return response
@@ -0,0 +1,45 @@
+import statistics
+from collections import deque
+
+
+class LatencyStats:
+    """
+    Rolling latency statistics over the last n observations
+    """
+
+    samples: deque[float]
+    count: int
+    failures: int
+    # observations that were cut short: their samples are lower bounds of the real latency
+    cancelled: int
+
+    def __init__(self, window: int = 200):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    def record(self, seconds: float, ok: bool = True, cancelled: bool = False):
+        self.samples.append(seconds)
+        self.count += 1
+        if not ok:
+            self.failures += 1
+        if cancelled:
+            self.cancelled += 1
+
+    def quantile(self, q: float) -> float | None:
+        if len(self.samples) == 0:
+            return None
+        if len(self.samples) == 1:
+            return round(self.samples[0], 3)
+        return round(statistics.quantiles(self.samples, n=100, method="inclusive")[round(q * 100) - 1], 3)
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+            "mean": round(statistics.fmean(self.samples), 3) if len(self.samples) > 0 else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+        }
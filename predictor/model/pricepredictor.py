@@ -3,22 +3,84 @@
 import asyncio
 import logging
 import math
+from time import perf_counter
 from datetime import datetime, timedelta, timezone
 from typing import Dict, cast
 
+import numpy as np
 import pandas as pd
 import lightgbm as lgb
 
 from .auxdatastore import AuxDataStore
+from .datastore import DataStore
 from .priceregion import PriceRegion
 from .pricestore import PriceStore
 from .weatherstore import WeatherStore
 from .entsoedatastore import EntsoeDataStore
 from .gaspricestore import GasPriceStore
+from .featurematrix import FeatureMatrix
+from .cpubudget import INFERENCE_THREADS, reserve_threads
+from .training import FULL_FIT_DAYS, TRAINING_MODE, Binning, TimeBox, train_model
+from .treeinference import INFERENCE_ENGINE, CompiledForest, compile_booster
+from .slotgrid import SlotFrame, ffill, slot_index, slot_range
+from .workers import run_cpu
 
 log = logging.getLogger(__name__)
 
 
+def assemble_features(weather: SlotFrame, aux: SlotFrame, entsoe: SlotFrame | None, gas: SlotFrame | None, prices: SlotFrame,
+                      first: int, last: int, output_first: int) -> pd.DataFrame:
+    """
+    Join the store data of slots [first, last) into one feature frame, keeping slots >= output_first.
+    Rows are all slots any store except gas has data for. Gas prices are forward filled along the weather rows
+    """
+    if entsoe is not None and not entsoe.slice(first, last).rows.any():
+        entsoe = None
+    frames = [f for f in (weather, aux, entsoe, gas, prices) if f is not None]
+    columns = [c for frame in frames for c in frame.columns]
+
+    rows = np.zeros(last - first, dtype=bool)
+    for frame in (weather, aux, entsoe, prices):
+        if frame is not None:
+            rows |= frame.row_mask(first, last)
+    rows[:max(0, min(output_first, last) - first)] = False
+
+    present = np.flatnonzero(rows)
+    if len(present) == 0:
+        return pd.DataFrame(np.empty((0, len(columns))), index=slot_index(0, 0), columns=columns)
+
+    # only allocate the span that has output rows, that's usually all of it
+    start, end = first + int(present[0]), first + int(present[-1]) + 1
+    values = np.full((end - start, len(columns)), np.nan, order="F")
+    col = 0
+    for frame in frames:
+        width = len(frame.columns)
+        if frame is gas:
+            weather_rows = weather.row_mask(first, last)
+            filled = np.full((last - first, width), np.nan)
+            filled[weather_rows] = ffill(gas.window(first, last)[weather_rows])
+            values[:, col:col + width] = filled[start - first:end - first]
+        else:
+            part = frame.slice(start, end)
+            values[part.base - start:part.end - start, col:col + width] = part.values
+        col += width
+
+    index = slot_index(start, end)
+    keep = rows[start - first:end - first]
+    if not keep.all():
+        values = values[keep]
+        index = index[keep]
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def feature_start(actual_start: datetime) -> datetime:
+    """
+    Where to start reading the stores for features from actual_start on
+    """
+    # gas prices are usually not available for today or the last few days. If forecast range is in the future, we might have nothing to ffill. Ensure we do
+    return min(datetime.now(timezone.utc) - timedelta(days=14), actual_start)
+
+
 class PricePredictor:
     region: PriceRegion
     weatherstore: WeatherStore
@@ -30,9 +92,43 @@ class PricePredictor:
     traindata: pd.DataFrame | None = None
 
     predictor: lgb.Booster | None = None
-
-    def __init__(self, region: PriceRegion, storage_dir: str | None = None):
+    # "lightgbm" or "compiled", see treeinference.INFERENCE_ENGINE
+    inference_engine: str
+    # predictor compiled, with the compiled engine. None: predict with LightGBM
+    compiled: CompiledForest | None = None
+    # snapshot version of each data store the model was trained on (see datastores())
+    trained_on: dict[str, int] | None = None
+    # training window features, only patched where the stores changed between trainings
+    trainfeatures: FeatureMatrix
+    # feature bins of the last full fit, reused by the next trainings
+    binning: Binning
+    # boosting rounds of the last full fit, the next one starts from there
+    rounds: int | None = None
+
+    # "full" or "incremental", see training.TRAINING_MODE
+    training_mode: str
+    full_fit_days: int
+    # end of the training data of the last full fit
+    full_fit_until: pd.Timestamp | None = None
+    # what the last training did and how long it took
+    last_fit: str | None = None
+    last_fit_seconds: float | None = None
+    # seconds a training may take before boosting stops early (training.training_budget()), None: no limit
+    training_budget: float | None
+    # the last training ran out of time, its model has fewer rounds than it should. The next one is a full fit
+    degraded: bool = False
+
+    def __init__(self, region: PriceRegion, storage_dir: str | None = None, training_mode: str = TRAINING_MODE, full_fit_days: int = FULL_FIT_DAYS,
+                 training_budget: float | None = None, inference_engine: str = INFERENCE_ENGINE):
+        if inference_engine not in ("lightgbm", "compiled"):
+            raise ValueError(f"unknown inference engine {inference_engine}")
         self.region = region
+        self.training_budget = training_budget
+        self.inference_engine = inference_engine
+        self.trainfeatures = FeatureMatrix()
+        self.binning = Binning()
+        self.training_mode = training_mode
+        self.full_fit_days = full_fit_days
         self.weatherstore = WeatherStore(region, storage_dir)
         self.pricestore = PriceStore(region, storage_dir)
         self.auxstore = AuxDataStore(region, storage_dir)
@@ -49,9 +145,31 @@ class PricePredictor:
         )
         return self
     
+    async def backfill(self, start: datetime, end: datetime) -> bool:
+        """
+        Fetch all missing history of all stores concurrently. Much faster than letting get_data() fill gaps range by range
+        """
+        results = await asyncio.gather(
+            self.weatherstore.backfill(start, end),
+            self.pricestore.backfill(start, end),
+            self.auxstore.backfill(start, end),
+            self.entsoestore.backfill(start, end),
+            self.gasstore.backfill(start, end)
+        )
+        return any(results)
+
     def last_data_update(self) -> datetime:
         return max(self.weatherstore.last_updated, self.pricestore.last_updated, self.entsoestore.last_updated, self.gasstore.last_updated)
 
+    def datastores(self) -> dict[str, DataStore]:
+        return {
+            "weather": self.weatherstore,
+            "prices": self.pricestore,
+            "aux": self.auxstore,
+            "entsoe": self.entsoestore,
+            "gas": self.gasstore,
+        }
+
     def use_datastores_from(self, other: "PricePredictor"):
         assert self.region.bidding_zone_entsoe == other.region.bidding_zone_entsoe
         self.weatherstore = other.weatherstore
@@ -64,23 +182,62 @@ class PricePredictor:
         return self.predictor is not None
 
 
-    async def train(self, start: datetime, end: datetime):
-        self.traindata = await self.prepare_dataframe(start, end)
-        if self.traindata is None:
+    async def train(self, start: datetime, end: datetime, budget: float | None = None):
+        """
+        Train on [start, end]. budget: seconds boosting may take, default training_budget
+        """
+        traindata, versions = await self.prepare_versioned_dataframe(start, end, self.trainfeatures)
+        if traindata is None:
             return
-        self.traindata.dropna(inplace=True)
+        await self.fit(traindata, versions, budget)
 
-        params = self.traindata.drop(columns=["price"])
-        output = self.traindata["price"]
-
-        lgb_dataset = lgb.Dataset(params, label=output)
-        params_lgb = {
-            "force_col_wise": True,
-            "verbosity": -1,
+    async def fit(self, traindata: pd.DataFrame, versions: dict[str, int] | None = None, budget: float | None = None):
+        """
+        train() on a prepared feature frame. versions: what prepare_versioned_dataframe() said it was made of
+        """
+        init_model, new_since = self._incremental_base(traindata)
+        timebox = TimeBox(budget if budget is not None else self.training_budget)
+        started = perf_counter()
+        used, model = await train_model(traindata, init_model, new_since, self.binning, self.rounds, timebox)
+        self.last_fit_seconds = perf_counter() - started
+        compiled = await compile_booster(model) if self.inference_engine == "compiled" else None
+        # the previous model keeps serving predictions until the new one is swapped in
+        self.traindata, self.predictor, self.compiled = used, model, compiled
+        self.trained_on = versions
+        self.last_fit = "full" if init_model is None else "incremental"
+        self.degraded = timebox.expired
+        if timebox.expired:
+            log.warning(f"{self.region.bidding_zone_entsoe}: {self.last_fit} training ran out of its {timebox.seconds}s budget "
+                        f"after {self.predictor.num_trees() - (init_model.num_trees() if init_model is not None else 0)} boosting rounds")
+        elif init_model is None and len(self.traindata) > 0:
+            self.full_fit_until = self.traindata.index[-1]
+            self.rounds = self.predictor.num_trees()
+
+    def training_stats(self) -> dict:
+        return {
+            "budget": self.training_budget,
+            "degraded": self.degraded,
+            "last_fit": self.last_fit,
+            "last_fit_seconds": self.last_fit_seconds,
+            "rounds": self.predictor.num_trees() if self.predictor is not None else None,
         }
 
-        self.predictor = await asyncio.to_thread(lgb.train, params=params_lgb, train_set=lgb_dataset)
-
+    def _incremental_base(self, traindata: pd.DataFrame) -> tuple[lgb.Booster | None, pd.Timestamp | None]:
+        """
+        Model to continue and the end of the data it has seen, or None, None if the next training must be a full fit
+        """
+        if self.training_mode != "incremental" or self.predictor is None or self.traindata is None or self.full_fit_until is None:
+            return None, None
+        if self.degraded:
+            return None, None
+        if len(self.traindata) == 0 or self.predictor.feature_name() != [c for c in traindata.columns if c != "price"]:
+            return None, None
+        trained_until = self.traindata.index[-1]
+        until = traindata["price"].last_valid_index()
+        # going back in time, or drifted too far from the last full fit
+        if until is None or until < trained_until or until - self.full_fit_until >= timedelta(days=self.full_fit_days):
+            return None, None
+        return self.predictor, trained_until
 
 
     async def predict(self, start: datetime, end: datetime, fill_known=True) -> pd.DataFrame:
@@ -88,13 +245,33 @@ class PricePredictor:
 
         df = await self.prepare_dataframe(start, end)
         assert df is not None
+        return await self.predict_features(df, fill_known)
 
+    async def predict_features(self, df: pd.DataFrame, fill_known=True) -> pd.DataFrame:
+        """
+        predict() for a prepared feature frame
+        """
+        assert self.is_trained() and self.predictor is not None
+        compiled = self.compiled
+        # the compiled model runs single threaded
+        async with reserve_threads("inference", INFERENCE_THREADS if compiled is None else 1) as threads:
+            return await run_cpu(self._predict_frame, self.predictor, df, fill_known, threads, compiled)
+
+    @staticmethod
+    def _predict_frame(predictor: lgb.Booster, df: pd.DataFrame, fill_known: bool, num_threads: int,
+                       compiled: CompiledForest | None = None) -> pd.DataFrame:
+        """
+        Careful: runs in a worker thread
+        """
         prices_known = df["price"]
 
         params = df.drop(columns=["price"])
 
         resultdf = pd.DataFrame(index=params.index)
-        resultdf["price"] = self.predictor.predict(params)
+        if compiled is not None and compiled.feature_names == list(params.columns):
+            resultdf["price"] = compiled.predict(params.to_numpy(dtype=np.float64))
+        else:
+            resultdf["price"] = predictor.predict(params, num_threads=num_threads)
 
         if fill_known:
             resultdf.update(prices_known)
@@ -114,31 +291,40 @@ class PricePredictor:
 
 
     async def prepare_dataframe(self, actual_start: datetime, end: datetime) -> pd.DataFrame | None:
-        # gas prices are usually not available for today or the last few days. If forecast range is in the future, we might have nothing to ffill. Ensure we do
-        start = min(datetime.now(timezone.utc) - timedelta(days=14), actual_start)
-
-        weather, prices, auxdata = await asyncio.gather(
-            self.weatherstore.get_data(start, end),
-            self.pricestore.get_data(start, end),
-            self.auxstore.get_data(start, end)
-        )
-
-        df = pd.concat([weather, auxdata], axis=1, sort=True)
+        df, _ = await self.prepare_versioned_dataframe(actual_start, end)
+        return df
 
-        
+    async def prepare_versioned_dataframe(self, actual_start: datetime, end: datetime,
+                                          features: FeatureMatrix | None = None) -> tuple[pd.DataFrame | None, dict[str, int]]:
+        """
+        prepare_dataframe(), plus the snapshot version of each data store that went into it.
+        With features, the frame is assembled incrementally from what changed since the last call with the same matrix
+        """
+        start = feature_start(actual_start)
+        stores = self.feature_stores()
+        results = await asyncio.gather(*[store.get_versioned_slots(start, end) for store in stores.values()])
+        versions = {name: version for name, (version, _) in zip(stores, results)}
+        slots = {name: frame for name, (_, frame) in zip(stores, results)}
+
+        first, last = slot_range(start, end)
+        output_first = slot_range(actual_start, end)[0]
+        if features is None:
+            df = await run_cpu(assemble_features, slots["weather"], slots["aux"], slots.get("entsoe"), slots.get("gas"), slots["prices"],
+                               first, last, output_first)
+        else:
+            df = await run_cpu(features.update, self.datastores(), versions, slots, first, last, output_first)
+        return df, versions
+
+    def feature_stores(self) -> dict[str, DataStore]:
+        """
+        The datastores() the features of this region are made of
+        """
+        stores = {"weather": self.weatherstore, "prices": self.pricestore, "aux": self.auxstore}
         if self.region.use_entsoe_load_forecast:
-            entsoedata = await self.entsoestore.get_data(start, end)
-            if len(entsoedata) > 0:
-                df = pd.concat([df, entsoedata], axis=1, sort=True)
-
+            stores["entsoe"] = self.entsoestore
         if self.region.use_de_nat_gas_price:
-            gasprices = await self.gasstore.get_data(start, end)
-            gasprices = gasprices.reindex(weather.index).ffill()
-            df = pd.concat([df, gasprices], axis=1, sort=True)
-
-        df = pd.concat([df, prices], axis=1, sort=True)
-        df = df[actual_start:]
-        return df
+            stores["gas"] = self.gasstore
+        return stores
 
     async def refresh_forecasts(self, start : datetime, end: datetime):
         """
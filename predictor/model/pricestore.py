@@ -3,18 +3,21 @@ import json
 import logging
 from datetime import datetime, timedelta, timezone
 import os
-from typing import override
+import time
+from typing import Awaitable, Callable, override
 
-import aiohttp
-from aiohttp import ClientTimeout
-from entsoe import entsoe
 import pandas as pd
 
 from .datastore import DataStore
+from .entsoeclient import EntsoeClient
+from .http import HttpCacheMiss, fetch, range_ttl
+from .metrics import LatencyStats
 from .priceregion import PriceRegion
 
 log = logging.getLogger(__name__)
 
+ENERGYCHARTS_URL = os.getenv("EPEXPREDICTOR_ENERGYCHARTS_URL", "https://api.energy-charts.info")
+
 class PriceStore(DataStore):
     """
     Fetches and caches price info from api.energy-charts.info
@@ -25,20 +28,30 @@ class PriceStore(DataStore):
     region: PriceRegion
     storage_dir: str|None
 
-    update_lock: asyncio.Lock
-
     entsoe_api_key: str|None = None
-    
+
+    # If set, start the ENTSO-E query in parallel when energy-charts didn't answer within this many seconds
+    hedge_delay: float|None = None
+    provider_latency: dict[str, LatencyStats]
+
+    backfill_chunk = timedelta(days=30)
+    backfill_concurrency = 2
+    # day-ahead prices appear once a day, but we poll every few minutes when they are due
+    http_cache_ttl = timedelta(minutes=5)
+
 
     def __init__(self, region : PriceRegion, storage_dir=None):
         super().__init__(region, storage_dir, "prices_v3")
-        self.update_lock = asyncio.Lock()
 
         self.entsoe_api_key = os.getenv("EPEXPREDICTOR_ENTSOE_API_KEY", None)
         if self.entsoe_api_key is None or len(self.entsoe_api_key) == 0:
             self.entsoe_api_key = None
             log.warning("EPEXPREDICTOR_ENTSOE_API_KEY is not defined. Not all bidding zones are available.")
 
+        hedge_delay = os.getenv("EPEXPREDICTOR_PRICE_HEDGE_DELAY", "")
+        self.hedge_delay = float(hedge_delay) if len(hedge_delay) > 0 else None
+        self.provider_latency = {"energycharts": LatencyStats(), "entsoe": LatencyStats()}
+
     @override
     def get_next_horizon_revalidation_time(self) -> datetime | None:
         # Refresh more often when the horizon is fairly small (after 13:00 local time if the following day is not yet known)
@@ -65,7 +78,7 @@ class PriceStore(DataStore):
         Fetch missing price data from energy-charts.info or ENTSO-E.
         
         This method attempts to fetch price data from energy-charts.info first.
-        If energy-charts returns data but no update is necessary (i.e., _update_data returns False),
+        If energy-charts returns data but no update is necessary (i.e., update_data returns False),
         it will fall back to ENTSO-E to ensure we have the most recent data available.
         
         Args:
@@ -84,6 +97,9 @@ class PriceStore(DataStore):
 
             for rstart, rend in self.gen_missing_date_ranges(start, end):
                 checked = True
+                if self.hedge_delay is not None:
+                    updated |= await self._fetch_and_update_hedged(rstart, rend)
+                    continue
                 updated |= await self._fetch_and_update_from_energycharts(rstart, rend)
                 if not updated:
                     # If energy-charts didn't update anything, try ENTSO-E as fallback
@@ -92,7 +108,6 @@ class PriceStore(DataStore):
         
             if updated:
                 log.info(f"{self.region.bidding_zone_entsoe}: price data updated")
-                self.data.sort_index(inplace=True)
                 await self.serialize()
             elif checked:
                 log.info(f"{self.region.bidding_zone_entsoe}: unable to fetch prices - no newer prices available from any provider. Prices available until {self.get_last_known()}")
@@ -100,25 +115,95 @@ class PriceStore(DataStore):
 
     async def _fetch_and_update_from_energycharts(self, rstart: datetime, rend: datetime) -> bool:
         """Fetch price data from energy-charts and update cache if new data is available."""
-        prices = await self.fetch_prices_energycharts(rstart, rend)
+        prices = await self._timed("energycharts", self.fetch_prices_energycharts(rstart, rend))
         if prices is not None and len(prices) > 0:
             if self._is_invalid_zero_data(prices):
                 log.warning(f"{self.region.bidding_zone_entsoe}: discarding zero-price data from energy-charts")
                 return False
-            return self._update_data(prices)
+            return await self.update_data(prices)
         return False
 
     async def _fetch_and_update_from_entsoe(self, rstart: datetime, rend: datetime) -> bool:
         """Fetch price data from ENTSO-E and update cache if new data is available."""
         log.info(f"{self.region.bidding_zone_entsoe}: trying ENTSO-E fallback")
-        entsoe_prices = await self.fetch_prices_entsoe(rstart, rend)
+        entsoe_prices = await self._timed("entsoe", self.fetch_prices_entsoe(rstart, rend))
         if entsoe_prices is not None and len(entsoe_prices) > 0:
             if self._is_invalid_zero_data(entsoe_prices):
                 log.warning(f"{self.region.bidding_zone_entsoe}: discarding zero-price data from ENTSO-E")
                 return False
-            return self._update_data(entsoe_prices)
+            return await self.update_data(entsoe_prices)
         return False
 
+    async def _fetch_and_update_hedged(self, rstart: datetime, rend: datetime) -> bool:
+        """
+        Query energy-charts, and if it didn't answer within hedge_delay (or had nothing new), ENTSO-E in parallel.
+        The first valid result that updates the cache wins, the other query is cancelled.
+        """
+        providers: dict[str, Callable[[], Awaitable[pd.DataFrame | None]]] = {
+            "energycharts": lambda: self.fetch_prices_energycharts(rstart, rend),
+        }
+        if self.entsoe_api_key is not None:
+            providers["entsoe"] = lambda: self.fetch_prices_entsoe(rstart, rend)
+
+        tasks: dict[asyncio.Task, str] = {}
+        def start(provider: str) -> asyncio.Task:
+            task = asyncio.create_task(self._timed(provider, providers.pop(provider)()))
+            tasks[task] = provider
+            return task
+
+        pending = {start("energycharts")}
+        try:
+            while pending:
+                timeout = self.hedge_delay if "entsoe" in providers else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = tasks[task]
+                    prices = task.result()
+                    if prices is None or len(prices) == 0:
+                        continue
+                    if self._is_invalid_zero_data(prices):
+                        log.warning(f"{self.region.bidding_zone_entsoe}: discarding zero-price data from {provider}")
+                        continue
+                    if await self.update_data(prices):
+                        log.info(f"{self.region.bidding_zone_entsoe}: using prices from {provider}")
+                        return True
+
+                if "entsoe" in providers:
+                    # energy-charts is slow, or answered without anything new
+                    if len(done) == 0:
+                        log.info(f"{self.region.bidding_zone_entsoe}: no answer from energy-charts after {self.hedge_delay}s - hedging with ENTSO-E")
+                    pending.add(start("entsoe"))
+            return False
+        finally:
+            for task in pending:
+                task.cancel()
+            # the loser's cleanup (closing its connection) is done before we return
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _timed(self, provider: str, coro: Awaitable[pd.DataFrame | None]) -> pd.DataFrame | None:
+        """
+        Await coro and record its latency for the given provider. A None result counts as failure. A cancelled query took
+        at least as long as it ran, which is recorded, so the latencies of a slow provider that loses hedges aren't biased low
+        """
+        t = time.monotonic()
+        try:
+            result = await coro
+        except asyncio.CancelledError:
+            self.provider_latency[provider].record(time.monotonic() - t, cancelled=True)
+            raise
+        self.provider_latency[provider].record(time.monotonic() - t, ok=result is not None)
+        return result
+
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame | None:
+        """Fetch prices from energy-charts, falling back to ENTSO-E. Does not modify the store."""
+        prices = await self.fetch_prices_energycharts(rstart, rend)
+        if prices is not None and len(prices) > 0 and not self._is_invalid_zero_data(prices):
+            return prices
+        prices = await self.fetch_prices_entsoe(rstart, rend)
+        if prices is not None and len(prices) > 0 and not self._is_invalid_zero_data(prices):
+            return prices
+        return None
+
     def _is_invalid_zero_data(self, df: pd.DataFrame) -> bool:
         """Check if the last 24 hours of data are all zero (invalid)."""
         last_24h = df.tail(20 * 4)
@@ -135,28 +220,29 @@ class PriceStore(DataStore):
                 end_of_day = (rend.astimezone(tzlocal).replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).astimezone(timezone.utc)
                 start_formatted = start_of_day.isoformat().replace("+00:00", "Z")
                 end_formatted = end_of_day.isoformat().replace("+00:00", "Z")
-                url = f"https://api.energy-charts.info/price?bzn={self.region.bidding_zone_energycharts}&start={start_formatted}&end={end_formatted}"
+                url = f"{ENERGYCHARTS_URL}/price?bzn={self.region.bidding_zone_energycharts}&start={start_formatted}&end={end_formatted}"
                 log.info(f"{self.region.bidding_zone_entsoe}: fetching price data: {url}")
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers={"accept": "application/json"}, timeout=ClientTimeout(total=8)) as resp:
-                        txt = await resp.text()
-                        if "no content available" in txt:
-                            return None
-                        
-                        data = json.loads(txt)
-                        timestamps = data["unix_seconds"]
-                        prices = data["price"]
-                        df = pd.DataFrame.from_dict(dict(zip(timestamps, prices)), orient="index", columns=["price"])
-                        df.index = pd.to_datetime(df.index, unit="s", utc=True)
-                        df.index.name = "time"
-                        df["price"] = df["price"] / 10
-                        
-                        # for BE, a few hours are missing in late september.. make sure they are filled or stuff will get out of hand
-                        # TODO: this will become an issue if we ever have a region where a whole day or so is missing, and the df is empty.
-                        # will solve that when needed.
-                        df = df.sort_index().resample('15min').ffill().bfill()
-
-                        return df
+                resp = await fetch(url, headers={"accept": "application/json"}, timeout=8, ttl=range_ttl(end_of_day, self.http_cache_ttl))
+                txt = resp.text
+                if "no content available" in txt:
+                    return None
+
+                data = json.loads(txt)
+                timestamps = data["unix_seconds"]
+                prices = data["price"]
+                df = pd.DataFrame.from_dict(dict(zip(timestamps, prices)), orient="index", columns=["price"])
+                df.index = pd.to_datetime(df.index, unit="s", utc=True)
+                df.index.name = "time"
+                df["price"] = df["price"] / 10
+
+                # for BE, a few hours are missing in late september.. make sure they are filled or stuff will get out of hand
+                # TODO: this will become an issue if we ever have a region where a whole day or so is missing, and the df is empty.
+                # will solve that when needed.
+                df = df.sort_index().resample('15min').ffill().bfill()
+
+                return df
+        except HttpCacheMiss:
+            raise
         except Exception as e:
             log.error(f"{self.region.bidding_zone_entsoe}: failed to fetch prices from energy-charts: {e}")
 
@@ -169,13 +255,15 @@ class PriceStore(DataStore):
             qstart = rstart - timedelta(days=1)
             qend = rend + timedelta(days=2)
             log.info(f"{self.region.bidding_zone_entsoe}: fetching prices from {rstart.isoformat()} to {rend.isoformat()} from Entso-E")
-            client = entsoe.EntsoePandasClient(api_key=self.entsoe_api_key)
-            prices_series = await asyncio.to_thread(client.query_day_ahead_prices, self.region.bidding_zone_entsoe, pd.to_datetime(qstart), pd.to_datetime(qend))
+            prices_series = await EntsoeClient(self.entsoe_api_key).query_day_ahead_prices(self.region.bidding_zone_entsoe, qstart, qend)
             prices = prices_series.to_frame("price")
             prices["price"] = prices["price"] / 10
             prices.index = prices.index.tz_convert("UTC") # type: ignore
+            prices.index.name = "time"
             prices = prices.resample("15min").ffill().bfill()
             return prices
+        except HttpCacheMiss:
+            raise
         except Exception as e:
             log.error(f"{self.region.bidding_zone_entsoe}: failed to fetch prices from entso-e: {e}")
 
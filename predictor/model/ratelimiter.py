@@ -0,0 +1,223 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Awaitable, Callable, TypeVar
+
+log = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RequestPriority(IntEnum):
+    """
+    Lower value = served first. Live forecast refreshes must never starve behind a long historical backfill
+    """
+    FORECAST = 0
+    BACKFILL = 1
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised by callers when the upstream rejected a request because of rate limiting (e.g. HTTP 429)
+    """
+
+    retry_after: float | None
+
+    def __init__(self, msg: str, retry_after: float | None = None):
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Allows `capacity` request units per `period` seconds, refilled continuously
+    """
+
+    capacity: float
+    period: float
+    tokens: float
+    last_refill: float
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.period = period
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+
+    def _refill(self, now: float):
+        elapsed = now - self.last_refill
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / self.period)
+        self.last_refill = now
+
+    def time_until_available(self, cost: float, now: float) -> float:
+        self._refill(now)
+        missing = min(cost, self.capacity) - self.tokens
+        if missing <= 0:
+            return 0
+        return missing * self.period / self.capacity
+
+    def take(self, cost: float, now: float):
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+    def drain(self, now: float):
+        self._refill(now)
+        self.tokens = min(self.tokens, 0)
+
+
+@dataclass(order=True)
+class _Waiter:
+    priority: int
+    seq: int
+    cost: float = field(compare=False)
+    future: asyncio.Future = field(compare=False)
+    enqueued: float = field(compare=False)
+
+
+class RequestBudget:
+    """
+    Token-bucket request budget for one upstream provider with multiple windows (e.g. per minute, hour and day).
+    Requests wait in a priority queue until all windows have enough tokens left. If the upstream still rejects
+    a request, the work is deferred and retried automatically.
+    """
+
+    name: str
+    buckets: list[TokenBucket]
+    max_retries: int
+    backoff: float
+
+    def __init__(self, name: str, limits: list[tuple[float, float]], max_retries: int = 3, backoff: float = 60.0):
+        """
+        limits: list of (capacity, period in seconds)
+        """
+        self.name = name
+        self.buckets = [TokenBucket(capacity, period) for capacity, period in limits]
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+        self._queue: list[_Waiter] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+        self.requests = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.retries = 0
+        self.wait_seconds = 0.0
+
+
+    def queue_depth(self) -> dict[str, int]:
+        result = {p.name.lower(): 0 for p in RequestPriority}
+        for w in self._queue:
+            result[RequestPriority(w.priority).name.lower()] += 1
+        return result
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        for b in self.buckets:
+            b.time_until_available(0, now) # refill
+        return {
+            "queue_depth": self.queue_depth(),
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "tokens_left": [round(b.tokens, 2) for b in self.buckets],
+        }
+
+    async def acquire(self, cost: float = 1, priority: RequestPriority = RequestPriority.FORECAST):
+        waiter = _Waiter(int(priority), next(self._seq), cost, asyncio.get_running_loop().create_future(), time.monotonic())
+        heapq.heappush(self._queue, waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+                heapq.heapify(self._queue)
+                self._dispatch()
+            raise
+
+        waited = time.monotonic() - waiter.enqueued
+        self.requests += 1
+        if waited > 0.001:
+            self.throttled += 1
+            self.wait_seconds += waited
+
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queue:
+            head = self._queue[0]
+            if head.future.done(): # cancelled
+                heapq.heappop(self._queue)
+                continue
+            now = time.monotonic()
+            wait = max(b.time_until_available(head.cost, now) for b in self.buckets)
+            if wait > 0:
+                # strict priority: the head blocks everything behind it until its budget is available
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            for b in self.buckets:
+                b.take(head.cost, now)
+            heapq.heappop(self._queue)
+            head.future.set_result(None)
+
+
+    def _reject(self, e: RateLimitExceeded):
+        """
+        The upstream knows better than our bookkeeping - assume all windows are exhausted
+        """
+        now = time.monotonic()
+        for b in self.buckets:
+            b.drain(now)
+        self.rejected += 1
+
+
+    async def run(self, func: Callable[[], Awaitable[T]], cost: float = 1, priority: RequestPriority = RequestPriority.FORECAST) -> T:
+        """
+        Wait for budget, then run func. If func raises RateLimitExceeded, requeue it with the same priority
+        after the upstream's Retry-After (or our own backoff)
+        """
+        attempt = 0
+        while True:
+            await self.acquire(cost, priority)
+            try:
+                return await func()
+            except RateLimitExceeded as e:
+                self._reject(e)
+                if attempt >= self.max_retries:
+                    log.warning(f"{self.name}: request still rate limited after {attempt} retries - giving up")
+                    raise
+                attempt += 1
+                self.retries += 1
+                delay = e.retry_after if e.retry_after is not None else self.backoff * attempt
+                log.info(f"{self.name}: rate limited by upstream, deferring request by {delay:.0f}s (retry {attempt}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+
+# Free tier limits as documented on https://open-meteo.com/en/pricing.
+# They apply per client, to the forecast and the historical forecast API together
+OPEN_METEO = "open-meteo"
+OPEN_METEO_LIMITS = [(600, 60), (5000, 60 * 60), (10000, 60 * 60 * 24)]
+
+_budgets: dict[str, RequestBudget] = {}
+
+def get_request_budget(provider: str, limits: list[tuple[float, float]]) -> RequestBudget:
+    """
+    Process-wide budget per upstream provider, shared by all regions and all hosts of the provider
+    """
+    if provider not in _budgets:
+        _budgets[provider] = RequestBudget(provider, limits)
+    return _budgets[provider]
+
+def request_budget_stats() -> dict[str, dict]:
+    return {provider: budget.stats() for provider, budget in _budgets.items()}
@@ -0,0 +1,150 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from typing import Iterator
+
+log = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to an upstream that failed repeatedly. Stores handle it like any other
+    fetch error and keep serving the data they already have
+    """
+    pass
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class BreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one upstream host.
+    closed: all requests pass. After failure_threshold consecutive failures -> open: requests fail immediately.
+    After reset_timeout seconds -> half_open: a single probe request is let through. Success closes the breaker again,
+    failure re-opens it.
+    """
+
+    host: str
+    failure_threshold: int
+    reset_timeout: float
+
+    state: BreakerState
+    consecutive_failures: int
+    opened_at: float
+    probing: bool
+
+    def __init__(self, host: str, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+        self.failures = 0
+        self.rejected = 0
+        self.trips = 0
+
+
+    def acquire(self):
+        """
+        Call before each request. Raises CircuitOpenError if the request must not be sent
+        """
+        if self.state == BreakerState.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            log.info(f"{self.host}: circuit half-open, probing upstream")
+            self.state = BreakerState.HALF_OPEN
+            self.probing = False
+
+        if self.state == BreakerState.OPEN or (self.state == BreakerState.HALF_OPEN and self.probing):
+            self.rejected += 1
+            raise CircuitOpenError(f"{self.host}: circuit open after {self.consecutive_failures} consecutive failures")
+        if self.state == BreakerState.HALF_OPEN:
+            self.probing = True
+
+    def success(self):
+        if self.state != BreakerState.CLOSED:
+            log.info(f"{self.host}: upstream recovered, circuit closed")
+        self.state = BreakerState.CLOSED
+        self.consecutive_failures = 0
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == BreakerState.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != BreakerState.OPEN:
+                log.warning(f"{self.host}: {self.consecutive_failures} consecutive failures - opening circuit for {self.reset_timeout:.0f}s")
+                self.trips += 1
+            self.state = BreakerState.OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """
+        The request ended without a verdict (e.g. cancelled) - let the next one probe instead
+        """
+        self.probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state.value,
+            "consecutive_failures": self.consecutive_failures,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "trips": self.trips,
+        }
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(host: str) -> CircuitBreaker:
+    """
+    Process-wide breaker per upstream host, shared by all regions
+    """
+    if host not in _breakers:
+        _breakers[host] = CircuitBreaker(host)
+    return _breakers[host]
+
+def circuit_breaker_stats() -> dict[str, dict]:
+    return {host: breaker.stats() for host, breaker in _breakers.items()}
+
+
+# monotonic time until which the current request wants an answer. Copied into tasks created while it is set
+_deadline: ContextVar[float | None] = ContextVar("deadline", default=None)
+
+@contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    """
+    Request-scoped deadline for everything awaited inside. Nested deadlines can only shorten it.
+    deadline(None) removes it, e.g. for background work that outlives the request
+    """
+    if seconds is None:
+        token = _deadline.set(None)
+    else:
+        at = time.monotonic() + seconds
+        current = _deadline.get()
+        token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def time_left() -> float | None:
+    """
+    Seconds until the current deadline, None if there is none
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    return max(0.0, at - time.monotonic())
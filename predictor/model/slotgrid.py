@@ -0,0 +1,107 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+# All stores use the same 15 minute grid. A slot is the number of 15 minute steps since the epoch
+SLOT_SECONDS = 900
+
+
+def to_slot(ts: datetime | pd.Timestamp) -> int:
+    """
+    Slot containing ts
+    """
+    return int(pd.Timestamp(ts).timestamp()) // SLOT_SECONDS
+
+def slot_range(start: datetime, end: datetime) -> tuple[int, int]:
+    """
+    Half-open slot range [first, last) of all grid points in the closed interval [start, end] - same rows as .loc[start:end]
+    """
+    first = -(-int(pd.Timestamp(start).timestamp()) // SLOT_SECONDS)
+    last = int(pd.Timestamp(end).timestamp()) // SLOT_SECONDS + 1
+    return first, max(first, last)
+
+def slot_index(first: int, last: int) -> pd.DatetimeIndex:
+    """
+    Timestamps of slots [first, last), in the same unit pandas uses for pd.date_range
+    """
+    return pd.DatetimeIndex(np.arange(first, last, dtype=np.int64) * SLOT_SECONDS * 1_000_000, dtype="datetime64[us, UTC]", name="time")
+
+def ffill(values: np.ndarray) -> np.ndarray:
+    """
+    Forward fill NaNs along the first axis. Leading NaNs stay NaN
+    """
+    rows = np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1))
+    idx = np.where(np.isnan(values), 0, rows)
+    np.maximum.accumulate(idx, axis=0, out=idx)
+    return np.take_along_axis(values, idx, axis=0)
+
+
+@dataclass(frozen=True)
+class SlotFrame:
+    """
+    Dense float64 array of a store's data on the slot grid: row i is slot base + i, missing slots are all NaN.
+    Aligning frames is offset arithmetic and slicing is array indexing, no label lookups.
+    values are column-major like pandas keeps them, so copying whole columns between frames is cheap.
+    Immutable like the snapshot it belongs to: the snapshot marks values read-only, and slices are views of it.
+    """
+
+    base: int
+    columns: tuple[str, ...]
+    values: np.ndarray
+    # slots with data. Stores never keep partial rows
+    rows: np.ndarray
+
+    @property
+    def end(self) -> int:
+        return self.base + len(self.values)
+
+    @staticmethod
+    def empty(columns: tuple[str, ...] = ()) -> "SlotFrame":
+        return SlotFrame(0, columns, np.empty((0, len(columns)), order="F"), np.empty(0, dtype=bool))
+
+    @staticmethod
+    def from_frame(df: pd.DataFrame) -> "SlotFrame":
+        """
+        Convert a store frame (tz-aware index on the 15 minute grid) to a dense slot frame
+        """
+        columns = tuple(str(c) for c in df.columns)
+        if len(df) == 0:
+            return SlotFrame.empty(columns)
+
+        seconds = df.index.as_unit("s").asi8
+        if (seconds % SLOT_SECONDS != 0).any():
+            raise ValueError("index is not aligned to the 15 minute grid")
+        slots = seconds // SLOT_SECONDS
+        base = int(slots.min())
+        values = np.full((int(slots.max()) - base + 1, len(columns)), np.nan, order="F")
+        values[slots - base] = df.to_numpy(dtype=np.float64, na_value=np.nan)
+        rows = ~np.isnan(values).any(axis=1) if len(columns) > 0 else np.zeros(len(values), dtype=bool)
+        return SlotFrame(base, columns, values, rows)
+
+    def slice(self, first: int, last: int) -> "SlotFrame":
+        """
+        Slots [first, last), clipped to what this frame covers
+        """
+        first = min(max(first, self.base), self.end)
+        last = max(min(last, self.end), first)
+        return SlotFrame(first, self.columns, self.values[first - self.base:last - self.base], self.rows[first - self.base:last - self.base])
+
+    def window(self, first: int, last: int) -> np.ndarray:
+        """
+        Exactly the slots [first, last) as a new array, NaN where this frame has no data
+        """
+        result = np.full((last - first, len(self.columns)), np.nan, order="F")
+        part = self.slice(first, last)
+        result[part.base - first:part.end - first] = part.values
+        return result
+
+    def row_mask(self, first: int, last: int) -> np.ndarray:
+        """
+        rows for exactly the slots [first, last)
+        """
+        result = np.zeros(last - first, dtype=bool)
+        part = self.slice(first, last)
+        result[part.base - first:part.end - first] = part.rows
+        return result
@@ -0,0 +1,486 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+import uuid
+import weakref
+from datetime import timedelta
+from functools import lru_cache
+from typing import Callable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.shared_memory import SharedMemory
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+
+from .cpubudget import reserve_threads
+from .metrics import LatencyStats
+from .workers import WorkerPool, run_cpu
+
+log = logging.getLogger(__name__)
+
+
+# "thread": train in the CPU worker pool. "process": train in separate processes, so regions don't compete for the GIL
+TRAINING_BACKEND = os.getenv("EPEXPREDICTOR_TRAINING_BACKEND", "thread")
+# At most this many models are trained at the same time, the rest wait for their turn
+MAX_TRAININGS = int(os.getenv("EPEXPREDICTOR_MAX_TRAININGS", "2"))
+
+LGB_PARAMS = {
+    "force_col_wise": True,
+    "verbosity": -1,
+}
+# "full": train a new model every time. "incremental": continue the previous model with the new data, full fit every FULL_FIT_DAYS
+TRAINING_MODE = os.getenv("EPEXPREDICTOR_TRAINING_MODE", "full")
+FULL_FIT_DAYS = int(os.getenv("EPEXPREDICTOR_FULL_FIT_DAYS", "7"))
+# Incremental training: weight of the previous leaf values when refitting them on the new window (LightGBM's default),
+# and how many trees are added for the new rows
+REFIT_DECAY = 0.9
+INCREMENTAL_ROUNDS = 10
+# Feature bins of a full fit are reused for the next ones. New bins after this many days of new data, or earlier when more
+# than REBIN_DRIFT of the values of a feature are outside the range the bins were made for
+REBIN_DAYS = int(os.getenv("EPEXPREDICTOR_REBIN_DAYS", "7"))
+REBIN_DRIFT = 0.05
+# Full fits hold out the most recent days to find out how many boosting rounds help (early stopping), then train on all rows
+# with that many. 0 (default, until backtests show it doesn't cost accuracy): always DEFAULT_ROUNDS
+VALIDATION_DAYS = int(os.getenv("EPEXPREDICTOR_VALIDATION_DAYS", "0"))
+EARLY_STOPPING_ROUNDS = 10
+DEFAULT_ROUNDS = 100
+MAX_ROUNDS = 500
+
+
+def parse_budgets(setting: str) -> dict[str, float]:
+    """
+    "60" or "60,SE1=20,DE=120": seconds a training may take, for all regions and per region. "" is the default for all
+    """
+    budgets = {}
+    for part in setting.split(","):
+        if part.strip() == "":
+            continue
+        region, sep, seconds = part.rpartition("=")
+        try:
+            if sep and region.strip() == "":
+                raise ValueError
+            budgets[region.strip().upper()] = float(seconds)
+        except ValueError:
+            raise ValueError(f"invalid EPEXPREDICTOR_TRAINING_BUDGET entry {part.strip()!r}, expected seconds or REGION=seconds") from None
+    return budgets
+
+# Wall clock seconds a training may take before boosting stops early, 0: no limit. See parse_budgets() for the format
+TRAINING_BUDGETS = parse_budgets(os.getenv("EPEXPREDICTOR_TRAINING_BUDGET", ""))
+
+def training_budget(region: str) -> float | None:
+    """
+    Training budget of a region (PriceRegionName), None if there is none
+    """
+    budget = TRAINING_BUDGETS.get(region.upper(), TRAINING_BUDGETS.get("", 0))
+    return budget if budget > 0 else None
+
+
+class TimeBox:
+    """
+    Wall clock budget of one training. Boosting stops once it is used up and the model is marked as degraded.
+    A full fit with validation gives half of it to the validation run
+    """
+
+    seconds: float | None
+    started: float | None
+    # the budget was used up, the model has fewer rounds than it should
+    expired: bool
+
+    def __init__(self, seconds: float | None):
+        self.seconds = seconds
+        self.started = None
+        self.expired = False
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def stopper(self, share: float = 1.0) -> Callable[[lgb.callback.CallbackEnv], None]:
+        """
+        LightGBM callback that ends boosting once share of the budget is used up. Trees boosted so far are kept
+        """
+        if self.seconds is None or self.started is None:
+            deadline = None
+        else:
+            deadline = self.started + share * self.seconds
+
+        def stop(env: lgb.callback.CallbackEnv):
+            if deadline is not None and time.monotonic() >= deadline and env.iteration + 1 < env.end_iteration:
+                self.expired = True
+                raise lgb.callback.EarlyStopException(env.iteration, env.evaluation_result_list or [])
+        # after early stopping and recording the evaluation of this round
+        stop.order = 40 # type: ignore[attr-defined]
+        return stop
+
+
+class Binning:
+    """
+    Bin boundaries LightGBM found for a previous training set. Training sets built against them skip bin discovery,
+    which is most of the Dataset construction time.
+    Thread backend: the constructed Dataset is kept as reference. Process backend: a binary dump of it, which the
+    training processes load (once per file)
+    """
+
+    rebin_days: int
+    drift: float
+    reference: lgb.Dataset | None
+    path: str | None
+    features: list[str]
+    # value range per feature the bins were made for
+    low: np.ndarray
+    high: np.ndarray
+    # end of the data the bins were made from
+    until: pd.Timestamp | None
+
+    def __init__(self, rebin_days: int = REBIN_DAYS, drift: float = REBIN_DRIFT):
+        self.rebin_days = rebin_days
+        self.drift = drift
+        self.reference = None
+        self.path = None
+        self.features = []
+        self.low = self.high = np.empty(0)
+        self.until = None
+        self.rebins = 0
+        self.reuses = 0
+        self._finalizer: weakref.finalize | None = None
+
+    def usable(self, traindata: pd.DataFrame) -> bool:
+        """
+        Whether the bins still fit the complete rows in traindata
+        """
+        features = [c for c in traindata.columns if c != "price"]
+        if self.until is None or len(traindata) == 0 or features != self.features:
+            return False
+        if traindata.index[-1] - self.until >= timedelta(days=self.rebin_days):
+            return False
+        values = traindata[features].to_numpy(dtype=np.float64)
+        outside = ((values < self.low) | (values > self.high)).mean(axis=0)
+        return bool(outside.max(initial=0) <= self.drift)
+
+    def remember(self, traindata: pd.DataFrame, reference: lgb.Dataset | None = None, path: str | None = None):
+        """
+        New bins, made from the complete rows in traindata
+        """
+        self.forget()
+        self.reference = reference
+        self.path = path
+        if path is not None:
+            self._finalizer = weakref.finalize(self, _remove, path)
+        self.features = [c for c in traindata.columns if c != "price"]
+        values = traindata[self.features].to_numpy(dtype=np.float64)
+        self.low, self.high = values.min(axis=0, initial=np.inf), values.max(axis=0, initial=-np.inf)
+        self.until = traindata.index[-1]
+        self.rebins += 1
+
+    def forget(self):
+        if self._finalizer is not None:
+            self._finalizer()
+            self._finalizer = None
+        self.reference = None
+        self.path = None
+        self.until = None
+
+    def stats(self) -> dict:
+        return {"rebins": self.rebins, "reuses": self.reuses, "until": None if self.until is None else self.until.isoformat()}
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+def _release(shm: SharedMemory, save_bins: str | None = None):
+    shm.close()
+    shm.unlink()
+    if save_bins is not None:
+        _remove(save_bins)
+
+@lru_cache(maxsize=32)
+def _load_reference(path: str, params: tuple) -> lgb.Dataset:
+    """
+    Runs in a training process: bins dumped by a previous training
+    """
+    return lgb.Dataset(path, params=dict(params)).construct()
+
+
+def round_budget(rounds: int | None) -> int:
+    """
+    Most boosting rounds to try when the previous full fit used rounds: some room to grow, early stopping cuts the rest
+    """
+    if rounds is None:
+        return MAX_ROUNDS
+    return min(MAX_ROUNDS, rounds + rounds // 2 + EARLY_STOPPING_ROUNDS)
+
+def best_rounds(train_set: lgb.Dataset, validation_rows: int, params: dict, budget: int, timebox: TimeBox | None = None) -> int:
+    """
+    Boosting rounds with the lowest error on the last validation_rows rows of the constructed train_set, trained on the others
+    """
+    rows = train_set.num_data()
+    train = train_set.subset(list(range(rows - validation_rows)))
+    valid = train_set.subset(list(range(rows - validation_rows, rows)))
+    errors: dict = {}
+    callbacks = [lgb.early_stopping(EARLY_STOPPING_ROUNDS, verbose=False), lgb.record_evaluation(errors)]
+    if timebox is not None:
+        callbacks.append(timebox.stopper(0.5))
+    lgb.train(params=params, train_set=train, num_boost_round=budget, valid_sets=[valid], callbacks=callbacks)
+    # early stopping or out of time, the best round so far counts
+    error = next(iter(errors["valid_0"].values()), [])
+    return int(np.argmin(error)) + 1 if len(error) > 0 else budget
+
+def boost(features: pd.DataFrame | np.ndarray, labels: pd.Series | np.ndarray, params: dict,
+          init_model: lgb.Booster | None = None, new_rows: int = 0, feature_name: list[str] | str = "auto",
+          reference: lgb.Dataset | None = None, rounds: int | None = None, validation_rows: int = 0,
+          timebox: TimeBox | None = None) -> tuple[lgb.Booster, lgb.Dataset | None]:
+    """
+    New model, or with init_model: refit its leaf values on all rows and continue boosting on the last new_rows rows.
+    A new model gets as many rounds as best on the last validation_rows rows (see best_rounds(), rounds: the number of
+    the previous full fit), without validation rows rounds or DEFAULT_ROUNDS.
+    Training sets are binned like reference, if given. Also returns the training set of a new model, to be used as reference
+    """
+    callbacks = [timebox.stopper()] if timebox is not None else []
+    if init_model is None:
+        train_set = lgb.Dataset(features, label=labels, feature_name=feature_name, reference=reference, params=params)
+        if 0 < validation_rows < len(labels):
+            rounds = best_rounds(train_set.construct(), validation_rows, params, round_budget(rounds), timebox)
+        model = lgb.train(params=params, train_set=train_set, num_boost_round=rounds or DEFAULT_ROUNDS, callbacks=callbacks)
+        return model, train_set
+
+    model = init_model.refit(features, labels, decay_rate=REFIT_DECAY, feature_name=feature_name, num_threads=params.get("num_threads", 0))
+    if new_rows == 0:
+        return model, None
+    new = lgb.Dataset(features[-new_rows:], label=labels[-new_rows:], feature_name=feature_name, reference=reference)
+    return lgb.train(params=params, train_set=new, num_boost_round=INCREMENTAL_ROUNDS, init_model=model, callbacks=callbacks), None
+
+
+def _complete(traindata: pd.DataFrame, new_since: pd.Timestamp | None) -> tuple[pd.DataFrame, int]:
+    """
+    Complete rows of traindata, and how many of them are after new_since
+    """
+    # not in place, the feature matrix may hand out the same frame again
+    traindata = traindata.dropna()
+    new_rows = 0 if new_since is None else len(traindata) - int(traindata.index.searchsorted(new_since, side="right"))
+    return traindata, new_rows
+
+def _validation_rows(traindata: pd.DataFrame) -> int:
+    """
+    Rows of the last VALIDATION_DAYS days
+    """
+    if VALIDATION_DAYS <= 0 or len(traindata) == 0:
+        return 0
+    return len(traindata) - int(traindata.index.searchsorted(traindata.index[-1] - timedelta(days=VALIDATION_DAYS), side="right"))
+
+def fit(traindata: pd.DataFrame, num_threads: int, init_model: lgb.Booster | None = None,
+        new_since: pd.Timestamp | None = None, binning: Binning | None = None, rounds: int | None = None,
+        timebox: TimeBox | None = None) -> tuple[pd.DataFrame, lgb.Booster]:
+    """
+    Train on all complete rows of traindata, price is the label. Returns the rows used and the model.
+    With init_model, continue that model instead, new_since is the end of the data it was trained on.
+    With binning, reuse its bins while usable, and remember new ones otherwise.
+    rounds: boosting rounds of the previous full fit, see boost(). timebox: stop boosting when its time is up.
+    Careful: runs in a worker thread
+    """
+    if timebox is not None:
+        timebox.start()
+    traindata, new_rows = _complete(traindata, new_since)
+
+    params = traindata.drop(columns=["price"])
+    output = traindata["price"]
+
+    reference = None
+    if binning is not None and binning.reference is not None and binning.usable(traindata):
+        reference = binning.reference
+        binning.reuses += 1
+    model, train_set = boost(params, output, LGB_PARAMS | {"num_threads": num_threads}, init_model, new_rows, reference=reference,
+                             rounds=rounds, validation_rows=_validation_rows(traindata), timebox=timebox)
+    if binning is not None and reference is None and train_set is not None:
+        binning.remember(traindata, reference=train_set)
+    return traindata, model
+
+
+def _share(traindata: pd.DataFrame, new_since: pd.Timestamp | None) -> tuple[pd.DataFrame, int, SharedMemory, list[str]]:
+    """
+    Copy the complete rows of traindata to a new shared memory block: features row-major, followed by the labels.
+    Both parts are contiguous, so LightGBM uses them without another copy
+    """
+    traindata, new_rows = _complete(traindata, new_since)
+    features = [str(c) for c in traindata.columns if c != "price"]
+    rows = len(traindata)
+    shm = SharedMemory(create=True, size=max(1, rows * (len(features) + 1) * 8))
+    values = np.ndarray((rows, len(features)), dtype=np.float64, buffer=shm.buf)
+    values[:] = traindata[features].to_numpy(dtype=np.float64)
+    labels = np.ndarray(rows, dtype=np.float64, buffer=shm.buf, offset=rows * len(features) * 8)
+    labels[:] = traindata["price"].to_numpy(dtype=np.float64)
+    del values, labels # the block can only be closed without views on it
+    return traindata, new_rows, shm, features
+
+def _fit_shared(name: str, rows: int, features: list[str], params: dict, init_model: str | None, new_rows: int,
+                bins: str | None = None, save_bins: str | None = None, rounds: int | None = None, validation_rows: int = 0,
+                budget: float | None = None) -> tuple[str, bool]:
+    """
+    Runs in a training process: train on the block shared by _share(), return the model as string and whether it ran
+    out of time. bins: dumped bins to use, save_bins: where to dump the bins of a new model, budget: seconds for boosting
+    """
+    timebox = TimeBox(budget)
+    timebox.start()
+    shm = SharedMemory(name=name)
+    try:
+        return _train_on(shm, rows, features, params, init_model, new_rows, bins, save_bins, rounds, validation_rows, timebox), timebox.expired
+    finally:
+        shm.close()
+
+def _train_on(shm: SharedMemory, rows: int, features: list[str], params: dict, init_model: str | None, new_rows: int,
+              bins: str | None, save_bins: str | None, rounds: int | None, validation_rows: int, timebox: TimeBox) -> str:
+    values = np.ndarray((rows, len(features)), dtype=np.float64, buffer=shm.buf)
+    labels = np.ndarray(rows, dtype=np.float64, buffer=shm.buf, offset=rows * len(features) * 8)
+    booster = lgb.Booster(model_str=init_model) if init_model is not None else None
+    reference = _load_reference(bins, tuple(sorted(LGB_PARAMS.items()))) if bins is not None else None
+    model, train_set = boost(values, labels, params, booster, new_rows, feature_name=features, reference=reference,
+                             rounds=rounds, validation_rows=validation_rows, timebox=timebox)
+    if save_bins is not None and train_set is not None:
+        train_set.save_binary(save_bins)
+    return model.model_to_string()
+
+
+class Trainer:
+    """
+    Runs model trainings, at most max_trainings at a time.
+    With the thread backend, trainings run in threads of their own, not in the shared CPU pool: a fit takes seconds to
+    minutes, and requests would queue behind it for all that time. With the process backend, training data is passed to the training processes in shared memory and the model comes
+    back serialized - nothing big is pickled
+    """
+
+    backend: str
+    max_trainings: int
+    executor: ProcessPoolExecutor | None
+    pool: WorkerPool
+
+    def __init__(self, backend: str = TRAINING_BACKEND, max_trainings: int = MAX_TRAININGS):
+        if backend not in ("thread", "process"):
+            raise ValueError(f"unknown training backend {backend}")
+        self.backend = backend
+        self.max_trainings = max_trainings
+        self.executor = None
+        self.pool = WorkerPool(max_trainings, "training")
+        # asyncio primitives belong to one event loop
+        self.limits: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore] = weakref.WeakKeyDictionary()
+
+        self.running = 0
+        self.queued = 0
+        self.wait = LatencyStats()
+        self.runtime = LatencyStats()
+        # trainings that ran out of time
+        self.expired = 0
+
+    async def train(self, traindata: pd.DataFrame, init_model: lgb.Booster | None = None,
+                    new_since: pd.Timestamp | None = None, binning: Binning | None = None,
+                    rounds: int | None = None, timebox: TimeBox | None = None) -> tuple[pd.DataFrame, lgb.Booster]:
+        """
+        fit() with the configured backend
+        """
+        loop = asyncio.get_running_loop()
+        limit = self.limits.setdefault(loop, asyncio.Semaphore(self.max_trainings))
+
+        submitted = time.monotonic()
+        self.queued += 1
+        try:
+            await limit.acquire()
+        finally:
+            self.queued -= 1
+        started = time.monotonic()
+        self.wait.record(started - submitted)
+        self.running += 1
+        ok = False
+        try:
+            async with reserve_threads("training", parallel=self.max_trainings) as threads:
+                if self.backend == "process":
+                    result = await self._train_in_process(traindata, threads, init_model, new_since, binning, rounds, timebox)
+                else:
+                    result = await self.pool.run(fit, traindata, threads, init_model, new_since, binning, rounds, timebox)
+            if timebox is not None and timebox.expired:
+                self.expired += 1
+            ok = True
+            return result
+        finally:
+            self.running -= 1
+            self.runtime.record(time.monotonic() - started, ok)
+            limit.release()
+
+    async def _train_in_process(self, traindata: pd.DataFrame, num_threads: int, init_model: lgb.Booster | None,
+                                new_since: pd.Timestamp | None, binning: Binning | None, rounds: int | None,
+                                timebox: TimeBox | None) -> tuple[pd.DataFrame, lgb.Booster]:
+        if self.executor is None:
+            # no fork - the parent has running threads, and OpenMP doesn't survive it
+            self.executor = ProcessPoolExecutor(self.max_trainings, mp_context=multiprocessing.get_context("spawn"))
+
+        traindata, new_rows, shm, features = await run_cpu(_share, traindata, new_since)
+        init = await run_cpu(init_model.model_to_string) if init_model is not None else None
+        bins = save_bins = None
+        if binning is not None:
+            if binning.path is not None and await run_cpu(binning.usable, traindata):
+                bins = binning.path
+                binning.reuses += 1
+            elif init_model is None:
+                save_bins = os.path.join(tempfile.gettempdir(), f"epexpredictor-bins-{uuid.uuid4().hex}.bin")
+        future = None
+        try:
+            future = self.executor.submit(_fit_shared, shm.name, len(traindata), features, LGB_PARAMS | {"num_threads": num_threads},
+                                          init, new_rows, bins, save_bins, rounds, _validation_rows(traindata),
+                                          timebox.seconds if timebox is not None else None)
+            try:
+                model, expired = await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                log.error("training process died, starting new ones for the next training")
+                self.executor = None
+                raise
+        except BaseException:
+            if future is not None and not future.cancel() and not future.done():
+                # cancelled while the training process reads the shared memory - release it once the process is done
+                future.add_done_callback(lambda _: _release(shm, save_bins))
+            else:
+                _release(shm, save_bins)
+            raise
+        _release(shm)
+        if timebox is not None:
+            timebox.expired = expired
+        if binning is not None and save_bins is not None:
+            await run_cpu(lambda: binning.remember(traindata, path=save_bins))
+        return traindata, await run_cpu(lambda: lgb.Booster(model_str=model))
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+        self.pool.shutdown()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend,
+            "max_trainings": self.max_trainings,
+            "running": self.running,
+            "queued": self.queued,
+            "expired": self.expired,
+            "wait": self.wait.stats(),
+            "runtime": self.runtime.stats(),
+        }
+
+
+_trainer = Trainer()
+
+async def train_model(traindata: pd.DataFrame, init_model: lgb.Booster | None = None,
+                      new_since: pd.Timestamp | None = None, binning: Binning | None = None,
+                      rounds: int | None = None, timebox: TimeBox | None = None) -> tuple[pd.DataFrame, lgb.Booster]:
+    """
+    Train with the process-wide trainer. Returns the rows used and the model
+    """
+    return await _trainer.train(traindata, init_model, new_since, binning, rounds, timebox)
+
+def training_stats() -> dict:
+    return _trainer.stats()
+
+def shutdown_training():
+    _trainer.shutdown()
@@ -0,0 +1,215 @@
+import asyncio
+import ctypes
+import logging
+import os
+import shutil
+import tempfile
+import weakref
+
+import lightgbm as lgb
+import numpy as np
+
+from .workers import run_cpu
+
+log = logging.getLogger(__name__)
+
+
+# "lightgbm": Booster.predict. "compiled": every model is compiled to a small shared library with the C compiler CC,
+# predictions skip LightGBM's input checks and conversions and walk the trees as plain branches
+INFERENCE_ENGINE = os.getenv("EPEXPREDICTOR_INFERENCE_ENGINE", "lightgbm")
+CC = os.getenv("CC", "cc")
+
+# objectives whose raw score is the prediction
+IDENTITY_OBJECTIVES = {"regression", "regression_l1", "huber", "fair", "quantile", "mape"}
+# missing value handling of a split, like LightGBM's MissingType
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+# LightGBM's kZeroThreshold
+ZERO_THRESHOLD = 1e-35
+
+
+class FlatForest:
+    """
+    Trees of a LightGBM regression model, flattened into arrays. Node i splits on feature[i] <= threshold[i],
+    children >= 0 are nodes, negative ones ~leaf index into leaf_value. A tree that is a single leaf has a negative root
+    """
+
+    feature_names: list[str]
+    feature: np.ndarray
+    threshold: np.ndarray
+    missing: np.ndarray
+    default_left: np.ndarray
+    left: np.ndarray
+    right: np.ndarray
+    leaf_value: np.ndarray
+    roots: np.ndarray
+    average: bool
+
+    def __init__(self, feature_names: list[str], feature: list[int], threshold: list[float], missing: list[int], default_left: list[bool],
+                 left: list[int], right: list[int], leaf_value: list[float], roots: list[int], average: bool = False):
+        self.feature_names = feature_names
+        self.feature = np.array(feature, dtype=np.int32)
+        self.threshold = np.array(threshold, dtype=np.float64)
+        self.missing = np.array(missing, dtype=np.uint8)
+        self.default_left = np.array(default_left, dtype=bool)
+        self.left = np.array(left, dtype=np.int32)
+        self.right = np.array(right, dtype=np.int32)
+        self.leaf_value = np.array(leaf_value, dtype=np.float64)
+        self.roots = np.array(roots, dtype=np.int32)
+        self.average = average
+
+    @classmethod
+    def from_booster(cls, booster: lgb.Booster) -> "FlatForest":
+        """
+        Trees predict() would use. ValueError for models this can't evaluate (categorical splits, linear trees, multiclass,
+        objectives that transform the score)
+        """
+        model = booster.dump_model()
+        objective = str(model.get("objective", "regression")).split(" ")[0]
+        if objective not in IDENTITY_OBJECTIVES:
+            raise ValueError(f"objective {objective} is not supported")
+        if model.get("num_tree_per_iteration", 1) != 1:
+            raise ValueError("multiclass models are not supported")
+
+        feature, threshold, missing, default_left, left, right, leaf_value = [], [], [], [], [], [], []
+        missing_types = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+
+        def add(node: dict) -> int:
+            if "leaf_value" in node:
+                if "leaf_coeff" in node:
+                    raise ValueError("linear trees are not supported")
+                leaf_value.append(node["leaf_value"])
+                return ~(len(leaf_value) - 1)
+            if node["decision_type"] != "<=":
+                raise ValueError("categorical splits are not supported")
+            i = len(feature)
+            feature.append(node["split_feature"])
+            threshold.append(node["threshold"])
+            missing.append(missing_types[node["missing_type"]])
+            default_left.append(node["default_left"])
+            left.append(0)
+            right.append(0)
+            left[i] = add(node["left_child"])
+            right[i] = add(node["right_child"])
+            return i
+
+        roots = [add(tree["tree_structure"]) for tree in model["tree_info"]]
+        if not (np.isfinite(threshold).all() and np.isfinite(leaf_value).all()):
+            raise ValueError("model has infinite thresholds or leaf values")
+        return cls(model["feature_names"], feature, threshold, missing, default_left, left, right, leaf_value, roots,
+                   bool(model.get("average_output", False)))
+
+    def to_c(self) -> str:
+        """
+        C source with one function per tree and predict(x, rows, row_stride, column_stride, out) summing them up.
+        Constants are written as hex floats, so they are exactly LightGBM's doubles
+        """
+        lines = ["#include <math.h>", ""]
+        for t, root in enumerate(self.roots):
+            lines.append(f"static double tree{t}(const double *x, long c) {{")
+            self._node_c(int(root), 1, lines)
+            lines.append("}")
+        lines += [
+            "",
+            "void predict(const double *x, long rows, long rs, long cs, double *out) {",
+            "    for (long r = 0; r < rows; r++) {",
+            "        const double *row = x + r * rs;",
+            "        double sum = 0.0;",
+        ]
+        lines += [f"        sum += tree{t}(row, cs);" for t in range(len(self.roots))]
+        if self.average and len(self.roots) > 0:
+            lines.append(f"        sum /= {len(self.roots)};")
+        lines += ["        out[r] = sum;", "    }", "}", ""]
+        return "\n".join(lines)
+
+    def _node_c(self, node: int, depth: int, lines: list[str]):
+        indent = "    " * depth
+        if node < 0:
+            lines.append(f"{indent}return {float(self.leaf_value[~node]).hex()};")
+            return
+        value = f"x[{self.feature[node]} * c]"
+        threshold = float(self.threshold[node]).hex()
+        default = int(self.default_left[node])
+        # same decision as LightGBM's NumericalDecision
+        if self.missing[node] == MISSING_NAN:
+            condition = f"isnan({value}) ? {default} : {value} <= {threshold}"
+        elif self.missing[node] == MISSING_ZERO:
+            condition = f"(isnan({value}) || fabs({value}) <= {ZERO_THRESHOLD!r}) ? {default} : {value} <= {threshold}"
+        else:
+            condition = f"(isnan({value}) ? 0.0 : {value}) <= {threshold}"
+        lines.append(f"{indent}if ({condition}) {{")
+        self._node_c(int(self.left[node]), depth + 1, lines)
+        lines.append(f"{indent}}} else {{")
+        self._node_c(int(self.right[node]), depth + 1, lines)
+        lines.append(f"{indent}}}")
+
+
+_DOUBLE_P = ctypes.POINTER(ctypes.c_double)
+
+class CompiledForest:
+    """
+    A FlatForest compiled to a shared library, see compile_forest(). The library lives in its own temporary directory,
+    which is removed with the object - a loaded library must never be overwritten
+    """
+
+    feature_names: list[str]
+    directory: str
+
+    def __init__(self, feature_names: list[str], directory: str, library: str):
+        self.feature_names = feature_names
+        self.directory = directory
+        self._finalizer = weakref.finalize(self, shutil.rmtree, directory, True)
+        self._predict = ctypes.CDLL(library).predict
+        self._predict.argtypes = [_DOUBLE_P, ctypes.c_long, ctypes.c_long, ctypes.c_long, _DOUBLE_P]
+        self._predict.restype = None
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """
+        Predictions for a (rows, features) float64 array in feature_names order. Row- and column-major both work without copy
+        """
+        features = np.asarray(features, dtype=np.float64)
+        if features.ndim != 2 or features.shape[1] != len(self.feature_names):
+            raise ValueError(f"expected {len(self.feature_names)} features, got shape {features.shape}")
+        if any(stride % features.itemsize != 0 for stride in features.strides):
+            features = np.ascontiguousarray(features)
+        out = np.empty(features.shape[0], dtype=np.float64)
+        if len(out) > 0:
+            rs, cs = (stride // features.itemsize for stride in features.strides)
+            # ctypes releases the GIL for the call
+            self._predict(features.ctypes.data_as(_DOUBLE_P), features.shape[0], rs, cs, out.ctypes.data_as(_DOUBLE_P))
+        return out
+
+
+async def compile_forest(forest: FlatForest) -> CompiledForest:
+    """
+    Compile forest with CC. The compiler runs as subprocess, not in a worker thread. Raises RuntimeError if it fails
+    """
+    directory = tempfile.mkdtemp(prefix="epexpredictor-trees-")
+    try:
+        source = os.path.join(directory, "trees.c")
+        library = os.path.join(directory, "trees.so")
+
+        def write():
+            with open(source, "w") as f:
+                f.write(forest.to_c())
+        await run_cpu(write)
+
+        process = await asyncio.create_subprocess_exec(CC, "-O2", "-shared", "-fPIC", "-o", library, source,
+                                                       stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"{CC} failed: {output.decode(errors='replace')[-2000:]}")
+        return CompiledForest(forest.feature_names, directory, library)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+
+async def compile_booster(booster: lgb.Booster) -> CompiledForest | None:
+    """
+    Compiled version of booster, None (and a warning) if that isn't possible - predict with LightGBM then
+    """
+    try:
+        forest = await run_cpu(FlatForest.from_booster, booster)
+        return await compile_forest(forest)
+    except (ValueError, RuntimeError, OSError) as e:
+        log.warning(f"can't compile model, predicting with LightGBM: {e}")
+        return None
@@ -1,84 +1,115 @@
-import asyncio
 import json
 import logging
+import math
+import os
 from datetime import datetime, timedelta, timezone
 from typing import override
+from urllib.parse import urlsplit
 
-import aiohttp
 import pandas as pd
 from .datastore import DataStore
+from .http import fetch, get_cached, range_ttl
 from .priceregion import PriceRegion
+from .ratelimiter import OPEN_METEO, OPEN_METEO_LIMITS, RateLimitExceeded, RequestPriority, get_request_budget
 
 log = logging.getLogger(__name__)
 
+OPENMETEO_URL = os.getenv("EPEXPREDICTOR_OPENMETEO_URL", "https://api.open-meteo.com")
+OPENMETEO_HISTORY_URL = os.getenv("EPEXPREDICTOR_OPENMETEO_HISTORY_URL", "https://historical-forecast-api.open-meteo.com")
+
 class WeatherStore(DataStore):
     """
-    Fetches and caches weather data from OpenMeteo
-    TODO: add management of allowed API calls, delay queries if needed
+    Fetches and caches weather data from OpenMeteo.
+    All queries to both OpenMeteo APIs go through one process-wide request budget, forecast refreshes are served before history backfills.
     """
 
     data: pd.DataFrame
     region: PriceRegion
     storage_dir: str|None
 
-    update_lock: asyncio.Lock
-    
+    # Fractional API calls are counted per 2 weeks anyway, so small chunks don't cost extra budget
+    backfill_chunk = timedelta(days=13)
+    backfill_concurrency = 4
+    range_resolution = timedelta(days=1)
+    # forecasts are updated hourly by OpenMeteo
+    http_cache_ttl = timedelta(minutes=30)
+    # seconds. Long history queries can take a while, but a hanging upstream must not block updates forever
+    request_timeout = 60
+
 
     def __init__(self, region : PriceRegion, storage_dir: str|None =None):
         super().__init__(region, storage_dir, "weather_v2")
-        self.update_lock = asyncio.Lock()
 
     @override
     def get_next_horizon_revalidation_time(self) -> datetime | None:
         return self.last_updated + timedelta(hours=6)
 
-    async def refresh_range(self, rstart: datetime, rend: datetime) -> bool:
-        async with self.update_lock:
-            lats = ",".join(map(str, self.region.latitudes))
-            lons = ",".join(map(str, self.region.longitudes))
+    async def fetch_range(self, rstart: datetime, rend: datetime) -> pd.DataFrame:
+        lats = ",".join(map(str, self.region.latitudes))
+        lons = ",".join(map(str, self.region.longitudes))
 
-            updated = False
-            if self.needs_history_query(rstart):
-                host = "historical-forecast-api.open-meteo.com"
-            else:
-                host = "api.open-meteo.com"
+        if self.needs_history_query(rstart):
+            base_url = OPENMETEO_HISTORY_URL
+            priority = RequestPriority.BACKFILL
+        else:
+            base_url = OPENMETEO_URL
+            priority = RequestPriority.FORECAST
+        host = urlsplit(base_url).netloc
+
+        url = f"{base_url}/v1/forecast?latitude={lats}&longitude={lons}&azimuth=0&tilt=0&start_date={rstart.date().isoformat()}&end_date={rend.date().isoformat()}&minutely_15=wind_speed_80m,temperature_2m,global_tilted_irradiance,pressure_msl,relative_humidity_2m&timezone=UTC"
+
+        ttl = range_ttl(rend, self.http_cache_ttl)
 
-            url = f"https://{host}/v1/forecast?latitude={lats}&longitude={lons}&azimuth=0&tilt=0&start_date={rstart.date().isoformat()}&end_date={rend.date().isoformat()}&minutely_15=wind_speed_80m,temperature_2m,global_tilted_irradiance,pressure_msl,relative_humidity_2m&timezone=UTC"
+        async def query() -> str:
             log.info(f"{self.region.bidding_zone_entsoe}: Fetching weather data: {url}")
+            resp = await fetch(url, ttl=ttl, timeout=self.request_timeout, lookup=False)
+            if resp.status == 429:
+                retry_after = resp.headers.get("Retry-After")
+                raise RateLimitExceeded(f"{host} returned 429", float(retry_after) if retry_after and retry_after.isdigit() else None)
+            resp.raise_for_status()
+            return resp.text
+
+        # cached responses don't cost any request budget. query() doesn't look up a miss again
+        cached = await get_cached(url, ttl=ttl)
+        if cached is not None:
+            data = cached.text
+        else:
+            budget = get_request_budget(OPEN_METEO, OPEN_METEO_LIMITS)
+            data = await budget.run(query, cost=self.request_cost(rstart, rend), priority=priority)
+
+        data = json.loads(data)
+        frames = []
+        for i, fc in enumerate(data):
+            df = pd.DataFrame()
+
+            df["time"] = fc["minutely_15"]["time"]
+            df[f"wind_{i}"] = fc["minutely_15"]["wind_speed_80m"]
+            df[f"temp_{i}"] = fc["minutely_15"]["temperature_2m"]
+            df[f"irradiance_{i}"] = fc["minutely_15"]["global_tilted_irradiance"]
+            df[f"pressure_{i}"] = fc["minutely_15"]["pressure_msl"]        
+            df[f"humidity_{i}"] = fc["minutely_15"]["relative_humidity_2m"]
+            
+            df.set_index("time", inplace=True)
+            df = df.dropna()
+            frames.append(df)
+
+        df = pd.concat(frames, axis=1).reset_index()
+        df["time"] = pd.to_datetime(df["time"], utc=True)
+        df.set_index("time", inplace=True)
+        return df
 
+    async def refresh_range(self, rstart: datetime, rend: datetime) -> bool:
+        async with self.update_lock:
+            updated = False
             try:
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as resp:
-                        data = await resp.text()
-
-                        data = json.loads(data)
-                        frames = []
-                        for i, fc in enumerate(data):
-                            df = pd.DataFrame()
-
-                            df["time"] = fc["minutely_15"]["time"]
-                            df[f"wind_{i}"] = fc["minutely_15"]["wind_speed_80m"]
-                            df[f"temp_{i}"] = fc["minutely_15"]["temperature_2m"]
-                            df[f"irradiance_{i}"] = fc["minutely_15"]["global_tilted_irradiance"]
-                            df[f"pressure_{i}"] = fc["minutely_15"]["pressure_msl"]        
-                            df[f"humidity_{i}"] = fc["minutely_15"]["relative_humidity_2m"]
-                            
-                            df.set_index("time", inplace=True)
-                            df = df.dropna()
-                            frames.append(df)
-
-                        df = pd.concat(frames, axis=1).reset_index()
-                        df["time"] = pd.to_datetime(df["time"], utc=True)
-                        df.set_index("time", inplace=True)
-
-                        updated = self._update_data(df) or updated
+                df = await self.fetch_range(rstart, rend)
+                updated = await self.update_data(df) or updated
             except Exception as e:
                 log.warning(f"{self.region.bidding_zone_entsoe}: Failed to fetch weather data: error: {str(e)}")
                 raise e
             finally:
                 if updated:
                     log.info(f"{self.region.bidding_zone_entsoe}: weather data updated")
-                    self.data.sort_index(inplace=True)
                     await self.serialize()
 
             return updated
@@ -122,6 +153,13 @@ class WeatherStore(DataStore):
             curr = next_day
         return result
 
+    def request_cost(self, rstart: datetime, rend: datetime) -> float:
+        """
+        OpenMeteo counts every location separately, and each started block of 2 weeks as an additional call
+        """
+        days = (rend - rstart).total_seconds() / (60 * 60 * 24) + 1
+        return len(self.region.latitudes) * max(1, math.ceil(days / 14))
+
     def needs_history_query(self, dt: datetime) -> bool:
         """
         If query is older than a few weeks, we need OpenMeteo's historical data API.
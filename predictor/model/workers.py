@@ -0,0 +1,183 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, ParamSpec, TypeVar
+
+from .metrics import LatencyStats
+
+log = logging.getLogger(__name__)
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+# Threads for CPU bound work (pandas, LightGBM). Bounded, so a retrain can't take all cores from request handling
+CPU_WORKERS = int(os.getenv("EPEXPREDICTOR_CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Log the blocking code whenever the event loop doesn't get to run for longer than this many seconds. 0 = off
+LOOP_LAG_THRESHOLD = float(os.getenv("EPEXPREDICTOR_LOOP_LAG_THRESHOLD", "0"))
+
+
+class WorkerPool:
+    """
+    Bounded thread pool for CPU bound work, so it doesn't block the event loop. numpy, pandas and LightGBM release the
+    GIL for most of their work, so the loop stays responsive while the workers are busy
+    """
+
+    workers: int
+    name: str
+    executor: ThreadPoolExecutor | None
+
+    def __init__(self, workers: int = CPU_WORKERS, name: str = "cpu"):
+        self.workers = workers
+        self.name = name
+        self.executor = None
+        self.lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.wait = LatencyStats()
+        self.runtime = LatencyStats()
+
+    async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        """
+        Run func in the pool. Context variables are passed on, like asyncio.to_thread does
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+        call = functools.partial(contextvars.copy_context().run, self._timed, time.monotonic(), func, *args, **kwargs)
+        with self.lock:
+            self.queued += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def _timed(self, submitted: float, func: Callable[..., T], *args, **kwargs) -> T:
+        started = time.monotonic()
+        with self.lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait.record(started - submitted)
+        ok = False
+        try:
+            result = func(*args, **kwargs)
+            ok = True
+            return result
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.runtime.record(time.monotonic() - started, ok)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "wait": self.wait.stats(),
+            "runtime": self.runtime.stats(),
+        }
+
+
+_pool = WorkerPool()
+
+async def run_cpu(func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """
+    Run CPU bound func in the process-wide worker pool
+    """
+    return await _pool.run(func, *args, **kwargs)
+
+def worker_stats() -> dict:
+    return _pool.stats()
+
+
+class LoopLagMonitor:
+    """
+    Watchdog for the event loop. A heartbeat coroutine ticks every interval, a thread checks that it keeps ticking.
+    If it doesn't for longer than threshold seconds, some callback blocks the loop - log what the loop thread is running
+    right now, and in which task. Logged once per stall
+    """
+
+    threshold: float
+    interval: float
+
+    def __init__(self, threshold: float, interval: float | None = None):
+        self.threshold = threshold
+        self.interval = interval if interval is not None else threshold / 4
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.loop_thread: int | None = None
+        self.heartbeat = time.monotonic()
+        self.task: asyncio.Task | None = None
+        self.thread: threading.Thread | None = None
+        self.stopped = threading.Event()
+
+        self.stalls = 0
+        self.max_lag = 0.0
+
+    def start(self):
+        """
+        Call from the event loop to be watched
+        """
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self.stopped.clear()
+        self.task = asyncio.create_task(self._beat())
+        self.thread = threading.Thread(target=self._watch, name="loop-lag-monitor", daemon=True)
+        self.thread.start()
+        log.info(f"event loop lag monitor started, threshold {self.threshold}s")
+
+    async def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        if self.thread is not None:
+            await asyncio.to_thread(self.thread.join)
+
+    async def _beat(self):
+        while True:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.max_lag = max(self.max_lag, now - before - self.interval)
+            self.heartbeat = now
+
+    def _watch(self):
+        reported = None
+        while not self.stopped.wait(self.interval):
+            heartbeat = self.heartbeat
+            # the next beat is due interval after the last one
+            lag = time.monotonic() - heartbeat - self.interval
+            if lag > self.threshold and reported != heartbeat:
+                reported = heartbeat
+                self.stalls += 1
+                log.warning(f"event loop blocked for {lag:.2f}s{self._culprit()}")
+
+    def _culprit(self) -> str:
+        """
+        Task and stack of the loop thread at this moment
+        """
+        assert self.loop is not None and self.loop_thread is not None
+        task = asyncio.current_task(self.loop)
+        where = f" in task {task.get_name()} ({task.get_coro()!r})" if task is not None else " outside of any task"
+        frame = sys._current_frames().get(self.loop_thread)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        return f"{where}:\n{stack}"
+
+    def stats(self) -> dict:
+        return {
+            "threshold": self.threshold,
+            "stalls": self.stalls,
+            "max_lag": round(self.max_lag, 3),
+        }
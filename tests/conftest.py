@@ -19,6 +19,24 @@ def event_loop():
     loop.close()
 
 
+@pytest.fixture(autouse=True)
+def isolated_gas_price_source():
+    """Don't share the process-wide gas price source between tests."""
+    from predictor.model import gaspricestore
+    gaspricestore._sources.clear()
+    yield
+    gaspricestore._sources.clear()
+
+
+@pytest.fixture(autouse=True)
+def isolated_circuit_breakers():
+    """Don't carry circuit breaker state over to other tests."""
+    from predictor.model import resilience
+    resilience._breakers.clear()
+    yield
+    resilience._breakers.clear()
+
+
 @pytest.fixture
 def temp_storage_dir():
     """Create a temporary directory for data storage."""
@@ -168,10 +186,11 @@ def mocked_predictor(
 ):
     """Create a PricePredictor with all stores mocked."""
     from predictor.model.pricepredictor import PricePredictor
+    from predictor.model.slotgrid import SlotFrame
 
     predictor = PricePredictor(sample_region)
-    predictor.weatherstore.get_data = AsyncMock(return_value=sample_weather_data)
-    predictor.pricestore.get_data = AsyncMock(return_value=sample_price_data)
-    predictor.auxstore.get_data = AsyncMock(return_value=sample_aux_data)
-    predictor.entsoestore.get_data = AsyncMock(return_value=sample_entsoe_data)
+    predictor.weatherstore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_weather_data)))
+    predictor.pricestore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_price_data)))
+    predictor.auxstore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_aux_data)))
+    predictor.entsoestore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_entsoe_data)))
     return predictor
@@ -0,0 +1,143 @@
+"""
+Previous implementations of optimized code paths and the synthetic data to compare them on.
+Used by the tests to check that the new implementations give the same results, and by predictor.benchmarks
+"""
+
+import json
+import re
+from datetime import datetime, timedelta, timezone
+from math import nan
+
+import numpy as np
+import pandas as pd
+
+from predictor.model.pricepredictor import PricePredictor
+
+
+def shape_load_forecast_rowwise(load_forecast: pd.DataFrame) -> pd.Series:
+    """
+    Previous row-by-row implementation of shape_load_forecast, for reference
+    """
+    load_forecast = load_forecast.resample("15min").ffill()
+
+    def resample_load_to_hourly(row):
+        maxload = row["Max Forecasted Load"]
+        minload = row["Min Forecasted Load"]
+        if row.name.hour == 11 and row.name.minute == 30:
+            return maxload
+        elif row.name.hour == 19 and row.name.minute == 0:
+            return maxload
+        elif row.name.hour == 14 and row.name.minute == 30:
+            return (3 * maxload + minload) / 4.0
+        elif row.name.hour == 3 and row.name.minute == 0:
+            return minload
+        return nan
+
+    load_hourly = load_forecast.apply(resample_load_to_hourly, axis=1)
+    load_hourly = load_hourly.interpolate(method='cubic').dropna()
+    load_hourly.name = "load"
+    return load_hourly
+
+
+def parse_gas_prices_regex(txt: str) -> pd.DataFrame:
+    """
+    Previous regex based implementation of extract_gas_prices, for reference
+    """
+    pattern = re.compile(r"data_myChartId_.*_export\s*= [\w\W]*?labels: (?P<labels>.*?\])[\w\W]*?THE Future \(M\+1\)[\w\W]*?data: (?P<data>.*?\])")
+    for match in pattern.finditer(txt):
+        timestamps = json.loads(match.group("labels").replace("'", "\""))
+        prices = json.loads(match.group("data").replace(" ,", "null,"))
+
+    pricedict = {}
+
+    for i, t in enumerate(timestamps):
+        gasprice = prices[i]
+        if isinstance(gasprice, float): # sometimes "null" ??
+            time = pd.to_datetime(datetime.strptime(t, "%d.%m.%Y").replace(tzinfo=timezone.utc))
+            pricedict[time] = gasprice
+
+    df = pd.DataFrame.from_dict(pricedict, orient="index", columns=["gasprice"])
+    return df.resample('15min').ffill()
+
+
+def daily_load_forecast(days: int, tz: str = "Europe/Berlin") -> pd.DataFrame:
+    """
+    Random daily min/max load forecast like ENTSO-E's A65/A31 documents
+    """
+    index = pd.date_range("2025-09-01", periods=days, freq="D", tz=tz)
+    rng = np.random.default_rng(42)
+    minload = rng.uniform(30000, 40000, days)
+    return pd.DataFrame({
+        "Min Forecasted Load": minload,
+        "Max Forecasted Load": minload + rng.uniform(10000, 20000, days),
+    }, index=index)
+
+
+def assemble_features_concat(weather: pd.DataFrame, aux: pd.DataFrame, entsoe: pd.DataFrame | None, gas: pd.DataFrame | None,
+                             prices: pd.DataFrame, actual_start: datetime) -> pd.DataFrame:
+    """
+    Previous concat based feature assembly of PricePredictor.prepare_dataframe, for reference
+    """
+    df = pd.concat([weather, aux], axis=1, sort=True)
+    if entsoe is not None and len(entsoe) > 0:
+        df = pd.concat([df, entsoe], axis=1, sort=True)
+    if gas is not None:
+        gas = gas.reindex(weather.index).ffill()
+        df = pd.concat([df, gas], axis=1, sort=True)
+    df = pd.concat([df, prices], axis=1, sort=True)
+    return df[actual_start:]
+
+
+def store_frames(days: int, locations: int = 4) -> dict[str, pd.DataFrame]:
+    """
+    Random store contents of a training window, with the usual horizons: weather and aux data reach a week into the future,
+    load forecasts a few days, prices until tomorrow and gas prices lag a few days behind
+    """
+    rng = np.random.default_rng(42)
+    start = pd.Timestamp("2025-06-01", tz="UTC")
+    now = start + pd.Timedelta(days=days)
+
+    def frame(end: pd.Timestamp, columns: list[str]) -> pd.DataFrame:
+        index = pd.date_range(start, end, freq="15min", name="time")
+        return pd.DataFrame(rng.normal(size=(len(index), len(columns))), index=index, columns=columns)
+
+    weather = [f"{v}_{i}" for i in range(locations) for v in ("wind", "temp", "irradiance", "pressure", "humidity")]
+    aux = ["holiday"] + [f"day_{i}" for i in range(6)] + ["sunelevation", "azimuth", "sr_influence", "ss_influence", "morningpeak", "eveningpeak"]
+    return {
+        "weather": frame(now + pd.Timedelta(days=7), weather),
+        "aux": frame(now + pd.Timedelta(days=7), aux),
+        "entsoe": frame(now + pd.Timedelta(days=4), ["load"]),
+        "gas": frame(now - pd.Timedelta(days=3), ["gasprice"]),
+        "prices": frame(now + pd.Timedelta(days=1), ["price"]),
+    }
+
+
+async def perform_test(predictor: PricePredictor, start: datetime, end: datetime, learn_days: int) -> tuple[list[list[float]], list[list[float]]]:
+    """
+    The daily loop of the previous performance_testing.perform_test on one predictor, for reference.
+    MAE and MSE of every iteration, per predicted day
+    """
+    learn_start = start - timedelta(days=learn_days)
+    learn_end = start
+    maes = []
+    mses = []
+
+    while learn_end < end - timedelta(days=3):
+        days = [learn_end + timedelta(days=i) for i in range(4)]
+
+        predictor.pricestore.horizon_cutoff = learn_end
+        predictor.gasstore.horizon_cutoff = learn_end
+
+        await predictor.train(learn_start, learn_end - timedelta(minutes=15)) # exclusive last
+        prediction = await predictor.predict(days[0], days[3], False)
+
+        predictor.pricestore.horizon_cutoff = None
+        actual = await predictor.pricestore.get_data(days[0], days[3])
+
+        errors = [actual.loc[a:b]["price"] - prediction.loc[a:b]["price"] for a, b in zip(days, days[1:])]
+        maes.append([float(e.abs().mean()) for e in errors])
+        mses.append([float(e.pow(2).mean()) for e in errors])
+
+        learn_start += timedelta(days=1)
+        learn_end += timedelta(days=1)
+    return maes, mses
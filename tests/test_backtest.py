@@ -0,0 +1,222 @@
+"""Tests for predictor.backtest module."""
+
+import math
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictor import backtest
+from predictor.backtest import (Iteration, backtest_predictor, build_features, check_leakage, learn_ends, load_results, run_days, select,
+                               shards, split_cores, stored_results, summarize)
+from predictor.model.featurematrix import FullRangeFeatures
+from predictor.model.pricepredictor import PricePredictor
+from predictor.model.priceregion import PriceRegionName
+from tests.legacy import perform_test
+
+# no Entso-E and gas prices, everything else is in the data directory
+REGION = PriceRegionName.NL
+START = datetime(2025, 3, 11, tzinfo=timezone.utc)
+END = datetime(2025, 3, 16, tzinfo=timezone.utc)
+LEARN_DAYS = 10
+
+
+async def _write_data(data_dir: str):
+    """Persist synthetic weather and prices for the whole backtest range."""
+    rng = np.random.default_rng(0)
+    index = pd.date_range(START - timedelta(days=LEARN_DAYS + 1), END + timedelta(days=1), freq="15min", tz="UTC", name="time")
+    weather = pd.DataFrame(rng.normal(size=(len(index), 3)), index=index, columns=["wind_speed_80m_0", "temperature_2m_0", "global_tilted_irradiance_0"])
+    hours = index.hour + index.minute / 60
+    prices = pd.DataFrame({"price": 8 + 2 * np.sin(hours / 24 * 2 * np.pi) - 3 * weather["wind_speed_80m_0"].to_numpy()}, index=index)
+
+    predictor = PricePredictor(REGION.to_region(), data_dir)
+    predictor.weatherstore.data = weather
+    predictor.pricestore.data = prices
+    await predictor.weatherstore.serialize()
+    await predictor.pricestore.serialize()
+
+
+class TestSchedule:
+    """Tests for splitting a backtest into iterations."""
+
+    def test_learn_ends(self):
+        """Test that every day is tested as long as all predicted days are in the range."""
+        days = learn_ends(START, END)
+
+        assert days == [START, START + timedelta(days=1)]
+
+    def test_shards_are_consecutive(self):
+        """Test that shards are runs of consecutive days covering all days once."""
+        days = learn_ends(START, START + timedelta(days=10))
+
+        parts = shards(days, 3)
+
+        assert [len(p) for p in parts] == [3, 3, 1]
+        assert sum(parts, []) == days
+
+    def test_workers_split_cores(self, monkeypatch):
+        """Test that worker processes get their share of the cores and one CPU worker, unless the user set them."""
+        monkeypatch.setattr(backtest.os, "cpu_count", lambda: 12)
+        monkeypatch.delenv("EPEXPREDICTOR_CPU_CORES", raising=False)
+        monkeypatch.setenv("EPEXPREDICTOR_CPU_WORKERS", "2")
+
+        with split_cores(4):
+            assert os.environ["EPEXPREDICTOR_CPU_CORES"] == "3"
+            assert os.environ["EPEXPREDICTOR_CPU_WORKERS"] == "2"
+        assert "EPEXPREDICTOR_CPU_CORES" not in os.environ
+
+
+class TestSummary:
+    """Tests for aggregating iteration errors."""
+
+    def test_mean_errors_per_day(self):
+        """Test that MAE is the mean and RMSE the root of the mean MSE, per region and predicted day."""
+        iterations = [
+            Iteration("DE", START, [1.0, 2.0, 3.0], [1.0, 4.0, 9.0], 2.0, 0.1, 10, 960, 20, 30),
+            Iteration("DE", START + timedelta(days=1), [3.0, 2.0, 1.0], [9.0, 4.0, 1.0], 4.0, 0.1, 10, 960, 20, 30),
+            Iteration("AT", START, [1.0, 1.0, 1.0], [1.0, 1.0, 1.0], 1.0, 0.1, 10, 960, 20, 30),
+        ]
+
+        de, at = summarize(iterations)
+
+        assert (de.region, de.iterations, at.region) == ("DE", 2, "AT")
+        assert de.mae == [2.0, 2.0, 2.0]
+        assert de.rmse == [math.sqrt(5), 2.0, math.sqrt(5)]
+        assert de.train_seconds == 3.0
+
+
+class TestResults:
+    """Tests for the results file."""
+
+    def test_round_trip(self, tmp_path):
+        """Test that stored iterations are read back unchanged, the last one per region and day, skipping cut off lines."""
+        first = Iteration("DE", START, [1.0, 2.0, 3.0], [1.0, 4.0, 9.0], 2.0, 0.1, 10, 960, 20, 30)
+        second = Iteration("DE", START + timedelta(days=1), [1.0, 2.0, 3.0], [1.0, 4.0, 9.0], 2.0, 0.1, 10, 960, 20, 30)
+        again = Iteration("DE", START, [0.5, 0.5, 0.5], [1.0, 1.0, 1.0], 3.0, 0.1, 10, 960, 20, 25)
+        path = tmp_path / "results.jsonl"
+        path.write_text(first.to_json() + "\n" + second.to_json() + "\n" + again.to_json() + "\n" + second.to_json()[:20])
+
+        assert load_results(str(path)) == [again, second]
+        assert load_results(str(tmp_path / "missing.jsonl")) == []
+
+    def test_incomplete_fields_skipped(self, tmp_path):
+        """Test that lines missing fields are skipped like cut off ones."""
+        it = Iteration("DE", START, [1.0, 2.0, 3.0], [1.0, 4.0, 9.0], 2.0, 0.1, 10, 960, 20, 30)
+        path = tmp_path / "results.jsonl"
+        path.write_text('{"region": "DE"}\n' + '{"region": "DE", "learn_end": "2025-03-11T00:00:00+00:00"}\n' + it.to_json() + "\n")
+
+        assert load_results(str(path)) == [it]
+
+    def test_stored_results(self, tmp_path):
+        """Test that reports only use the results of the same regions, days, training window and mode."""
+        wanted = Iteration("NL", START, [1.0] * 3, [1.0] * 3, 2.0, 0.1, LEARN_DAYS, 960, 20, 30, sequential=True)
+        others = [
+            Iteration("NL", START + timedelta(days=1), [1.0] * 3, [1.0] * 3, 2.0, 0.1, LEARN_DAYS + 1, 960, 20, 30, sequential=True),
+            Iteration("NL", START + timedelta(days=5), [1.0] * 3, [1.0] * 3, 2.0, 0.1, LEARN_DAYS, 960, 20, 30, sequential=True),
+            Iteration("DE", START, [1.0] * 3, [1.0] * 3, 2.0, 0.1, LEARN_DAYS, 960, 20, 30, sequential=True),
+        ]
+        path = tmp_path / "results.jsonl"
+        path.write_text("".join(it.to_json() + "\n" for it in [wanted, *others]))
+
+        assert stored_results(str(path), [REGION], START, END, LEARN_DAYS, sequential=True) == [wanted]
+        assert stored_results(str(path), [REGION], START, END, LEARN_DAYS) == []
+
+    def test_select(self):
+        """Test that only the given regions and the days a backtest of the range tests are selected, in region order."""
+        iterations = [Iteration(region, START + timedelta(days=day), [1.0] * 3, [1.0] * 3, 2.0, 0.1, 10, 960, 20, 30)
+                      for region in ["DE", "NL", "AT"] for day in range(4)]
+
+        selected = select(iterations, [PriceRegionName.NL, PriceRegionName.DE], START, END)
+
+        assert [(it.region, it.learn_end) for it in selected] == [("NL", START), ("NL", START + timedelta(days=1)),
+                                                                  ("DE", START), ("DE", START + timedelta(days=1))]
+
+
+class TestBacktest:
+    """Tests for running backtests."""
+
+    @pytest.mark.asyncio
+    async def test_workers_match_sequential_run(self, temp_storage_dir):
+        """Test that iterations spread over worker processes, with precomputed features, give the same errors as one predictor
+        reading the stores for all days in order."""
+        await _write_data(temp_storage_dir)
+
+        results = f"{temp_storage_dir}/backtest.jsonl"
+        parallel = await backtest.backtest([REGION], temp_storage_dir, START, END, LEARN_DAYS, workers=2, shard_days=1, results=results)
+        predictor = await backtest_predictor(REGION, temp_storage_dir).load_from_persistence()
+        sequential = await run_days(REGION, predictor, LEARN_DAYS, learn_ends(START, END))
+
+        assert [it.learn_end for it in parallel] == [START, START + timedelta(days=1)]
+        for p, s in zip(parallel, sequential):
+            assert p.mae == pytest.approx(s.mae)
+            assert p.mse == pytest.approx(s.mse)
+            assert p.rounds == s.rounds
+            assert p.rows == s.rows == LEARN_DAYS * 96
+        assert all(0 < mae < 10 for it in parallel for mae in it.mae)
+        assert sorted(load_results(results), key=lambda it: it.learn_end) == parallel
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mode", ["full", "incremental"])
+    async def test_sequential_matches_performance_test(self, temp_storage_dir, monkeypatch, mode):
+        """Test that a sequential backtest gives the errors of the previous performance test loop, which trains one
+        predictor configured like the service on all days in order."""
+        await _write_data(temp_storage_dir)
+        # the worker processes read it at import
+        monkeypatch.setenv("EPEXPREDICTOR_TRAINING_MODE", mode)
+
+        iterations = await backtest.backtest([REGION], temp_storage_dir, START, END, LEARN_DAYS, workers=1, shard_days=1, sequential=True)
+        predictor = await PricePredictor(REGION.to_region(), temp_storage_dir, training_mode=mode).load_from_persistence()
+        maes, mses = await perform_test(predictor, START, END, LEARN_DAYS)
+
+        assert len(iterations) == len(maes) == 2
+        for it, mae, mse in zip(iterations, maes, mses):
+            assert it.sequential
+            assert it.mae == pytest.approx(mae)
+            assert it.mse == pytest.approx(mse)
+        assert predictor.last_fit == mode
+
+    @pytest.mark.asyncio
+    async def test_resume(self, temp_storage_dir):
+        """Test that a restarted run only tests the days missing in the results file."""
+        await _write_data(temp_storage_dir)
+        results = f"{temp_storage_dir}/backtest.jsonl"
+        predictor = await backtest_predictor(REGION, temp_storage_dir).load_from_persistence()
+        done = await run_days(REGION, predictor, LEARN_DAYS, [START], results=results)
+        # crashed while writing the next day
+        with open(results, "a") as f:
+            f.write('{"region": "NL", "learn_')
+
+        resumed = await backtest.backtest([REGION], temp_storage_dir, START, END, LEARN_DAYS, workers=1, results=results)
+
+        assert [it.learn_end for it in resumed] == [START, START + timedelta(days=1)]
+        assert resumed[0] == done[0]
+        assert len(load_results(results)) == 2
+        with pytest.raises(ValueError):
+            await backtest.backtest([REGION], temp_storage_dir, START, END, LEARN_DAYS + 1, workers=1, results=results)
+
+
+class TestPrecomputedFeatures:
+    """Tests for cutting backtest features out of one matrix."""
+
+    @pytest.mark.asyncio
+    async def test_no_leakage(self, temp_storage_dir):
+        """Test that the matrix gives the frames the stores give with horizon_cutoff, for every day."""
+        await _write_data(temp_storage_dir)
+        predictor = await backtest_predictor(REGION, temp_storage_dir).load_from_persistence()
+        features = await build_features(predictor, START - timedelta(days=LEARN_DAYS), END)
+
+        for learn_end in learn_ends(START, END):
+            await check_leakage(predictor, features, LEARN_DAYS, learn_end)
+
+    @pytest.mark.asyncio
+    async def test_leakage_detected(self, temp_storage_dir, monkeypatch):
+        """Test that the check fails if prices after the cutoff are not hidden."""
+        await _write_data(temp_storage_dir)
+        predictor = await backtest_predictor(REGION, temp_storage_dir).load_from_persistence()
+        features = await build_features(predictor, START - timedelta(days=LEARN_DAYS), END)
+        monkeypatch.setattr(FullRangeFeatures, "CUT", ())
+
+        with pytest.raises(RuntimeError):
+            await check_leakage(predictor, features, LEARN_DAYS, START)
@@ -0,0 +1,74 @@
+"""Tests for predictor.model.cpubudget module."""
+
+import asyncio
+
+import pytest
+
+from predictor.model.cpubudget import CpuBudget
+
+
+class TestCpuBudget:
+    """Tests for thread budgets of concurrent jobs."""
+
+    @pytest.mark.asyncio
+    async def test_training_leaves_cores_for_inference(self):
+        """Test that a training doesn't take the core reserved for predictions."""
+        budget = CpuBudget(cores=4)
+
+        async with budget.reserve("training") as training:
+            async with budget.reserve("inference", 2) as inference:
+                assert training == 3
+                assert inference == 1
+                assert budget.in_use == 4
+        assert budget.in_use == 0
+
+    @pytest.mark.asyncio
+    async def test_parallel_trainings_split_cores(self):
+        """Test that trainings expected to run in parallel each ask for their part only."""
+        budget = CpuBudget(cores=9)
+
+        async with budget.reserve("training", parallel=2) as first, budget.reserve("training", parallel=2) as second:
+            assert (first, second) == (4, 4)
+
+    @pytest.mark.asyncio
+    async def test_waiting_jobs_share_freed_cores(self):
+        """Test that queued jobs wait for free cores and split them when they get their turn."""
+        budget = CpuBudget(cores=4, inference_reserve=0)
+        granted = []
+        release = asyncio.Event()
+
+        async def job():
+            async with budget.reserve("inference", 4) as threads:
+                granted.append(threads)
+                await release.wait()
+
+        first = asyncio.create_task(job())
+        await asyncio.sleep(0)
+        waiting = [asyncio.create_task(job()) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert granted == [4]
+        assert budget.stats()["waiting"] == 2
+
+        release.set()
+        await asyncio.gather(first, *waiting)
+
+        assert granted == [4, 2, 2]
+        assert budget.in_use == 0
+        stats = budget.stats()["jobs"]["inference"]
+        assert stats["wait"]["count"] == 3
+        assert stats["runtime"]["count"] == 3
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_queue(self):
+        """Test that a job cancelled while waiting doesn't hold on to cores."""
+        budget = CpuBudget(cores=1)
+
+        async with budget.reserve("inference"):
+            task = asyncio.create_task(budget.reserve("inference").__aenter__())
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            assert budget.stats()["waiting"] == 0
+
+        assert budget.in_use == 0
@@ -1,12 +1,15 @@
 """Tests for predictor.model.datastore module."""
 
+import asyncio
 import os
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
 
 import pandas as pd
 import pytest
 
-from predictor.model.datastore import DataStore
+from predictor.model.datastore import ALL_SLOTS, CHANGELOG_LENGTH, DataStore
+from predictor.model.slotgrid import slot_index, to_slot
 
 
 class ConcreteDataStore(DataStore):
@@ -54,6 +57,212 @@ class TestDataStoreGetData:
         assert not result.empty
 
 
+
+class SlowDataStore(ConcreteDataStore):
+    """DataStore with a slow fake upstream that records what it fetched."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetched = []
+
+    async def fetch_missing_data(self, start, end):
+        missing = self.gen_missing_date_ranges(start, end)
+        self.fetched.extend(missing)
+        await asyncio.sleep(0.01)
+        for rstart, rend in missing:
+            await super().fetch_missing_data(rstart, rend)
+        return len(missing) > 0
+
+
+class TestDataStoreSingleFlight:
+    """Tests for deduplication of concurrent fetches."""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_are_coalesced(self, sample_region):
+        """Test that identical concurrent requests share one fetch."""
+        store = SlowDataStore(sample_region)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+        results = await asyncio.gather(*[store.get_data(start, end) for _ in range(5)])
+
+        assert len(store.fetched) == 1
+        assert store.fetch_stats() == {"fetches": 1, "coalesced": 4, "inflight": 0}
+        for result in results:
+            assert len(result) == 97
+
+    @pytest.mark.asyncio
+    async def test_partial_overlap_fetches_remainder(self, sample_region):
+        """Test that a request overlapping a running fetch only fetches what that one doesn't cover."""
+        store = SlowDataStore(sample_region)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        mid = datetime(2025, 1, 2, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 3, tzinfo=timezone.utc)
+
+        await asyncio.gather(store.get_data(start, mid), store.get_data(start, end))
+
+        assert store.fetched == [
+            (pd.Timestamp(start), pd.Timestamp(mid)),
+            (pd.Timestamp(mid + timedelta(minutes=15)), pd.Timestamp(end)),
+        ]
+        assert store.coalesced == 0
+
+    @pytest.mark.asyncio
+    async def test_failure_is_shared(self, sample_region):
+        """Test that all callers joining a failing fetch see its error and the next request retries."""
+        store = SlowDataStore(sample_region)
+        store.fetch_missing_data = AsyncMock(side_effect=ConnectionError("upstream down"))
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+        results = await asyncio.gather(store.get_data(start, end), store.get_data(start, end), return_exceptions=True)
+
+        assert all(isinstance(r, ConnectionError) for r in results)
+        assert store.fetch_missing_data.call_count == 1
+        assert store.inflight == []
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_fetch(self, sample_region):
+        """Test that the shared fetch survives cancellation of the caller that started it."""
+        store = SlowDataStore(sample_region)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 2, tzinfo=timezone.utc)
+
+        first = asyncio.create_task(store.get_data(start, end))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(store.get_data(start, end))
+        await asyncio.sleep(0)
+        first.cancel()
+
+        assert len(await second) == 97
+        assert first.cancelled()
+
+
+class TestDataStoreSnapshots:
+    """Tests for copy-on-write snapshots."""
+
+    def _df(self, start, periods, value):
+        dates = pd.date_range(start=start, periods=periods, freq="15min", tz="UTC")
+        df = pd.DataFrame({"value": [value] * periods}, index=dates)
+        df.index.name = "time"
+        return df
+
+    def test_update_publishes_new_version(self, sample_region):
+        """Test that changes publish a new snapshot and no-op updates don't."""
+        store = ConcreteDataStore(sample_region)
+        assert store.snapshot.version == 0
+
+        store._update_data(self._df("2025-01-01", 4, 1.0))
+        assert store.snapshot.version == 1
+
+        store._update_data(self._df("2025-01-01", 4, 1.0))
+        assert store.snapshot.version == 1
+
+    def test_old_snapshot_unchanged(self, sample_region):
+        """Test that readers holding a snapshot don't see later updates."""
+        store = ConcreteDataStore(sample_region)
+        store._update_data(self._df("2025-01-02", 4, 1.0))
+        snapshot = store.snapshot
+
+        store._update_data(self._df("2025-01-01", 4, 2.0))
+        store.drop_before(datetime(2025, 1, 2, tzinfo=timezone.utc))
+
+        assert len(snapshot.data) == 4
+        assert store.snapshot.version == 3
+
+    @pytest.mark.asyncio
+    async def test_readers_cant_modify_snapshot(self, sample_region):
+        """Test that data handed out by a store can't change the published snapshot."""
+        store = ConcreteDataStore(sample_region)
+        store._update_data(self._df("2025-01-01", 8, 1.0))
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 1, 1, tzinfo=timezone.utc)
+
+        data = await store.get_data(start, end)
+        data.iloc[0, 0] = 5.0
+        slots = await store.get_slots(start, end)
+        with pytest.raises(ValueError):
+            slots.values[0, 0] = 5.0
+
+        assert (store.data["value"] == 1.0).all()
+        assert (store.snapshot.slots.values == 1.0).all()
+
+    def test_update_keeps_data_sorted(self, sample_region):
+        """Test that merged data is sorted without sorting the published frame in place."""
+        store = ConcreteDataStore(sample_region)
+        store._update_data(self._df("2025-01-02", 4, 1.0))
+        store._update_data(self._df("2025-01-01", 4, 2.0))
+
+        assert store.data.index.is_monotonic_increasing
+
+    @pytest.mark.asyncio
+    async def test_readers_dont_wait_for_writers(self, sample_region):
+        """Test that reading already known data doesn't queue behind a running update."""
+        store = ConcreteDataStore(sample_region)
+        store._update_data(self._df("2025-01-01", 8, 1.0))
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 1, 1, tzinfo=timezone.utc)
+
+        async def locked_fetch(start, end):
+            async with store.update_lock:
+                return False
+        store.fetch_missing_data = locked_fetch
+
+        async with store.update_lock:
+            version, data = await asyncio.wait_for(store.get_versioned_data(start, end), 1)
+
+        assert version == 1
+        assert len(data) == 5
+
+    @pytest.mark.asyncio
+    async def test_get_slots_matches_get_data(self, sample_region):
+        """Test that the slot view holds the same data as the pandas view, including the horizon cutoff."""
+        store = ConcreteDataStore(sample_region)
+        store._update_data(self._df("2025-01-01", 96, 1.0))
+        store.horizon_cutoff = datetime(2025, 1, 1, 12, tzinfo=timezone.utc)
+        start = datetime(2025, 1, 1, 2, 5, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 1, 18, tzinfo=timezone.utc)
+
+        slots = await store.get_slots(start, end)
+
+        data = await store.get_data(start, end)
+        assert slot_index(slots.base, slots.end)[slots.rows].equals(data.index)
+        assert (slots.values[slots.rows] == data.to_numpy()).all()
+        assert store.snapshot.slots is store.snapshot.slots
+
+    def test_changed_since(self, sample_region):
+        """Test that snapshots report the slot range that changed since an older version."""
+        store = ConcreteDataStore(sample_region)
+        store._update_data(self._df("2025-01-01", 96, 1.0))
+        first = to_slot(datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+        store._update_data(self._df("2025-01-01 12:00", 4, 2.0))
+        assert store.snapshot.changed_since(2) is None
+        assert store.snapshot.changed_since(1) == (first + 48, first + 52)
+
+        store._update_data(self._df("2025-01-01 02:00", 4, 3.0))
+        assert store.snapshot.changed_since(1) == (first + 8, first + 52)
+
+        store.drop_before(datetime(2025, 1, 1, 1, tzinfo=timezone.utc))
+        assert store.snapshot.changed_since(3) == (ALL_SLOTS[0], first + 5)
+
+        # nothing to drop - no new version
+        store.drop_before(datetime(2025, 1, 1, 1, tzinfo=timezone.utc))
+        assert store.snapshot.version == 4
+
+    def test_changed_since_unknown_version(self, sample_region):
+        """Test that versions that are too old to tell report everything as changed."""
+        store = ConcreteDataStore(sample_region)
+        store.data = self._df("2025-01-01", 4, 1.0)
+        for i in range(CHANGELOG_LENGTH + 1):
+            store._update_data(self._df("2025-01-01", 4, float(i + 2)))
+
+        assert store.snapshot.changed_since(1) == ALL_SLOTS
+        assert store.snapshot.changed_since(0) == ALL_SLOTS
+        assert store.snapshot.changed_since(store.snapshot.version + 1) == ALL_SLOTS
+        assert store.snapshot.changed_since(store.snapshot.version - CHANGELOG_LENGTH) != ALL_SLOTS
+
+
 class TestDataStoreDropMethods:
     """Tests for drop_after and drop_before methods."""
 
@@ -163,6 +372,22 @@ class TestDataStoreUpdateData:
         # Should not have duplicates
         assert len(store.data) == len(df)
 
+    @pytest.mark.asyncio
+    async def test_update_data_in_worker_merges_again(self, sample_region):
+        """Test that an update published while the worker merged is not lost."""
+        store = ConcreteDataStore(sample_region)
+        dates = pd.date_range(start="2025-01-01", periods=8, freq="15min", tz="UTC", name="time")
+        df1 = pd.DataFrame({"value": [1.0] * 4}, index=dates[:4])
+        df2 = pd.DataFrame({"value": [2.0] * 4}, index=dates[4:])
+
+        task = asyncio.create_task(store.update_data(df1))
+        await asyncio.sleep(0)
+        store._update_data(df2)
+
+        assert await task
+        assert list(store.data["value"]) == [1.0] * 4 + [2.0] * 4
+        assert store.snapshot.version == 2
+
 
 class TestDataStoreSerialization:
     """Tests for serialize and load methods."""
@@ -445,3 +670,138 @@ class TestDataStorePersistenceEdgeCases:
         store3 = await ConcreteDataStore(sample_region, temp_storage_dir, "test").load()
         assert len(store3.data) == 3
         assert store3.data["value"].tolist() == [100, 200, 300]
+
+
+class BackfillDataStore(ConcreteDataStore):
+    """DataStore with a fake upstream for backfill tests."""
+
+    backfill_chunk = timedelta(days=2)
+    backfill_concurrency = 3
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetched = []
+        self.running = 0
+        self.max_running = 0
+        # the upstream has no data after this
+        self.source_end = None
+
+    async def fetch_range(self, rstart, rend):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        self.fetched.append((rstart, rend))
+        if self.source_end is not None:
+            rend = min(rend, self.source_end)
+        dates = pd.date_range(start=rstart, end=rend, freq="15min")
+        df = pd.DataFrame({"value": [1.0] * len(dates)}, index=dates)
+        df.index.name = "time"
+        return df
+
+    def get_next_horizon_revalidation_time(self):
+        return datetime.now(timezone.utc) + timedelta(hours=1)
+
+
+class TestDataStoreBackfill:
+    """Tests for backfill method."""
+
+    def test_gen_backfill_chunks(self, sample_region):
+        """Test that missing ranges are split into chunks without gaps or overlaps."""
+        store = BackfillDataStore(sample_region)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 10, tzinfo=timezone.utc)
+
+        chunks = store.gen_backfill_chunks(start, end)
+
+        assert len(chunks) == 5
+        assert chunks[0][0] == pd.Timestamp(start)
+        assert chunks[-1][1] == pd.Timestamp(end)
+        for (_, prev_end), (next_start, _) in zip(chunks, chunks[1:]):
+            assert next_start - prev_end == timedelta(minutes=15)
+
+    @pytest.mark.asyncio
+    async def test_backfill_fetches_concurrently(self, sample_region):
+        """Test that chunks are fetched in parallel, limited by backfill_concurrency."""
+        store = BackfillDataStore(sample_region)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 20, tzinfo=timezone.utc)
+
+        assert await store.backfill(start, end)
+
+        assert store.max_running == store.backfill_concurrency
+        assert len(store.gen_missing_date_ranges(start, end)) == 0
+
+    @pytest.mark.asyncio
+    async def test_backfill_serializes_once(self, sample_region, temp_storage_dir):
+        """Test that all chunks are merged and serialized in one go."""
+        store = BackfillDataStore(sample_region, temp_storage_dir, "test")
+        store.serialize = AsyncMock()
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 20, tzinfo=timezone.utc)
+
+        await store.backfill(start, end)
+
+        assert len(store.fetched) > 1
+        assert store.serialize.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_backfill_only_fetches_missing(self, sample_region):
+        """Test that existing data is not fetched again."""
+        store = BackfillDataStore(sample_region)
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 4, tzinfo=timezone.utc)
+        await store.backfill(start, end)
+        store.fetched.clear()
+
+        assert not await store.backfill(start, end)
+        assert store.fetched == []
+
+    @pytest.mark.asyncio
+    async def test_backfill_ignores_failed_chunks(self, sample_region):
+        """Test that one failing chunk doesn't discard the others."""
+        store = BackfillDataStore(sample_region)
+        fetch = store.fetch_range
+
+        async def flaky(rstart, rend):
+            if rstart == pd.Timestamp(datetime(2025, 1, 1, tzinfo=timezone.utc)):
+                raise ConnectionError("upstream down")
+            return await fetch(rstart, rend)
+
+        store.fetch_range = flaky
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 8, tzinfo=timezone.utc)
+
+        assert await store.backfill(start, end)
+        assert len(store.gen_missing_date_ranges(start, end)) == 1
+
+    @pytest.mark.asyncio
+    async def test_backfill_stops_at_source_horizon(self, sample_region):
+        """Test that the range after the end of the source's data is only fetched again once the horizon is due."""
+        store = BackfillDataStore(sample_region)
+        store.source_end = pd.Timestamp(datetime(2025, 1, 3, tzinfo=timezone.utc))
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 6, tzinfo=timezone.utc)
+        assert await store.backfill(start, end)
+        assert store.known_source_horizon == store.source_end
+        store.fetched.clear()
+
+        assert not await store.backfill(start, end)
+        assert store.fetched == []
+
+        store.source_horizon_revalitation_ts = datetime.now(timezone.utc) - timedelta(minutes=1)
+        await store.backfill(start, end)
+        assert store.fetched[0][0] == store.source_end + timedelta(minutes=15)
+
+    @pytest.mark.asyncio
+    async def test_backfill_after_restart(self, sample_region, temp_storage_dir):
+        """Test that a new process only fetches what is missing in the persisted data."""
+        store = BackfillDataStore(sample_region, temp_storage_dir, "test")
+        start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 1, 6, tzinfo=timezone.utc)
+        await store.backfill(start, end)
+
+        restarted = await BackfillDataStore(sample_region, temp_storage_dir, "test").load()
+        await restarted.backfill(start, end + timedelta(days=1))
+
+        assert restarted.fetched == [(pd.Timestamp(end) + timedelta(minutes=15), pd.Timestamp(end + timedelta(days=1)))]
@@ -0,0 +1,191 @@
+"""Tests for predictor.model.entsoeclient module."""
+
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from entsoe.mappings import lookup_area
+from entsoe.parsers import parse_loads, parse_prices
+
+from predictor.model.entsoeclient import (
+    EntsoeClient,
+    NoMatchingDataError,
+    _parse_resolution,
+    parse_timeseries,
+)
+from predictor.model.http import close_session
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def _fixture(name):
+    return (FIXTURES / name).read_text()
+
+
+@pytest_asyncio.fixture
+async def entsoe_server():
+    """Local stand-in for the ENTSO-E API serving recorded responses."""
+    requests = []
+
+    async def api(request):
+        requests.append(dict(request.query))
+        if request.query.get("securityToken") != "test-key":
+            return web.Response(status=401, text="Unauthorized")
+        if request.query["periodStart"].startswith("2030"):
+            return web.Response(status=200, text=_fixture("entsoe_no_data.xml"), content_type="application/xml")
+        if request.query["documentType"] == "A44":
+            return web.Response(text=_fixture("entsoe_a44_de_lu.xml"), content_type="application/xml")
+        if request.query["documentType"] == "A65":
+            return web.Response(text=_fixture("entsoe_a65_a31_de_lu.xml"), content_type="application/xml")
+        return web.Response(status=400)
+
+    app = web.Application()
+    app.router.add_get("/api", api)
+    server = TestServer(app)
+    await server.start_server()
+    server.requests = requests
+    yield server
+    await server.close()
+    await close_session()
+
+
+@pytest.mark.filterwarnings("ignore::bs4.XMLParsedAsHTMLWarning") # entsoe-py parses XML with bs4's HTML parser
+class TestParseTimeseries:
+    """Tests for the XML parser."""
+
+    def test_parse_resolution(self):
+        """Test ISO 8601 durations used by ENTSO-E."""
+        assert _parse_resolution("PT15M") == 900
+        assert _parse_resolution("PT60M") == 3600
+        assert _parse_resolution("PT1H") == 3600
+        assert _parse_resolution("P1D") == 86400
+
+    def test_a03_curve_fills_omitted_positions(self):
+        """Test that omitted positions of A03 curves repeat the previous value."""
+        series = parse_timeseries(_fixture("entsoe_a44_de_lu.xml"), "price.amount")
+        assert len(series) == 2
+        for ts in series:
+            assert len(ts.times) == 96
+            assert not np.isnan(ts.values).any()
+            assert np.all(np.diff(ts.times) == 900)
+
+    def test_prices_match_entsoe_py(self):
+        """Test that the parsed prices are identical to entsoe-py's parser."""
+        xml = _fixture("entsoe_a44_de_lu.xml")
+        expected = parse_prices(xml)["15min"]
+        series = parse_timeseries(xml, "price.amount")
+        times = np.concatenate([ts.times for ts in series])
+        values = np.concatenate([ts.values for ts in series])
+
+        assert np.array_equal(times, expected.index.as_unit("s").asi8)
+        assert np.array_equal(values, expected.to_numpy(dtype=np.float64))
+
+    def test_load_matches_entsoe_py(self):
+        """Test that min/max load forecasts are identical to entsoe-py's parser."""
+        xml = _fixture("entsoe_a65_a31_de_lu.xml")
+        expected = parse_loads(xml, process_type="A31")
+        series = {ts.business_type: ts for ts in parse_timeseries(xml, "quantity")}
+
+        assert np.array_equal(series["A60"].values, expected["Min Forecasted Load"].to_numpy(dtype=np.float64))
+        assert np.array_equal(series["A61"].values, expected["Max Forecasted Load"].to_numpy(dtype=np.float64))
+
+    def test_no_matching_data(self):
+        """Test that acknowledgement documents without data raise NoMatchingDataError."""
+        with pytest.raises(NoMatchingDataError):
+            parse_timeseries(_fixture("entsoe_no_data.xml"), "price.amount")
+
+
+class TestEntsoeClient:
+    """Tests for EntsoeClient against a local stand-in server."""
+
+    @pytest.mark.asyncio
+    async def test_query_day_ahead_prices(self, entsoe_server):
+        """Test day-ahead price query."""
+        client = EntsoeClient("test-key", url=str(entsoe_server.make_url("/api")))
+        start = datetime(2025, 10, 31, 23, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, 22, 45, tzinfo=timezone.utc)
+
+        prices = await client.query_day_ahead_prices("DE_LU", start, end)
+
+        assert len(prices) == 192
+        assert str(prices.index.tz) == "Europe/Berlin"
+        query = entsoe_server.requests[0]
+        assert query["documentType"] == "A44"
+        assert query["in_Domain"] == "10Y1001A1001A82H"
+        assert query["classificationSequence_AttributeInstanceComponent.position"] == "1"
+        assert query["periodStart"] == "202510312300"
+
+    @pytest.mark.asyncio
+    async def test_query_load_forecast(self, entsoe_server):
+        """Test week-ahead load forecast query."""
+        client = EntsoeClient("test-key", url=str(entsoe_server.make_url("/api")))
+        start = datetime(2025, 10, 26, 23, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, 23, tzinfo=timezone.utc)
+
+        load = await client.query_load_forecast("DE_LU", start, end)
+
+        assert list(load.columns) == ["Min Forecasted Load", "Max Forecasted Load"]
+        assert len(load) == 7
+        assert (load["Max Forecasted Load"] > load["Min Forecasted Load"]).all()
+
+    @pytest.mark.asyncio
+    @pytest.mark.filterwarnings("ignore::bs4.XMLParsedAsHTMLWarning")
+    async def test_index_matches_entsoe_py(self, entsoe_server):
+        """Test that results are in the bidding zone's local time, like entsoe-py's query methods return them."""
+        client = EntsoeClient("test-key", url=str(entsoe_server.make_url("/api")))
+        tz = lookup_area("DE_LU").tz
+        start = datetime(2025, 10, 26, 23, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, 23, tzinfo=timezone.utc)
+
+        load = await client.query_load_forecast("DE_LU", start, end)
+        prices = await client.query_day_ahead_prices("DE_LU", start, end)
+
+        expected_load = parse_loads(_fixture("entsoe_a65_a31_de_lu.xml"), process_type="A31").tz_convert(tz).truncate(before=start, after=end)
+        expected_prices = parse_prices(_fixture("entsoe_a44_de_lu.xml"))["15min"].tz_convert(tz).truncate(before=start, after=end)
+        assert load.index.equals(expected_load.index)
+        assert str(load.index.tz) == str(expected_load.index.tz)
+        assert prices.index.equals(expected_prices.index)
+        assert str(prices.index.tz) == str(expected_prices.index.tz)
+
+    @pytest.mark.asyncio
+    async def test_long_load_forecast_is_split(self, entsoe_server):
+        """Test that load forecast queries are split into one-month requests."""
+        client = EntsoeClient("test-key", url=str(entsoe_server.make_url("/api")))
+        start = datetime(2025, 9, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 3, tzinfo=timezone.utc)
+
+        await client.query_load_forecast("DE_LU", start, end)
+
+        assert len(entsoe_server.requests) == 3
+
+    @pytest.mark.asyncio
+    async def test_no_data(self, entsoe_server):
+        """Test that empty responses raise NoMatchingDataError."""
+        client = EntsoeClient("test-key", url=str(entsoe_server.make_url("/api")))
+        start = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        end = datetime(2030, 1, 2, tzinfo=timezone.utc)
+
+        with pytest.raises(NoMatchingDataError):
+            await client.query_day_ahead_prices("DE_LU", start, end)
+
+    @pytest.mark.asyncio
+    async def test_price_store_uses_client(self, entsoe_server, sample_region, monkeypatch):
+        """Test that PriceStore converts ENTSO-E prices to ct/kWh on a 15 minute grid."""
+        import predictor.model.entsoeclient as entsoeclient
+        from predictor.model.pricestore import PriceStore
+
+        monkeypatch.setattr(entsoeclient, "ENTSOE_URL", str(entsoe_server.make_url("/api")))
+        store = PriceStore(sample_region)
+        store.entsoe_api_key = "test-key"
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+
+        prices = await store.fetch_prices_entsoe(start, start)
+
+        assert prices is not None
+        assert isinstance(prices.index, pd.DatetimeIndex)
+        assert prices["price"].max() < 20 # ct/kWh
@@ -0,0 +1,40 @@
+"""Tests for predictor.model.entsoedatastore module."""
+
+import numpy as np
+import pandas as pd
+
+from predictor.model.entsoedatastore import shape_load_forecast
+from tests.legacy import daily_load_forecast, shape_load_forecast_rowwise
+
+
+class TestShapeLoadForecast:
+    """Tests for shape_load_forecast."""
+
+    def test_matches_rowwise_implementation(self):
+        """Test that the vectorized shaping is identical to the row-wise one, across a DST change."""
+        load = daily_load_forecast(60)
+
+        expected = shape_load_forecast_rowwise(load)
+        result = shape_load_forecast(load)
+
+        pd.testing.assert_series_equal(result, expected)
+
+    def test_anchor_points(self):
+        """Test that max/min load are placed at the peak and night anchors in local time."""
+        load = daily_load_forecast(3)
+        result = shape_load_forecast(load)
+        day = load.index[1]
+
+        assert result[day + pd.Timedelta(hours=11, minutes=30)] == load["Max Forecasted Load"].iloc[1]
+        assert result[day + pd.Timedelta(hours=19)] == load["Max Forecasted Load"].iloc[1]
+        assert result[day + pd.Timedelta(hours=3)] == load["Min Forecasted Load"].iloc[1]
+
+    def test_missing_values_are_interpolated(self):
+        """Test that a missing day is bridged by the interpolation."""
+        load = daily_load_forecast(10)
+        load.iloc[5] = np.nan
+
+        result = shape_load_forecast(load)
+
+        pd.testing.assert_series_equal(result, shape_load_forecast_rowwise(load))
+        assert not result.isna().any()
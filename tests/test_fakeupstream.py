@@ -0,0 +1,140 @@
+"""Integration tests against predictor.fakeupstream."""
+
+from datetime import datetime, time, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from aiohttp.test_utils import TestServer
+
+import predictor.api.priceapi as priceapi
+import predictor.model.entsoeclient as entsoeclient
+import predictor.model.pricestore as pricestore
+import predictor.model.weatherstore as weatherstore
+from predictor.fakeupstream import GAS_PAGE_PATH, FakeUpstream, FakeUpstreamConfig
+from predictor.model.entsoeclient import EntsoeClient
+from predictor.model.gaspricestore import GasPriceSource
+from predictor.model.http import close_session
+from predictor.model.priceregion import PriceRegionName
+from predictor.model.pricestore import PriceStore
+
+
+async def _start(upstream, monkeypatch):
+    server = TestServer(upstream.app())
+    await server.start_server()
+    base_url = str(server.make_url("")).rstrip("/")
+    monkeypatch.setattr(pricestore, "ENERGYCHARTS_URL", base_url)
+    monkeypatch.setattr(weatherstore, "OPENMETEO_URL", base_url)
+    monkeypatch.setattr(weatherstore, "OPENMETEO_HISTORY_URL", base_url)
+    monkeypatch.setattr(entsoeclient, "ENTSOE_URL", f"{base_url}/api")
+    monkeypatch.setattr(GasPriceSource, "url", f"{base_url}{GAS_PAGE_PATH}")
+    monkeypatch.setenv("EPEXPREDICTOR_ENTSOE_API_KEY", "fake")
+    server.upstream = upstream
+    return server
+
+
+@pytest_asyncio.fixture
+async def fake_upstream(monkeypatch):
+    """Fake upstream with all stores pointed to it."""
+    server = await _start(FakeUpstream(), monkeypatch)
+    yield server
+    await server.close()
+    await close_session()
+
+
+class TestFakeUpstreamPublication:
+    """Tests for the simulated day-ahead publication time."""
+
+    def test_prices_before_publication(self):
+        """Test that tomorrow's prices are not available before the publication time."""
+        clock = lambda: datetime(2025, 11, 3, 11, 0, tzinfo=timezone.utc) # 12:00 CET
+        upstream = FakeUpstream(FakeUpstreamConfig(publication_time=time(13, 0)), clock=clock)
+
+        assert upstream.published_until() == datetime(2025, 11, 3, 23, 0, tzinfo=timezone.utc)
+
+    def test_prices_after_publication(self):
+        """Test that tomorrow's prices are available after the publication time."""
+        clock = lambda: datetime(2025, 11, 3, 12, 30, tzinfo=timezone.utc) # 13:30 CET
+        upstream = FakeUpstream(FakeUpstreamConfig(publication_time=time(13, 0)), clock=clock)
+
+        prices = upstream.day_ahead_prices("DE-LU", datetime(2025, 11, 3, tzinfo=timezone.utc), datetime(2025, 11, 10, tzinfo=timezone.utc))
+        assert prices.index[-1] == datetime(2025, 11, 4, 22, 45, tzinfo=timezone.utc)
+
+    def test_prices_deterministic(self):
+        """Test that repeated queries see the same data."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+        a = FakeUpstream().day_ahead_prices("DE-LU", start, end)
+        b = FakeUpstream().day_ahead_prices("DE-LU", start, end)
+        assert a.equals(b)
+
+
+class TestFakeUpstreamWireFormat:
+    """Tests that the real clients understand the fake responses."""
+
+    @pytest.mark.asyncio
+    async def test_energycharts(self, fake_upstream, sample_region):
+        """Test energy-charts prices through PriceStore."""
+        store = PriceStore(sample_region)
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+
+        prices = await store.fetch_prices_energycharts(start, start + timedelta(days=1))
+
+        assert prices is not None
+        assert len(prices) >= 96
+
+    @pytest.mark.asyncio
+    async def test_energycharts_not_published(self, fake_upstream, sample_region):
+        """Test that unpublished days are answered like energy-charts does."""
+        store = PriceStore(sample_region)
+        start = datetime.now(timezone.utc) + timedelta(days=5)
+
+        assert await store.fetch_prices_energycharts(start, start + timedelta(days=1)) is None
+
+    @pytest.mark.asyncio
+    async def test_entsoe(self, fake_upstream):
+        """Test ENTSO-E price and load documents through EntsoeClient."""
+        client = EntsoeClient("fake")
+        start = datetime(2025, 10, 20, 22, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 27, 23, tzinfo=timezone.utc) # across the DST change
+
+        prices = await client.query_day_ahead_prices("DE_LU", start, end)
+        load = await client.query_load_forecast("DE_LU", start, end)
+
+        assert len(prices) == 7 * 96 + 4 # one 25 hour day
+        assert len(load) == 7
+        assert (load["Max Forecasted Load"] > load["Min Forecasted Load"]).all()
+
+    @pytest.mark.asyncio
+    async def test_error_rate(self, monkeypatch, sample_region):
+        """Test that injected errors surface as failed provider queries."""
+        server = await _start(FakeUpstream(FakeUpstreamConfig(error_rate=1.0)), monkeypatch)
+        try:
+            store = PriceStore(sample_region)
+            start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+            assert await store.fetch_prices_energycharts(start, start + timedelta(days=1)) is None
+            assert server.upstream.requests["/price"] == 1
+        finally:
+            await server.close()
+            await close_session()
+
+
+class TestFakeUpstreamEndToEnd:
+    """Full update cycle of the API against the fake upstream."""
+
+    @pytest.mark.asyncio
+    async def test_update_data_if_needed(self, fake_upstream, monkeypatch):
+        """Test that a region manager backfills, trains and predicts from the fake upstream."""
+        monkeypatch.setattr(priceapi, "EPEXPREDICTOR_DATADIR", None)
+        manager = priceapi.RegionPriceManager(PriceRegionName.AT.to_region())
+
+        await manager.update_data_if_needed()
+
+        upstream = fake_upstream.upstream
+        assert upstream.requests["/price"] > 0
+        assert upstream.requests["/v1/forecast"] > 0
+        assert upstream.requests["/api"] > 0
+        assert upstream.requests[GAS_PAGE_PATH] > 0
+
+        assert manager.last_known_price == upstream.published_until() - timedelta(minutes=15)
+        assert manager.cachedprices.index[-1] > datetime.now(timezone.utc) + timedelta(days=5)
+        assert not manager.cachedprices["price"].isna().any()
@@ -0,0 +1,242 @@
+"""Tests for predictor.model.featurematrix module."""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictor.model.datastore import DataStore
+from predictor.model.featurematrix import FeatureMatrix, FullRangeFeatures
+from predictor.model.pricepredictor import assemble_features
+from predictor.model.slotgrid import slot_range, to_slot
+from tests.legacy import store_frames
+
+
+class MemoryStore(DataStore):
+    """Store that only holds what the test puts in."""
+
+    async def fetch_missing_data(self, start: datetime, end: datetime) -> bool:
+        return False
+
+
+@pytest.fixture
+def stores(sample_region):
+    """Stores with a month of random data."""
+    result = {}
+    for name, df in store_frames(30, locations=1).items():
+        result[name] = MemoryStore(sample_region)
+        result[name].data = df
+    return result
+
+
+class TestFeatureMatrix:
+    """Tests for incremental feature assembly."""
+
+    def _update(self, matrix, stores, start, end, actual_start, cutoff=None):
+        """Update the matrix and check it against a full assembly of the same snapshots. Prices and gas end at cutoff."""
+        first, last = slot_range(start, end)
+        output_first = slot_range(actual_start, end)[0]
+        versions = {name: store.snapshot.version for name, store in stores.items()}
+        slots = {name: store.snapshot.slots.slice(first, last if cutoff is None or name not in ("prices", "gas") else to_slot(cutoff) + 1)
+                 for name, store in stores.items()}
+
+        result = matrix.update(stores, versions, slots, first, last, output_first)
+
+        expected = assemble_features(slots["weather"], slots["aux"], slots["entsoe"], slots["gas"], slots["prices"], first, last, output_first)
+        pd.testing.assert_frame_equal(result, expected)
+        return result
+
+    def _replace(self, store, start, periods, seed):
+        """Overwrite a range of a store with new random values."""
+        index = pd.date_range(start, periods=periods, freq="15min", tz="UTC", name="time")
+        rng = np.random.default_rng(seed)
+        store._update_data(pd.DataFrame(rng.normal(size=(periods, len(store.data.columns))), index=index, columns=store.data.columns))
+
+    def test_first_update_builds(self, stores):
+        """Test that the first update assembles everything."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+
+        self._update(matrix, stores, start, start + pd.Timedelta(days=20), start + pd.Timedelta(days=14))
+
+        assert matrix.builds == 1
+
+    def test_only_changed_slots_are_patched(self, stores):
+        """Test that new forecasts only copy the slots they cover."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=35)
+        self._update(matrix, stores, start, end, start)
+        patched = matrix.patched_slots
+
+        self._replace(stores["weather"], "2025-07-01", 96, 1)
+        self._replace(stores["prices"], "2025-07-01 12:00", 48, 2)
+        self._update(matrix, stores, start, end, start)
+
+        assert matrix.builds == 1
+        assert matrix.patched_slots - patched == 96 + 48
+
+    def test_unchanged_returns_cached_frame(self, stores):
+        """Test that nothing is copied if no store changed."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=35)
+        first = self._update(matrix, stores, start, end, start)
+        patched = matrix.patched_slots
+
+        assert self._update(matrix, stores, start, end, start) is first
+        assert matrix.patched_slots == patched
+
+    def test_cutoff_without_new_version(self, stores):
+        """Test that prices hidden or shown again by a horizon cutoff are copied, though no store changed."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=20)
+        cutoff = start + pd.Timedelta(days=15)
+        self._update(matrix, stores, start, end, start)
+        patched = matrix.patched_slots
+
+        hidden = self._update(matrix, stores, start, end, start, cutoff)
+        assert hidden["price"][cutoff + pd.Timedelta(minutes=15):].isna().all()
+        assert matrix.patched_slots - patched == 2 * 5 * 96
+        shown = self._update(matrix, stores, start, end, start)
+        assert not shown["price"][cutoff:].isna().all()
+
+    def test_window_shift(self, stores):
+        """Test that moving the window only copies the new slots and drops the old ones."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=30)
+        self._update(matrix, stores, start, end, start)
+        patched = matrix.patched_slots
+
+        shift = pd.Timedelta(hours=6)
+        result = self._update(matrix, stores, start + shift, end + shift, start + shift)
+
+        assert matrix.builds == 1
+        assert matrix.patched_slots - patched == 5 * 24
+        assert result.index[0] == start + shift
+
+    def test_gas_fill_restarts_at_window_start(self, stores):
+        """Test that gas prices of slots that left the window are not forward filled into it."""
+        stores["gas"].data = stores["gas"].data.drop(stores["gas"].data.loc["2025-06-02":"2025-06-04"].index)
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=30)
+        self._update(matrix, stores, start, end, start)
+
+        result = self._update(matrix, stores, start + pd.Timedelta(days=2), end + pd.Timedelta(days=2), start)
+
+        assert result["gasprice"].iloc[:4].isna().all()
+
+    def test_gas_change_carries_forward(self, stores):
+        """Test that a changed gas price is forward filled into the following slots without own price."""
+        stores["gas"].data = stores["gas"].data.drop(stores["gas"].data.loc["2025-06-10 01:00":"2025-06-12"].index)
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=30)
+        self._update(matrix, stores, start, end, start)
+
+        self._replace(stores["gas"], "2025-06-10", 4, 3)
+        self._update(matrix, stores, start, end, start)
+
+    def test_drops_outside_window_patch_nothing(self, stores):
+        """Test that cleaning up old data doesn't touch the window."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-10", tz="UTC")
+        end = start + pd.Timedelta(days=20)
+        self._update(matrix, stores, start, end, start)
+        patched = matrix.patched_slots
+
+        for store in stores.values():
+            store.drop_before(pd.Timestamp("2025-06-05", tz="UTC").to_pydatetime())
+        self._update(matrix, stores, start, end, start)
+
+        assert matrix.patched_slots == patched
+
+    def test_replaced_store_rebuilds(self, stores, sample_region):
+        """Test that switching to other stores assembles everything again."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=30)
+        self._update(matrix, stores, start, end, start)
+
+        other = MemoryStore(sample_region)
+        other.data = stores["prices"].data * 2
+        self._update(matrix, stores | {"prices": other}, start, end, start)
+
+        assert matrix.builds == 2
+
+    def test_entsoe_leaving_the_window_rebuilds(self, stores):
+        """Test that the load forecast columns disappear like in assemble_features when there is no data in range."""
+        matrix = FeatureMatrix()
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+        end = start + pd.Timedelta(days=30)
+        self._update(matrix, stores, start, end, start)
+
+        stores["entsoe"].drop_after(pd.Timestamp("2025-05-01", tz="UTC").to_pydatetime())
+        result = self._update(matrix, stores, start, end, start)
+
+        assert "load" not in result.columns
+
+
+class TestFullRangeFeatures:
+    """Tests for the precomputed feature matrix of backtests."""
+
+    def _check(self, features, stores, start, end, actual_start, cutoff=None):
+        """Cut a window out of the matrix and check it against assembling the stores with prices and gas cut off."""
+        first, last = slot_range(start, end)
+        output_first = slot_range(actual_start, end)[0]
+        hidden_from = to_slot(cutoff) + 1 if cutoff is not None else None
+        slots = {name: store.snapshot.slots.slice(first, last) for name, store in stores.items()}
+        if hidden_from is not None:
+            slots["prices"] = slots["prices"].slice(first, hidden_from)
+            slots["gas"] = slots["gas"].slice(first, hidden_from)
+
+        result = features.frame(first, last, output_first, hidden_from)
+
+        expected = assemble_features(slots["weather"], slots["aux"], slots["entsoe"], slots["gas"], slots["prices"], first, last, output_first)
+        pd.testing.assert_frame_equal(result, expected)
+        return result
+
+    def _features(self, stores):
+        first, last = slot_range(pd.Timestamp("2025-06-01", tz="UTC"), pd.Timestamp("2025-07-10", tz="UTC"))
+        return FullRangeFeatures({name: store.snapshot.slots for name, store in stores.items()}, first, last)
+
+    def test_windows_match_assembly(self, stores):
+        """Test that training and prediction windows are the same as assembling them from the stores."""
+        features = self._features(stores)
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+
+        for day in range(0, 14, 3):
+            learn_end = start + pd.Timedelta(days=14 + day)
+            train = self._check(features, stores, learn_end - pd.Timedelta(days=14), learn_end - pd.Timedelta(minutes=15),
+                                learn_end - pd.Timedelta(days=14), learn_end)
+            predict = self._check(features, stores, learn_end, learn_end + pd.Timedelta(days=3), learn_end, learn_end)
+            assert train.index[-1] < learn_end <= predict.index[0]
+
+    def test_cutoff_hides_prices_and_gas(self, stores):
+        """Test that prices after the cutoff are gone and gas prices stay at the last known value."""
+        features = self._features(stores)
+        cutoff = pd.Timestamp("2025-06-20", tz="UTC")
+
+        result = self._check(features, stores, cutoff - pd.Timedelta(days=2), cutoff + pd.Timedelta(days=2), cutoff - pd.Timedelta(days=2), cutoff)
+
+        assert result.loc[cutoff:, "price"].iloc[1:].isna().all()
+        assert result.loc[:cutoff, "price"].notna().all()
+        assert (result.loc[cutoff:, "gasprice"] == result.loc[cutoff, "gasprice"]).all()
+        self._check(features, stores, cutoff - pd.Timedelta(days=2), cutoff + pd.Timedelta(days=2), cutoff - pd.Timedelta(days=2))
+
+    def test_gaps_and_missing_load_forecast(self, stores):
+        """Test gas gaps and windows without load forecast, which lose the load columns like in assemble_features."""
+        stores["gas"].data = stores["gas"].data.drop(stores["gas"].data.loc["2025-06-02":"2025-06-04"].index)
+        stores["entsoe"].data = stores["entsoe"].data.loc["2025-06-10":]
+        features = self._features(stores)
+        start = pd.Timestamp("2025-06-01", tz="UTC")
+
+        result = self._check(features, stores, start, start + pd.Timedelta(days=5), start, start + pd.Timedelta(days=3))
+
+        assert "load" not in result.columns
+        with pytest.raises(ValueError):
+            features.frame(*slot_range(start - pd.Timedelta(days=1), start), 0)
@@ -0,0 +1,265 @@
+"""Tests for predictor.model.gaspricestore module."""
+
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import predictor.model.gaspricestore as gaspricestore
+from predictor.model.gaspricestore import GasPriceSource, GasPriceStore, extract_gas_prices, get_gas_price_source
+from predictor.model.http import close_session
+from predictor.model.priceregion import PriceRegionName
+from tests.legacy import parse_gas_prices_regex
+
+GAS_PAGE = Path(__file__).parent / "fixtures" / "bnetza_gaspreise.html"
+
+
+def _gas_page(days):
+    """Minimal page with the chart export block the way bundesnetzagentur.de embeds it."""
+    labels = ", ".join(f"'{d:02d}.10.2025'" for d in range(1, days + 1))
+    data = ", ".join(f"{30 + d / 10}" for d in range(1, days + 1))
+    return f"""<html><body><script>
+var data_myChartId_870302_export = {{
+    labels: [{labels}],
+    datasets: [{{
+        label: 'THE Day Ahead',
+        data: [{data}]
+    }}, {{
+        label: 'THE Future (M+1)',
+        data: [{data}]
+    }}]
+}};
+</script></body></html>"""
+
+
+@pytest_asyncio.fixture
+async def gas_server(monkeypatch):
+    """Local stand-in for bundesnetzagentur.de, supporting ETag revalidation."""
+    server_state = {"page": _gas_page(10), "etag": '"v1"', "statuses": [], "etags": True}
+
+    async def page(request):
+        if server_state["etags"] and request.headers.get("If-None-Match") == server_state["etag"]:
+            server_state["statuses"].append(304)
+            return web.Response(status=304)
+        server_state["statuses"].append(200)
+        headers = {"ETag": server_state["etag"]} if server_state["etags"] else {}
+        return web.Response(text=server_state["page"], content_type="text/html", headers=headers)
+
+    app = web.Application()
+    app.router.add_get("/gaspreise.html", page)
+    server = TestServer(app)
+    await server.start_server()
+    monkeypatch.setattr(GasPriceSource, "url", str(server.make_url("/gaspreise.html")))
+    server.state = server_state
+    yield server
+    await server.close()
+    await close_session()
+
+
+class TestExtractGasPrices:
+    """Tests for extracting prices from the Bundesnetzagentur page."""
+
+    def test_matches_regex_extraction(self):
+        """Test that the extraction is identical to the previous regex based one on a saved page."""
+        html = GAS_PAGE.read_text()
+
+        pd.testing.assert_frame_equal(extract_gas_prices(html), parse_gas_prices_regex(html), check_freq=False)
+
+    def test_missing_days_are_filled(self):
+        """Test that days without a price (weekends) repeat the previous price."""
+        df = extract_gas_prices(GAS_PAGE.read_text())
+        assert df is not None
+
+        friday = df.loc["2026-10-09 00:00+00:00", "gasprice"]
+        assert df.loc["2026-10-11 12:00+00:00", "gasprice"] == friday
+        assert not df["gasprice"].isna().any()
+
+    def test_other_chart_before_prices(self):
+        """Test that labels are taken from the chart export containing the price series."""
+        other = "var data_myChartId_1_export = {\n    labels: ['01.01.2020', '02.01.2020'],\n    datasets: [{ data: [1.0, 2.0] }]\n};\n"
+        df = extract_gas_prices(other + _gas_page(3))
+
+        assert df is not None
+        assert df.index[0] == datetime(2025, 10, 1, tzinfo=timezone.utc)
+        assert df.index[-1] == datetime(2025, 10, 3, tzinfo=timezone.utc)
+
+    def test_unpadded_dates(self):
+        """Test labels that are not zero padded."""
+        df = extract_gas_prices(_gas_page(3).replace("'01.10.2025'", "'1.10.2025'"))
+
+        assert df is not None
+        assert df.index[0] == datetime(2025, 10, 1, tzinfo=timezone.utc)
+        assert np.isclose(df["gasprice"].iloc[0], 30.1)
+
+    @pytest.mark.parametrize("label", ["'31.02.2025'", "'3x.10.2025'", "'00.10.2025'", "'2.13.2025'"])
+    def test_malformed_dates_are_skipped(self, label, caplog):
+        """Test that rows with impossible or garbled dates are dropped with a warning, fixed width or not."""
+        page = _gas_page(3).replace("'02.10.2025'", label)
+
+        df = extract_gas_prices(page)
+
+        assert df is not None
+        assert df.index[0] == datetime(2025, 10, 1, tzinfo=timezone.utc)
+        # 2nd is filled with the price of the 1st, not the one of the garbled row
+        assert np.isclose(df.loc["2025-10-02 12:00+00:00", "gasprice"], 30.1)
+        assert np.isclose(df["gasprice"].iloc[-1], 30.3)
+        assert "malformed dates" in caplog.text
+
+    def test_no_prices(self):
+        """Test a page without the price chart."""
+        assert extract_gas_prices("<html><body>Wartungsarbeiten</body></html>") is None
+
+
+class TestGasPriceStoreSharing:
+    """Tests for the per-region views of the shared source."""
+
+    def test_regions_share_source(self):
+        """Test that all regions use the same source and data."""
+        de = GasPriceStore(PriceRegionName.DE.to_region())
+        at = GasPriceStore(PriceRegionName.AT.to_region())
+
+        assert de.source is at.source
+        assert de.source is get_gas_price_source(None)
+        assert de.data is at.data
+
+    def test_new_view_keeps_loaded_data(self):
+        """Test that creating another region's store doesn't reset the shared data."""
+        de = GasPriceStore(PriceRegionName.DE.to_region())
+        page = gaspricestore.extract_gas_prices(_gas_page(5))
+        assert page is not None
+        de._update_data(page)
+
+        at = GasPriceStore(PriceRegionName.AT.to_region())
+
+        assert len(at.data) == len(page)
+        assert at.last_updated == de.last_updated
+
+    def test_separate_storage_dirs(self, temp_storage_dir):
+        """Test that stores with different storage directories don't share data."""
+        assert get_gas_price_source(None) is not get_gas_price_source(temp_storage_dir)
+
+    @pytest.mark.asyncio
+    async def test_horizon_cutoff_per_region(self, gas_server):
+        """Test that the horizon cutoff of one region doesn't affect the others."""
+        de = GasPriceStore(PriceRegionName.DE.to_region())
+        at = GasPriceStore(PriceRegionName.AT.to_region())
+        start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 10, tzinfo=timezone.utc)
+        de.horizon_cutoff = datetime(2025, 10, 5, tzinfo=timezone.utc)
+
+        de_data = await de.get_data(start, end)
+        at_data = await at.get_data(start, end)
+
+        assert de_data.index[-1] == de.horizon_cutoff
+        assert at_data.index[-1] == end
+
+    @pytest.mark.asyncio
+    async def test_persists_one_file(self, gas_server, temp_storage_dir):
+        """Test that only one gas price file is written for all regions."""
+        de = GasPriceStore(PriceRegionName.DE.to_region(), temp_storage_dir)
+        at = GasPriceStore(PriceRegionName.AT.to_region(), temp_storage_dir)
+        start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 10, tzinfo=timezone.utc)
+
+        await de.get_data(start, end)
+        await at.get_data(start, end)
+
+        assert os.listdir(temp_storage_dir) == ["gasprices_DE_LU.json.gz"]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_regions_download_once(self, gas_server):
+        """Test that concurrent requests of all regions share one page download."""
+        stores = [GasPriceStore(PriceRegionName.DE.to_region()), GasPriceStore(PriceRegionName.AT.to_region())]
+        start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 10, tzinfo=timezone.utc)
+
+        await asyncio.gather(*[store.get_data(start, end) for store in stores])
+
+        assert gas_server.state["statuses"] == [200]
+        assert stores[0].fetch_stats()["coalesced"] == 1
+
+    @pytest.mark.asyncio
+    async def test_region_without_gas_prices(self, gas_server, temp_storage_dir):
+        """Test that regions without gas prices don't create, load or fetch the shared source."""
+        be = await GasPriceStore(PriceRegionName.BE.to_region(), temp_storage_dir).load()
+
+        data = await be.get_data(datetime(2025, 10, 1, tzinfo=timezone.utc), datetime(2025, 10, 10, tzinfo=timezone.utc))
+
+        assert be.source is None
+        assert data.empty
+        assert gaspricestore._sources == {}
+        assert gas_server.state["statuses"] == []
+
+    @pytest.mark.asyncio
+    async def test_region_files_are_migrated(self, temp_storage_dir):
+        """Test that the newest of the old per-region files becomes the shared file, and the others are removed."""
+        for zone, days in [("AT", 3), ("NL", 5)]:
+            old = GasPriceSource(temp_storage_dir)
+            old.region = getattr(PriceRegionName, zone).to_region()
+            old._update_data(extract_gas_prices(_gas_page(days)))
+            await old.serialize()
+            await asyncio.sleep(0.01) # distinct mtimes
+
+        source = await get_gas_price_source(temp_storage_dir).load()
+
+        assert os.listdir(temp_storage_dir) == ["gasprices_DE_LU.json.gz"]
+        assert source.data.index[-1] == datetime(2025, 10, 5, tzinfo=timezone.utc)
+
+
+class TestGasPriceSourceRevalidation:
+    """Tests for conditional page downloads."""
+
+    @pytest.mark.asyncio
+    async def test_etag_revalidation(self, gas_server, monkeypatch):
+        """Test that an unchanged page is answered with 304 and not parsed again."""
+        calls = []
+        parse = gaspricestore.extract_gas_prices
+        monkeypatch.setattr(gaspricestore, "extract_gas_prices", lambda txt: calls.append(1) or parse(txt))
+        source = get_gas_price_source()
+        start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 20, tzinfo=timezone.utc) # beyond the page -> always missing
+
+        assert await source.fetch_missing_data(start, end)
+        assert not await source.fetch_missing_data(start, end)
+
+        assert gas_server.state["statuses"] == [200, 304]
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_changed_page_is_parsed(self, gas_server):
+        """Test that a changed page is downloaded and merged."""
+        source = get_gas_price_source()
+        start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 20, tzinfo=timezone.utc)
+
+        await source.fetch_missing_data(start, end)
+        gas_server.state["page"] = _gas_page(12)
+        gas_server.state["etag"] = '"v2"'
+
+        assert await source.fetch_missing_data(start, end)
+        assert gas_server.state["statuses"] == [200, 200]
+        assert source.data.index[-1] == datetime(2025, 10, 12, tzinfo=timezone.utc)
+
+    @pytest.mark.asyncio
+    async def test_unchanged_page_without_etag_not_parsed(self, gas_server, monkeypatch):
+        """Test that the parsed page is reused if the server doesn't support revalidation."""
+        calls = []
+        parse = gaspricestore.extract_gas_prices
+        monkeypatch.setattr(gaspricestore, "extract_gas_prices", lambda txt: calls.append(1) or parse(txt))
+        gas_server.state["etags"] = False
+        source = get_gas_price_source()
+        start = datetime(2025, 10, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 20, tzinfo=timezone.utc)
+
+        await source.fetch_missing_data(start, end)
+        await source.fetch_missing_data(start, end)
+
+        assert gas_server.state["statuses"] == [200, 200]
+        assert len(calls) == 1
@@ -0,0 +1,226 @@
+"""Tests for predictor.model.http module."""
+
+import asyncio
+import gzip
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from predictor.model import http
+from predictor.model.http import HttpCacheMiss, cache_key, close_session, fetch, normalize_url, range_ttl
+from predictor.model.resilience import BreakerState, CircuitOpenError, DeadlineExceeded, deadline, get_circuit_breaker
+
+
+@pytest_asyncio.fixture
+async def upstream():
+    """Local upstream counting the requests it answers."""
+    state = {"requests": 0}
+
+    async def handler(request):
+        state["requests"] += 1
+        if request.path == "/missing":
+            return web.Response(status=404, text="no content available")
+        if request.path == "/broken":
+            return web.Response(status=500, text="oops")
+        if request.path == "/slow":
+            await asyncio.sleep(1)
+        return web.Response(text=f"answer {state['requests']}", headers={"ETag": '"abc"'})
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handler)
+    server = TestServer(app)
+    await server.start_server()
+    server.state = state
+    yield server
+    await server.close()
+    await close_session()
+
+
+@pytest.fixture
+def http_cache(monkeypatch, temp_storage_dir):
+    """Enable the response cache in a temporary directory."""
+    monkeypatch.setenv("EPEXPREDICTOR_HTTP_CACHE_DIR", temp_storage_dir)
+    monkeypatch.delenv("EPEXPREDICTOR_HTTP_CACHE_MODE", raising=False)
+    return temp_storage_dir
+
+
+def _cached_files(directory):
+    return [f for _, _, files in os.walk(directory) for f in files]
+
+
+class TestNormalizeUrl:
+    """Tests for cache keys."""
+
+    def test_param_order_irrelevant(self):
+        """Test that query parameter order and url vs. params don't change the key."""
+        a = cache_key("https://API.example.com/v1?b=2&a=1")
+        b = cache_key("https://api.example.com/v1", {"a": "1", "b": "2"})
+        c = cache_key("https://api.example.com/v1?a=1", {"b": "2"})
+        assert a == b == c
+
+    def test_security_token_removed(self):
+        """Test that the ENTSO-E API key is not part of the key."""
+        url = normalize_url("https://web-api.tp.entsoe.eu/api", {"securityToken": "secret", "documentType": "A44"})
+        assert "secret" not in url
+        assert cache_key("https://web-api.tp.entsoe.eu/api", {"securityToken": "a"}) == cache_key("https://web-api.tp.entsoe.eu/api", {"securityToken": "b"})
+
+    def test_range_ttl(self):
+        """Test that history never expires, but recent data does."""
+        recent = timedelta(minutes=5)
+        assert range_ttl(datetime(2024, 1, 1, tzinfo=timezone.utc), recent) is None
+        assert range_ttl(datetime.now(timezone.utc) + timedelta(days=1), recent) == recent
+
+
+class TestFetchCache:
+    """Tests for the response cache modes."""
+
+    @pytest.mark.asyncio
+    async def test_off_by_default(self, upstream, monkeypatch):
+        """Test that nothing is cached without a cache dir."""
+        monkeypatch.delenv("EPEXPREDICTOR_HTTP_CACHE_DIR", raising=False)
+        monkeypatch.delenv("EPEXPREDICTOR_HTTP_CACHE_MODE", raising=False)
+        url = str(upstream.make_url("/data"))
+
+        await fetch(url, ttl=None)
+        resp = await fetch(url, ttl=None)
+
+        assert resp.text == "answer 2"
+        assert not resp.from_cache
+
+    @pytest.mark.asyncio
+    async def test_readwrite_serves_within_ttl(self, upstream, http_cache):
+        """Test that a fresh cached response is served without a request."""
+        url = str(upstream.make_url("/data"))
+
+        first = await fetch(url, ttl=timedelta(hours=1))
+        second = await fetch(url, ttl=timedelta(hours=1))
+
+        assert upstream.state["requests"] == 1
+        assert second.from_cache
+        assert second.text == first.text
+        assert second.headers["ETag"] == '"abc"'
+
+    @pytest.mark.asyncio
+    async def test_readwrite_expired(self, upstream, http_cache):
+        """Test that the default ttl records the response but doesn't serve it."""
+        url = str(upstream.make_url("/data"))
+
+        await fetch(url)
+        resp = await fetch(url)
+
+        assert upstream.state["requests"] == 2
+        assert resp.text == "answer 2"
+        assert len(_cached_files(http_cache)) == 1
+
+    @pytest.mark.asyncio
+    async def test_history_never_expires(self, upstream, http_cache, monkeypatch):
+        """Test that responses fetched with ttl=None are served regardless of age."""
+        url = str(upstream.make_url("/data"))
+        await fetch(url, ttl=None)
+
+        monkeypatch.setattr(http.time, "time", lambda: 4102444800.0) # 2100
+        resp = await fetch(url, ttl=None)
+
+        assert resp.from_cache
+        assert upstream.state["requests"] == 1
+
+    @pytest.mark.asyncio
+    async def test_errors_not_cached(self, upstream, http_cache):
+        """Test that server errors are not recorded, but 404 'no content' answers are."""
+        await fetch(str(upstream.make_url("/broken")), ttl=None)
+        assert len(_cached_files(http_cache)) == 0
+
+        await fetch(str(upstream.make_url("/missing")), ttl=None)
+        resp = await fetch(str(upstream.make_url("/missing")), ttl=None)
+        assert resp.from_cache
+        assert resp.status == 404
+
+    @pytest.mark.asyncio
+    async def test_secret_not_stored(self, upstream, http_cache):
+        """Test that the API key doesn't end up in the cache files."""
+        await fetch(str(upstream.make_url("/api")), params={"securityToken": "very-secret", "documentType": "A44"})
+
+        for root, _, files in os.walk(http_cache):
+            for f in files:
+                with gzip.open(os.path.join(root, f), "rt") as fp:
+                    assert "very-secret" not in fp.read()
+
+    @pytest.mark.asyncio
+    async def test_replay(self, upstream, http_cache, monkeypatch):
+        """Test that replay mode serves recorded responses regardless of ttl and fails on misses."""
+        url = str(upstream.make_url("/data"))
+        await fetch(url)
+
+        monkeypatch.setenv("EPEXPREDICTOR_HTTP_CACHE_MODE", "replay")
+        resp = await fetch(url)
+        assert resp.from_cache
+        assert upstream.state["requests"] == 1
+
+        with pytest.raises(HttpCacheMiss):
+            await fetch(str(upstream.make_url("/other")))
+        assert upstream.state["requests"] == 1
+
+    @pytest.mark.asyncio
+    async def test_replay_miss_not_swallowed_by_store(self, http_cache, monkeypatch, sample_region):
+        """Test that stores don't log cache misses away as upstream errors."""
+        from predictor.model.pricestore import PriceStore
+        monkeypatch.setenv("EPEXPREDICTOR_HTTP_CACHE_MODE", "replay")
+        store = PriceStore(sample_region)
+
+        with pytest.raises(HttpCacheMiss):
+            await store.fetch_missing_data(datetime(2025, 11, 1, tzinfo=timezone.utc), datetime(2025, 11, 2, tzinfo=timezone.utc))
+
+    def test_invalid_mode(self, http_cache, monkeypatch):
+        """Test that typos in the mode are not silently ignored."""
+        monkeypatch.setenv("EPEXPREDICTOR_HTTP_CACHE_MODE", "replya")
+        with pytest.raises(ValueError):
+            http.cache_mode()
+
+
+class TestFetchResilience:
+    """Tests for circuit breaker and deadline handling."""
+
+    @pytest.mark.asyncio
+    async def test_failing_upstream_opens_circuit(self, upstream):
+        """Test that repeated 5xx responses stop further requests to the host."""
+        url = str(upstream.make_url("/broken"))
+        breaker = get_circuit_breaker(f"{upstream.host}:{upstream.port}")
+
+        for _ in range(breaker.failure_threshold):
+            assert (await fetch(url)).status == 500
+
+        assert breaker.state == BreakerState.OPEN
+        with pytest.raises(CircuitOpenError):
+            await fetch(str(upstream.make_url("/ok")))
+        assert upstream.state["requests"] == breaker.failure_threshold
+
+    @pytest.mark.asyncio
+    async def test_not_found_is_no_failure(self, upstream):
+        """Test that 404 answers (energy-charts: no prices yet) don't count as upstream failures."""
+        breaker = get_circuit_breaker(f"{upstream.host}:{upstream.port}")
+
+        for _ in range(breaker.failure_threshold):
+            await fetch(str(upstream.make_url("/missing")))
+
+        assert breaker.state == BreakerState.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_deadline_bounds_request(self, upstream):
+        """Test that a request is cut off at the deadline without blaming the upstream."""
+        breaker = get_circuit_breaker(f"{upstream.host}:{upstream.port}")
+
+        with deadline(0.1), pytest.raises(DeadlineExceeded):
+            await fetch(str(upstream.make_url("/slow")), timeout=10)
+
+        assert breaker.consecutive_failures == 0
+
+    @pytest.mark.asyncio
+    async def test_expired_deadline(self, upstream):
+        """Test that nothing is requested once the deadline has passed."""
+        with deadline(0), pytest.raises(DeadlineExceeded):
+            await fetch(str(upstream.make_url("/ok")))
+        assert upstream.state["requests"] == 0
@@ -1,5 +1,6 @@
 """Tests for predictor.api.priceapi module."""
 
+import asyncio
 from datetime import datetime, timedelta, timezone
 import pandas as pd
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -16,6 +17,7 @@ from predictor.api.priceapi import (
     RegionPriceManager,
     app,
 )
+from predictor.model.resilience import CircuitOpenError, deadline, time_left
 
 
 @pytest.fixture
@@ -335,6 +337,7 @@ class TestRegionPriceManagerUpdateDataIfNeeded:
         manager = RegionPriceManager(sample_region)
 
         # Mock predictor methods
+        manager.predictor.backfill = AsyncMock()
         manager.predictor.refresh_forecasts = AsyncMock()
         manager.predictor.train = AsyncMock()
         manager.predictor.predict = AsyncMock(
@@ -350,3 +353,91 @@ class TestRegionPriceManagerUpdateDataIfNeeded:
 
         # Should have called refresh methods
         assert manager.predictor.refresh_forecasts.called
+
+
+class TestRegionPriceManagerUpdateInBackground:
+    """Tests for waiting on data updates from the request path."""
+
+    def _manager(self, sample_region, hang):
+        manager = RegionPriceManager(sample_region)
+        manager.calls = 0
+
+        async def update():
+            manager.calls += 1
+            await hang.wait()
+        manager.update_data_if_needed = update
+        return manager
+
+    @pytest.mark.asyncio
+    async def test_stale_prices_wait_at_most_deadline(self, sample_region):
+        """Test that a request with a previous prediction only waits until its deadline for a hanging update."""
+        hang = asyncio.Event()
+        manager = self._manager(sample_region, hang)
+        manager.cachedprices = pd.DataFrame({"price": [10.0]}, index=pd.to_datetime([datetime(2025, 11, 1, tzinfo=timezone.utc)]))
+
+        with deadline(0.05):
+            await asyncio.wait_for(manager.update_in_background(), 1)
+
+        assert manager.update_task is not None
+        assert not manager.update_task.done()
+        hang.set()
+        await manager.update_task
+
+    @pytest.mark.asyncio
+    async def test_first_request_waits_for_update(self, sample_region):
+        """Test that the first request waits for the update regardless of the deadline."""
+        hang = asyncio.Event()
+        manager = self._manager(sample_region, hang)
+
+        with deadline(0.01):
+            request = asyncio.create_task(manager.update_in_background())
+            await asyncio.sleep(0.05)
+        assert not request.done()
+
+        hang.set()
+        await asyncio.wait_for(request, 1)
+
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_update(self, sample_region):
+        """Test that requests arriving during an update join it instead of queuing another one."""
+        hang = asyncio.Event()
+        manager = self._manager(sample_region, hang)
+
+        requests = [asyncio.create_task(manager.update_in_background()) for _ in range(3)]
+        await asyncio.sleep(0)
+        hang.set()
+        await asyncio.gather(*requests)
+
+        assert manager.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_update_has_no_deadline(self, sample_region):
+        """Test that the update itself isn't bound by the deadline of the request that started it."""
+        manager = RegionPriceManager(sample_region)
+        seen = []
+
+        async def update():
+            seen.append(time_left())
+        manager.update_data_if_needed = update
+
+        with deadline(5):
+            await manager.update_in_background()
+
+        assert seen == [None]
+
+    @pytest.mark.asyncio
+    async def test_failed_forecast_refresh_keeps_last_data(self, sample_region):
+        """Test that a failing weather source doesn't prevent retraining with the data we have."""
+        manager = RegionPriceManager(sample_region)
+        manager.cachedprices = pd.DataFrame({"price": [10.0]}, index=pd.to_datetime([datetime(2025, 11, 1, tzinfo=timezone.utc)]))
+        manager.predictor.refresh_forecasts = AsyncMock(side_effect=CircuitOpenError("open"))
+        manager.predictor.last_data_update = MagicMock(return_value=datetime.now(timezone.utc))
+        manager.predictor.train = AsyncMock()
+        manager.predictor.predict = AsyncMock(return_value=pd.DataFrame({"price": [11.0]}))
+        manager.predictor.pricestore.get_last_known = MagicMock(return_value=None)
+        manager.predictor.cleanup = MagicMock()
+
+        await manager.update_data_if_needed()
+
+        assert manager.predictor.train.called
+        assert manager.last_weather_update.year == 1980
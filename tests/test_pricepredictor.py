@@ -1,12 +1,16 @@
 """Tests for predictor.model.pricepredictor module."""
 
+import shutil
 from datetime import datetime, timezone
 from unittest.mock import AsyncMock
 
 import pandas as pd
 import pytest
 
-from predictor.model.pricepredictor import PricePredictor
+from predictor.model import treeinference
+from predictor.model.pricepredictor import PricePredictor, assemble_features
+from predictor.model.slotgrid import SlotFrame, slot_range
+from tests.legacy import assemble_features_concat, store_frames
 
 
 class TestPricePredictorInit:
@@ -87,10 +91,10 @@ class TestPricePredictorPrepareDataframe:
         predictor = PricePredictor(sample_region)
 
         # Mock the stores to return our sample data
-        predictor.weatherstore.get_data = AsyncMock(return_value=sample_weather_data)
-        predictor.pricestore.get_data = AsyncMock(return_value=sample_price_data)
-        predictor.auxstore.get_data = AsyncMock(return_value=sample_aux_data)
-        predictor.entsoestore.get_data = AsyncMock(return_value=sample_entsoe_data)
+        predictor.weatherstore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_weather_data)))
+        predictor.pricestore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_price_data)))
+        predictor.auxstore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_aux_data)))
+        predictor.entsoestore.get_versioned_slots = AsyncMock(return_value=(1, SlotFrame.from_frame(sample_entsoe_data)))
 
         start = datetime(2025, 11, 1, tzinfo=timezone.utc)
         end = datetime(2025, 11, 2, tzinfo=timezone.utc)
@@ -101,6 +105,55 @@ class TestPricePredictorPrepareDataframe:
         assert not result.empty
 
 
+class TestAssembleFeatures:
+    """Tests for joining store data on the slot grid."""
+
+    def _assemble(self, frames, start, end, actual_start, entsoe=True, gas=True):
+        slots = {name: SlotFrame.from_frame(df) for name, df in frames.items()}
+        first, last = slot_range(start, end)
+        return assemble_features(slots["weather"], slots["aux"], slots["entsoe"] if entsoe else None, slots["gas"] if gas else None,
+                                 slots["prices"], first, last, slot_range(actual_start, end)[0])
+
+    def _reference(self, frames, start, end, actual_start, entsoe=True, gas=True):
+        sliced = {name: df.loc[start:end] for name, df in frames.items()}
+        return assemble_features_concat(sliced["weather"], sliced["aux"], sliced["entsoe"] if entsoe else None, sliced["gas"] if gas else None,
+                                        sliced["prices"], actual_start)
+
+    @pytest.mark.parametrize("entsoe,gas", [(True, True), (False, True), (True, False)])
+    def test_matches_concat(self, entsoe, gas):
+        """Test that the result is identical to the previous concat based assembly."""
+        frames = store_frames(30, locations=2)
+        start = frames["weather"].index[0] + pd.Timedelta(hours=5)
+        end = frames["weather"].index[-1] - pd.Timedelta(days=2)
+        actual_start = start + pd.Timedelta(days=14)
+
+        pd.testing.assert_frame_equal(
+            self._assemble(frames, start, end, actual_start, entsoe, gas),
+            self._reference(frames, start, end, actual_start, entsoe, gas),
+            check_freq=False)
+
+    def test_matches_concat_with_gaps(self):
+        """Test that gaps in single stores and slots without any data are handled like an outer join."""
+        frames = store_frames(20, locations=1)
+        for name, (gstart, gend) in {"weather": ("2025-06-05", "2025-06-06"), "prices": ("2025-06-10", "2025-06-12"), "gas": ("2025-06-03", "2025-06-08")}.items():
+            frames[name] = frames[name].drop(frames[name].loc[gstart:gend].index)
+        frames["aux"] = frames["aux"].drop(frames["aux"].loc["2025-06-10":"2025-06-11"].index)
+        start = frames["weather"].index[0]
+        end = frames["weather"].index[-1]
+
+        pd.testing.assert_frame_equal(self._assemble(frames, start, end, start), self._reference(frames, start, end, start), check_freq=False)
+
+    def test_empty(self):
+        """Test that ranges without any data give an empty frame with all columns."""
+        frames = store_frames(5, locations=1)
+        start = pd.Timestamp("2030-01-01", tz="UTC")
+
+        result = self._assemble(frames, start, start + pd.Timedelta(days=1), start)
+
+        assert result.empty
+        assert list(result.columns)[-1] == "price"
+
+
 class TestPricePredictorTrain:
     """Tests for train method."""
 
@@ -114,6 +167,87 @@ class TestPricePredictorTrain:
 
         assert mocked_predictor.predictor is not None
 
+    @pytest.mark.asyncio
+    async def test_train_records_snapshot_versions(self, mocked_predictor):
+        """Test that the model remembers which data store snapshots it was trained on."""
+        mocked_predictor.pricestore.get_versioned_slots.return_value = (7, mocked_predictor.pricestore.get_versioned_slots.return_value[1])
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+
+        await mocked_predictor.train(start, end)
+
+        assert mocked_predictor.trained_on is not None
+        assert mocked_predictor.trained_on["prices"] == 7
+        assert mocked_predictor.trained_on["weather"] == 1
+
+    @pytest.mark.asyncio
+    async def test_train_remembers_rounds(self, mocked_predictor):
+        """Test that the number of boosting rounds of a full fit is kept for the next training."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+
+        await mocked_predictor.train(start, end)
+
+        assert mocked_predictor.predictor is not None
+        assert mocked_predictor.rounds == mocked_predictor.predictor.num_trees()
+
+    @pytest.mark.asyncio
+    async def test_incremental_mode_continues_model(self, mocked_predictor):
+        """Test that in incremental mode, only the first training is a full fit."""
+        mocked_predictor.training_mode = "incremental"
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+
+        await mocked_predictor.train(start, end)
+        assert mocked_predictor.last_fit == "full"
+        first = mocked_predictor.predictor
+
+        await mocked_predictor.train(start, end)
+        assert mocked_predictor.last_fit == "incremental"
+        assert mocked_predictor.predictor is not first
+        assert mocked_predictor.last_fit_seconds is not None
+
+    @pytest.mark.asyncio
+    async def test_incremental_mode_scheduled_full_fit(self, mocked_predictor):
+        """Test that a full fit is done again once the data moved full_fit_days past the last one."""
+        mocked_predictor.training_mode = "incremental"
+        mocked_predictor.full_fit_days = 0
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+
+        await mocked_predictor.train(start, end)
+        await mocked_predictor.train(start, end)
+
+        assert mocked_predictor.last_fit == "full"
+
+    @pytest.mark.asyncio
+    async def test_out_of_budget_is_degraded(self, mocked_predictor):
+        """Test that a training that ran out of time is marked degraded, and followed by a full fit."""
+        mocked_predictor.training_mode = "incremental"
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+
+        await mocked_predictor.train(start, end, budget=1e-9)
+        assert mocked_predictor.degraded
+        assert mocked_predictor.predictor is not None
+        assert mocked_predictor.rounds is None
+        assert mocked_predictor.training_stats()["degraded"]
+
+        await mocked_predictor.train(start, end)
+        assert mocked_predictor.last_fit == "full"
+        assert not mocked_predictor.degraded
+
+    @pytest.mark.asyncio
+    async def test_full_mode_never_continues(self, mocked_predictor):
+        """Test that the default mode trains a new model every time."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+
+        await mocked_predictor.train(start, end)
+        await mocked_predictor.train(start, end)
+
+        assert mocked_predictor.last_fit == "full"
+
 
 class TestPricePredictorPredict:
     """Tests for predict method."""
@@ -149,6 +283,27 @@ class TestPricePredictorPredict:
         assert result is not None
         assert not result.empty
 
+    @pytest.mark.asyncio
+    @pytest.mark.skipif(shutil.which(treeinference.CC) is None, reason="no C compiler")
+    async def test_compiled_engine_matches(self, mocked_predictor):
+        """Test that the compiled inference engine predicts exactly like LightGBM."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 11, 2, tzinfo=timezone.utc)
+        mocked_predictor.inference_engine = "compiled"
+
+        await mocked_predictor.train(start, end)
+        assert mocked_predictor.compiled is not None
+        result = await mocked_predictor.predict(start, end, fill_known=False)
+        mocked_predictor.compiled = None
+        expected = await mocked_predictor.predict(start, end, fill_known=False)
+
+        pd.testing.assert_frame_equal(result, expected)
+
+    def test_unknown_engine(self, sample_region):
+        """Test that typos in the engine setting are not silently ignored."""
+        with pytest.raises(ValueError):
+            PricePredictor(sample_region, inference_engine="onnx")
+
 
 class TestPricePredictorCleanup:
     """Tests for cleanup method."""
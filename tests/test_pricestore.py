@@ -1,5 +1,6 @@
 """Tests for predictor.model.pricestore module."""
 
+import asyncio
 from datetime import datetime, timezone
 from unittest.mock import AsyncMock, MagicMock, patch
 
@@ -44,9 +45,10 @@ class TestPriceStoreFetchMissingData:
             "price": [80.5, 75.2, 70.1],  # EUR/MWh
         }
 
-        with patch("aiohttp.ClientSession") as mock_session:
+        with patch("predictor.model.http.get_session") as mock_session:
             mock_response = AsyncMock()
             mock_response.status = 200
+            mock_response.headers = {}
             # The actual code uses resp.text() then json.loads()
             mock_response.text = AsyncMock(return_value=json.dumps(mock_response_data))
 
@@ -56,8 +58,6 @@ class TestPriceStoreFetchMissingData:
 
             mock_session_instance = MagicMock()
             mock_session_instance.get = MagicMock(return_value=mock_context)
-            mock_session_instance.__aenter__ = AsyncMock(return_value=mock_session_instance)
-            mock_session_instance.__aexit__ = AsyncMock(return_value=None)
 
             mock_session.return_value = mock_session_instance
 
@@ -145,3 +145,82 @@ class TestPriceStoreResampling:
 
         # Data should be stored (resampling happens during fetch)
         assert not store.data.empty
+
+
+def _price_frame(start, price):
+    dates = pd.date_range(start=start, periods=4 * 24, freq="15min", tz="UTC")
+    df = pd.DataFrame({"price": [price] * len(dates)}, index=dates)
+    df.index.name = "time"
+    return df
+
+
+class TestPriceStoreHedgedFetch:
+    """Tests for the hedged energy-charts/ENTSO-E fetch."""
+
+    @pytest.fixture
+    def hedged_store(self, sample_region):
+        store = PriceStore(sample_region)
+        store.entsoe_api_key = "test"
+        store.hedge_delay = 0.05
+        return store
+
+    @pytest.mark.asyncio
+    async def test_fast_primary_does_not_hedge(self, hedged_store):
+        """Test that ENTSO-E is not queried when energy-charts answers in time."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        hedged_store.fetch_prices_energycharts = AsyncMock(return_value=_price_frame(start, 8.0))
+        hedged_store.fetch_prices_entsoe = AsyncMock(return_value=_price_frame(start, 9.0))
+
+        assert await hedged_store._fetch_and_update_hedged(start, start)
+
+        assert not hedged_store.fetch_prices_entsoe.called
+        assert hedged_store.data["price"].iloc[0] == pytest.approx(8.0)
+        assert hedged_store.provider_latency["energycharts"].count == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_hedged_and_cancelled(self, hedged_store):
+        """Test that ENTSO-E wins when energy-charts hangs, and energy-charts is cancelled with the time it ran recorded."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        cancelled = asyncio.Event()
+
+        async def hanging(rstart, rend):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        hedged_store.fetch_prices_energycharts = hanging
+        hedged_store.fetch_prices_entsoe = AsyncMock(return_value=_price_frame(start, 9.0))
+
+        assert await hedged_store._fetch_and_update_hedged(start, start)
+
+        assert cancelled.is_set()
+        assert hedged_store.data["price"].iloc[0] == pytest.approx(9.0)
+        assert hedged_store.provider_latency["entsoe"].count == 1
+        # the loser ran at least for the hedge delay
+        latency = hedged_store.provider_latency["energycharts"].stats()
+        assert (latency["count"], latency["cancelled"], latency["failures"]) == (1, 1, 0)
+        assert latency["p50"] >= hedged_store.hedge_delay
+
+    @pytest.mark.asyncio
+    async def test_zero_data_falls_back_to_entsoe(self, hedged_store):
+        """Test that invalid zero prices from energy-charts trigger ENTSO-E immediately."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        hedged_store.fetch_prices_energycharts = AsyncMock(return_value=_price_frame(start, 0.0))
+        hedged_store.fetch_prices_entsoe = AsyncMock(return_value=_price_frame(start, 9.0))
+
+        assert await hedged_store._fetch_and_update_hedged(start, start)
+
+        assert hedged_store.data["price"].iloc[0] == pytest.approx(9.0)
+
+    @pytest.mark.asyncio
+    async def test_no_valid_result(self, hedged_store):
+        """Test that nothing is updated if no provider has valid data."""
+        start = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        hedged_store.fetch_prices_energycharts = AsyncMock(return_value=None)
+        hedged_store.fetch_prices_entsoe = AsyncMock(return_value=_price_frame(start, 0.0))
+
+        assert not await hedged_store._fetch_and_update_hedged(start, start)
+        assert hedged_store.data.empty
+        assert hedged_store.provider_latency["energycharts"].failures == 1
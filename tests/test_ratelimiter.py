@@ -0,0 +1,183 @@
+"""Tests for predictor.model.ratelimiter module."""
+
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+
+from predictor.model import ratelimiter, weatherstore
+from predictor.model.http import HttpResponse
+from predictor.model.ratelimiter import (
+    RateLimitExceeded,
+    RequestBudget,
+    RequestPriority,
+    TokenBucket,
+)
+from predictor.model.weatherstore import WeatherStore
+
+
+class TestTokenBucket:
+    """Tests for TokenBucket."""
+
+    def test_full_bucket_is_available(self):
+        """Test that a fresh bucket serves requests immediately."""
+        bucket = TokenBucket(10, 60)
+        assert bucket.time_until_available(5, bucket.last_refill) == 0
+
+    def test_empty_bucket_reports_wait_time(self):
+        """Test that an exhausted bucket reports the refill time."""
+        bucket = TokenBucket(10, 60)
+        now = bucket.last_refill
+        bucket.take(10, now)
+        # 6 seconds per token
+        assert bucket.time_until_available(1, now) == pytest.approx(6.0)
+
+    def test_cost_larger_than_capacity_is_clamped(self):
+        """Test that oversized requests can still be served eventually."""
+        bucket = TokenBucket(10, 60)
+        assert bucket.time_until_available(100, bucket.last_refill) == 0
+
+
+class TestRequestBudget:
+    """Tests for RequestBudget."""
+
+    @pytest.mark.asyncio
+    async def test_acquire_within_budget(self):
+        """Test that requests within budget are not throttled."""
+        budget = RequestBudget("test", [(10, 60)])
+        for _ in range(5):
+            await budget.acquire()
+        stats = budget.stats()
+        assert stats["requests"] == 5
+        assert stats["throttled"] == 0
+
+    @pytest.mark.asyncio
+    async def test_acquire_waits_when_exhausted(self):
+        """Test that requests wait for the bucket to refill."""
+        budget = RequestBudget("test", [(2, 0.1)])
+        for _ in range(4):
+            await budget.acquire()
+        stats = budget.stats()
+        assert stats["requests"] == 4
+        assert stats["throttled"] >= 1
+        assert stats["wait_seconds"] > 0
+
+    @pytest.mark.asyncio
+    async def test_forecast_served_before_backfill(self):
+        """Test that queued forecast requests overtake queued backfill requests."""
+        budget = RequestBudget("test", [(1, 0.05)])
+        await budget.acquire() # exhaust budget
+
+        order = []
+
+        async def request(name, priority):
+            await budget.acquire(priority=priority)
+            order.append(name)
+
+        tasks = [asyncio.create_task(request(f"backfill_{i}", RequestPriority.BACKFILL)) for i in range(3)]
+        await asyncio.sleep(0)
+        assert budget.queue_depth()["backfill"] == 3
+        tasks.append(asyncio.create_task(request("forecast", RequestPriority.FORECAST)))
+        await asyncio.gather(*tasks)
+
+        assert order[0] == "forecast"
+        assert budget.queue_depth() == {"forecast": 0, "backfill": 0}
+
+    @pytest.mark.asyncio
+    async def test_run_retries_rate_limited_requests(self):
+        """Test that rejected requests are deferred and retried."""
+        budget = RequestBudget("test", [(100, 0.01)])
+        calls = 0
+
+        async def flaky():
+            nonlocal calls
+            calls += 1
+            if calls < 3:
+                raise RateLimitExceeded("429", retry_after=0)
+            return "ok"
+
+        assert await budget.run(flaky) == "ok"
+        assert calls == 3
+        assert budget.stats()["retries"] == 2
+        assert budget.stats()["rejected"] == 2
+
+    @pytest.mark.asyncio
+    async def test_run_gives_up_after_max_retries(self):
+        """Test that persistent rejections are eventually raised."""
+        budget = RequestBudget("test", [(100, 0.01)], max_retries=1)
+
+        async def always_limited():
+            raise RateLimitExceeded("429", retry_after=0)
+
+        with pytest.raises(RateLimitExceeded):
+            await budget.run(always_limited)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_leaves_queue(self):
+        """Test that cancelling a waiting request removes it from the queue."""
+        budget = RequestBudget("test", [(1, 60)])
+        await budget.acquire()
+
+        task = asyncio.create_task(budget.acquire())
+        await asyncio.sleep(0)
+        assert budget.queue_depth()["forecast"] == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert budget.queue_depth()["forecast"] == 0
+
+
+class TestWeatherStoreRequestCost:
+    """Tests for WeatherStore.request_cost."""
+
+    def test_cost_per_location(self, sample_region):
+        """Test that each location counts as one call."""
+        store = WeatherStore(sample_region)
+        day = datetime(2025, 11, 1, tzinfo=timezone.utc)
+        assert store.request_cost(day, day) == len(sample_region.latitudes)
+
+    def test_cost_grows_with_range(self, sample_region):
+        """Test that long ranges count as multiple calls."""
+        store = WeatherStore(sample_region)
+        start = datetime(2025, 8, 1, tzinfo=timezone.utc)
+        end = datetime(2025, 10, 29, tzinfo=timezone.utc)
+        assert store.request_cost(start, end) == len(sample_region.latitudes) * 7
+
+
+class TestWeatherStoreBudget:
+    """Tests for the OpenMeteo budget shared by the forecast and history API."""
+
+    @pytest.mark.asyncio
+    async def test_forecast_overtakes_backfill(self, sample_region, monkeypatch):
+        """Test that a forecast refresh is fetched before history queries queued earlier on the other host."""
+        monkeypatch.setattr(ratelimiter, "_budgets", {})
+        budget = ratelimiter.get_request_budget(ratelimiter.OPEN_METEO, [(len(sample_region.latitudes), 0.05)])
+        await budget.acquire(len(sample_region.latitudes)) # exhaust budget
+
+        fetched = []
+
+        async def fake_fetch(url, **kwargs):
+            fetched.append(url)
+            day = url.split("start_date=")[1][:10]
+            data = [{"minutely_15": {"time": [f"{day}T00:00"], "wind_speed_80m": [1.0], "temperature_2m": [1.0],
+                                     "global_tilted_irradiance": [1.0], "pressure_msl": [1.0], "relative_humidity_2m": [1.0]}}
+                    for _ in sample_region.latitudes]
+            return HttpResponse(url, 200, json.dumps(data))
+
+        monkeypatch.setattr(weatherstore, "fetch", fake_fetch)
+        monkeypatch.setattr(weatherstore, "get_cached", AsyncMock(return_value=None))
+        store = WeatherStore(sample_region)
+        now = datetime.now(timezone.utc)
+
+        backfills = [asyncio.create_task(store.fetch_range(now - timedelta(days=100 + i), now - timedelta(days=100 + i)))
+                     for i in range(3)]
+        await asyncio.sleep(0)
+        assert budget.queue_depth()["backfill"] == 3
+        forecast = asyncio.create_task(store.fetch_range(now, now))
+        await asyncio.gather(forecast, *backfills)
+
+        assert fetched[0].startswith(weatherstore.OPENMETEO_URL)
+        assert all(url.startswith(weatherstore.OPENMETEO_HISTORY_URL) for url in fetched[1:])
+        assert ratelimiter.request_budget_stats().keys() == {ratelimiter.OPEN_METEO}
@@ -0,0 +1,119 @@
+"""Tests for predictor.model.resilience module."""
+
+import time
+
+import pytest
+
+from predictor.model.resilience import (
+    BreakerState,
+    CircuitBreaker,
+    CircuitOpenError,
+    circuit_breaker_stats,
+    deadline,
+    get_circuit_breaker,
+    time_left,
+)
+
+
+def _open_breaker(reset_timeout=60.0):
+    breaker = CircuitBreaker("example.com", failure_threshold=3, reset_timeout=reset_timeout)
+    for _ in range(3):
+        breaker.acquire()
+        breaker.failure()
+    return breaker
+
+
+class TestCircuitBreaker:
+    """Tests for the breaker state machine."""
+
+    def test_opens_after_consecutive_failures(self):
+        """Test that the breaker opens only after failure_threshold failures in a row."""
+        breaker = CircuitBreaker("example.com", failure_threshold=3)
+        breaker.failure()
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        breaker.failure()
+        assert breaker.state == BreakerState.CLOSED
+
+        breaker.failure()
+        assert breaker.state == BreakerState.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+        assert breaker.rejected == 1
+
+    def test_half_open_allows_single_probe(self):
+        """Test that only one request is let through after the reset timeout."""
+        breaker = _open_breaker(reset_timeout=0.01)
+        time.sleep(0.02)
+
+        breaker.acquire()
+        assert breaker.state == BreakerState.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+
+    def test_successful_probe_closes(self):
+        """Test that a successful probe closes the breaker."""
+        breaker = _open_breaker(reset_timeout=0.01)
+        time.sleep(0.02)
+
+        breaker.acquire()
+        breaker.success()
+
+        assert breaker.state == BreakerState.CLOSED
+        breaker.acquire()
+
+    def test_failed_probe_reopens(self):
+        """Test that a failing probe opens the breaker for another reset timeout."""
+        breaker = _open_breaker(reset_timeout=0.05)
+        time.sleep(0.06)
+
+        breaker.acquire()
+        breaker.failure()
+
+        assert breaker.state == BreakerState.OPEN
+        assert breaker.trips == 2
+        with pytest.raises(CircuitOpenError):
+            breaker.acquire()
+
+    def test_abandoned_probe_frees_slot(self):
+        """Test that a cancelled probe lets the next request probe instead."""
+        breaker = _open_breaker(reset_timeout=0.01)
+        time.sleep(0.02)
+
+        breaker.acquire()
+        breaker.abandon()
+        breaker.acquire()
+
+    def test_stats(self):
+        """Test that breakers of all hosts are reported."""
+        get_circuit_breaker("a.example.com").failure()
+        stats = circuit_breaker_stats()
+        assert stats["a.example.com"]["state"] == "closed"
+        assert stats["a.example.com"]["failures"] == 1
+
+
+class TestDeadline:
+    """Tests for request-scoped deadlines."""
+
+    def test_no_deadline_by_default(self):
+        """Test that there is no deadline outside of a request."""
+        assert time_left() is None
+
+    def test_nested_deadline_only_shortens(self):
+        """Test that an inner deadline can't extend the outer one."""
+        with deadline(1):
+            with deadline(60):
+                left = time_left()
+                assert left is not None and left <= 1
+            with deadline(0.5):
+                left = time_left()
+                assert left is not None and left <= 0.5
+        assert time_left() is None
+
+    def test_none_removes_deadline(self):
+        """Test that background work can opt out of the request's deadline."""
+        with deadline(1):
+            with deadline(None):
+                assert time_left() is None
+            assert time_left() is not None
@@ -0,0 +1,102 @@
+"""Tests for predictor.model.slotgrid module."""
+
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictor.model.slotgrid import SlotFrame, ffill, slot_index, slot_range, to_slot
+
+
+def _to_frame(slots):
+    """The pandas representation of the stores: slots with data only."""
+    index = slot_index(slots.base, slots.end)[slots.rows]
+    return pd.DataFrame(slots.values[slots.rows], index=index, columns=list(slots.columns))
+
+
+def _frame(start, periods, columns=("a", "b")):
+    index = pd.date_range(start, periods=periods, freq="15min", tz="UTC", name="time")
+    return pd.DataFrame({c: np.arange(periods, dtype=np.float64) + i for i, c in enumerate(columns)}, index=index)
+
+
+class TestSlotRange:
+    """Tests for slot arithmetic."""
+
+    def test_to_slot(self):
+        """Test that slots count 15 minute steps since the epoch."""
+        assert to_slot(datetime(1970, 1, 1, 0, 15, tzinfo=timezone.utc)) == 1
+        assert to_slot(datetime(1970, 1, 1, 0, 29, tzinfo=timezone.utc)) == 1
+
+    def test_matches_loc(self):
+        """Test that slot ranges select the same rows as .loc label slicing."""
+        df = _frame("2025-01-01", 96)
+        slots = SlotFrame.from_frame(df)
+        for start, end in [("2025-01-01 01:00", "2025-01-01 03:00"), ("2025-01-01 01:05", "2025-01-01 02:59"), ("2025-01-01 01:05", "2025-01-01 01:10")]:
+            start, end = pd.Timestamp(start, tz="UTC"), pd.Timestamp(end, tz="UTC")
+            expected = df.loc[start:end]
+            part = slots.slice(*slot_range(start, end))
+            pd.testing.assert_frame_equal(_to_frame(part), expected, check_freq=False)
+
+    def test_slot_index(self):
+        """Test that slot timestamps use the same unit as pd.date_range."""
+        first = to_slot(datetime(2025, 1, 1, tzinfo=timezone.utc))
+        index = slot_index(first, first + 4)
+        assert index.equals(pd.date_range("2025-01-01", periods=4, freq="15min", tz="UTC"))
+        assert index.dtype == pd.date_range("2025-01-01", periods=1, tz="UTC").dtype
+
+
+class TestSlotFrame:
+    """Tests for dense slot frames."""
+
+    def test_roundtrip_with_gaps(self):
+        """Test that missing slots become NaN rows and are dropped again on the way back."""
+        df = _frame("2025-01-01", 8)
+        df = df.drop(df.index[2:5])
+
+        slots = SlotFrame.from_frame(df)
+
+        assert len(slots.values) == 8
+        assert slots.rows.tolist() == [True, True, False, False, False, True, True, True]
+        pd.testing.assert_frame_equal(_to_frame(slots), df)
+
+    def test_slice_is_clipped(self):
+        """Test that slicing outside of the covered slots returns only what exists."""
+        slots = SlotFrame.from_frame(_frame("2025-01-01", 8))
+
+        part = slots.slice(slots.base - 10, slots.base + 3)
+        assert part.base == slots.base
+        assert len(part.values) == 3
+        assert len(slots.slice(slots.end + 5, slots.end + 10).values) == 0
+
+    def test_window_is_padded(self):
+        """Test that windows always have the requested length."""
+        slots = SlotFrame.from_frame(_frame("2025-01-01", 4))
+
+        window = slots.window(slots.base - 2, slots.end + 2)
+
+        assert window.shape == (8, 2)
+        assert np.isnan(window[:2]).all() and np.isnan(window[-2:]).all()
+        assert window[2, 0] == 0
+
+    def test_misaligned_index(self):
+        """Test that data off the 15 minute grid is rejected."""
+        df = _frame("2025-01-01 00:05", 4)
+        with pytest.raises(ValueError):
+            SlotFrame.from_frame(df)
+
+    def test_empty(self):
+        """Test that empty stores convert to empty frames with their columns."""
+        slots = SlotFrame.from_frame(_frame("2025-01-01", 0))
+        assert slots.columns == ("a", "b")
+        assert _to_frame(slots).empty
+
+
+class TestFfill:
+    """Tests for forward filling."""
+
+    def test_ffill_columns(self):
+        """Test that each column is filled independently and leading NaNs stay."""
+        values = np.array([[np.nan, 1.0], [2.0, np.nan], [np.nan, np.nan], [3.0, 4.0]])
+        filled = ffill(values)
+        np.testing.assert_array_equal(filled, [[np.nan, 1.0], [2.0, 1.0], [2.0, 1.0], [3.0, 4.0]])
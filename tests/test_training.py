@@ -0,0 +1,334 @@
+"""Tests for predictor.model.training module."""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import pytest
+
+import predictor.model.training as training
+import predictor.model.workers as workers
+from predictor.model.cpubudget import CpuBudget
+from predictor.model.training import Binning, TimeBox, Trainer
+
+
+def _traindata(rows=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.date_range("2025-01-01", periods=rows, freq="15min", tz="UTC", name="time")
+    df = pd.DataFrame(rng.normal(size=(rows, 4)), index=index, columns=["wind", "temp", "load", "gasprice"])
+    df["price"] = 3 * df["wind"] - df["load"] + rng.normal(scale=0.1, size=rows)
+    df.iloc[5, 1] = np.nan
+    return df
+
+
+class TestTrainer:
+    """Tests for the training backends."""
+
+    def test_unknown_backend(self):
+        """Test that typos in the backend setting are not silently ignored."""
+        with pytest.raises(ValueError):
+            Trainer("gpu")
+
+    @pytest.mark.asyncio
+    async def test_thread_backend(self):
+        """Test that the thread backend trains on complete rows only."""
+        traindata = _traindata()
+
+        used, booster = await Trainer("thread").train(traindata)
+
+        assert len(used) == len(traindata) - 1
+        assert booster.num_feature() == 4
+
+    @pytest.mark.asyncio
+    async def test_process_backend_matches_thread(self):
+        """Test that a model trained in a separate process predicts exactly like one trained in a thread."""
+        traindata = _traindata()
+        trainer = Trainer("process", max_trainings=1)
+        shm_before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+        timebox = TimeBox(600)
+        try:
+            used, booster = await trainer.train(traindata, timebox=timebox)
+        finally:
+            trainer.shutdown()
+        _, reference = await Trainer("thread").train(traindata)
+
+        features = used.drop(columns=["price"])
+        np.testing.assert_array_equal(booster.predict(features), reference.predict(features))
+        assert booster.feature_name() == ["wind", "temp", "load", "gasprice"]
+        assert not timebox.expired
+        # the shared block is gone
+        if os.path.isdir("/dev/shm"):
+            assert set(os.listdir("/dev/shm")) <= shm_before
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("started", [True, False])
+    async def test_cancelled_process_training(self, started):
+        """Test that a cancelled training is cancelled in the pool, and its shared memory is only released once the
+        training process is done with it."""
+        submitted = asyncio.Event()
+        futures = []
+
+        class Executor:
+            def submit(self, fn, name, *args):
+                futures.append((Future(), name))
+                if started:
+                    futures[0][0].set_running_or_notify_cancel()
+                submitted.set()
+                return futures[0][0]
+
+        trainer = Trainer("process", max_trainings=1)
+        trainer.executor = Executor()
+        task = asyncio.create_task(trainer.train(_traindata()))
+        await submitted.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        future, name = futures[0]
+        if started:
+            SharedMemory(name).close()
+            future.set_result(("", False))
+        else:
+            assert future.cancelled()
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name)
+
+    @pytest.mark.asyncio
+    async def test_cpu_pool_free_during_training(self, monkeypatch):
+        """Test that work for requests doesn't wait for a training in a thread, even with a single CPU worker."""
+        monkeypatch.setattr(workers, "_pool", workers.WorkerPool(1))
+        started = threading.Event()
+        release = threading.Event()
+
+        def blocking_fit(traindata, *args):
+            started.set()
+            release.wait(10)
+            return traindata, None
+
+        monkeypatch.setattr(training, "fit", blocking_fit)
+        trainer = Trainer("thread", max_trainings=1)
+        task = asyncio.create_task(trainer.train(_traindata(10)))
+        try:
+            await asyncio.to_thread(started.wait, 10)
+            begin = time.monotonic()
+            assert await asyncio.wait_for(workers.run_cpu(lambda: 1), 2) == 1
+            assert time.monotonic() - begin < 0.5
+        finally:
+            release.set()
+            await task
+            trainer.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_concurrent_trainings_are_capped(self, monkeypatch):
+        """Test that trainings beyond the limit wait for a free slot."""
+        running = []
+        peak = []
+
+        async def slow_fit(func, traindata, *args):
+            running.append(1)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.pop()
+            return traindata, None
+
+        # enough cores for everybody, only the training limit counts
+        monkeypatch.setattr(training, "reserve_threads", CpuBudget(cores=16).reserve)
+        trainer = Trainer("thread", max_trainings=2)
+        monkeypatch.setattr(trainer.pool, "run", slow_fit)
+
+        await asyncio.gather(*[trainer.train(_traindata(10)) for _ in range(5)])
+
+        assert max(peak) == 2
+        stats = trainer.stats()
+        assert stats["runtime"]["count"] == 5
+        assert stats["queued"] == 0 and stats["running"] == 0
+
+
+class TestIncrementalTraining:
+    """Tests for continuing a model with new data."""
+
+    def test_continues_previous_model(self):
+        """Test that the previous trees are kept and a few are added for the new rows."""
+        traindata = _traindata()
+        _, base = training.fit(traindata.iloc[:-96], 1)
+
+        used, model = training.fit(traindata, 1, init_model=base, new_since=traindata.index[-97])
+
+        assert len(used) == len(traindata) - 1
+        assert model.num_trees() == base.num_trees() + training.INCREMENTAL_ROUNDS
+        features = used.drop(columns=["price"])
+        assert not np.array_equal(model.predict(features), base.predict(features))
+
+    def test_refit_only_without_new_rows(self):
+        """Test that without new rows, only the leaf values are refit."""
+        traindata = _traindata()
+        _, base = training.fit(traindata, 1)
+
+        _, model = training.fit(traindata, 1, init_model=base, new_since=traindata.index[-1])
+
+        assert model.num_trees() == base.num_trees()
+
+    def test_shared_memory_path_matches(self):
+        """Test that incremental training on the shared block gives the same model as in a thread."""
+        traindata = _traindata()
+        _, base = training.fit(traindata.iloc[:-96], 1)
+        params = training.LGB_PARAMS | {"num_threads": 1}
+
+        used, new_rows, shm, features = training._share(traindata, traindata.index[-97])
+        try:
+            model, expired = training._fit_shared(shm.name, len(used), features, params, base.model_to_string(), new_rows)
+        finally:
+            shm.close()
+            shm.unlink()
+        _, reference = training.fit(traindata, 1, init_model=base, new_since=traindata.index[-97])
+
+        assert new_rows == 96 and not expired
+        x = used.drop(columns=["price"])
+        np.testing.assert_allclose(lgb.Booster(model_str=model).predict(x), reference.predict(x))
+
+
+
+class TestBinning:
+    """Tests for reusing feature bins across trainings."""
+
+    def test_bins_reused_for_next_day(self):
+        """Test that the next day's training reuses the bins of the previous one."""
+        traindata = _traindata(2096)
+        binning = Binning()
+
+        training.fit(traindata.iloc[:-96], 1, binning=binning)
+        _, model = training.fit(traindata.iloc[96:], 1, binning=binning)
+
+        assert (binning.rebins, binning.reuses) == (1, 1)
+        assert binning.until == traindata.index[-97]
+        assert model.num_feature() == 4
+
+    def test_rebin_on_drift(self):
+        """Test that new bins are made once values leave the binned range."""
+        traindata = _traindata()
+        binning = Binning()
+        training.fit(traindata, 1, binning=binning)
+
+        drifted = traindata.copy()
+        drifted["load"] *= 10
+        training.fit(drifted, 1, binning=binning)
+
+        assert (binning.rebins, binning.reuses) == (2, 0)
+
+    def test_rebin_on_schedule(self):
+        """Test that new bins are made once the data moved rebin_days past the binned data."""
+        traindata = _traindata()
+        binning = Binning(rebin_days=0)
+
+        training.fit(traindata, 1, binning=binning)
+        training.fit(traindata, 1, binning=binning)
+
+        assert (binning.rebins, binning.reuses) == (2, 0)
+
+    @pytest.mark.asyncio
+    async def test_process_backend_reuses_dumped_bins(self):
+        """Test that training processes reuse dumped bins, with the same result as in a thread, and the dump is removed."""
+        traindata = _traindata()
+        trainer = Trainer("process", max_trainings=1)
+        binning = Binning()
+        try:
+            await trainer.train(traindata, binning=binning)
+            path = binning.path
+            assert path is not None and os.path.exists(path)
+            used, booster = await trainer.train(traindata, binning=binning)
+        finally:
+            trainer.shutdown()
+        assert (binning.rebins, binning.reuses) == (1, 1)
+
+        reference = Binning()
+        training.fit(traindata, 1, binning=reference)
+        _, expected = training.fit(traindata, 1, binning=reference)
+        features = used.drop(columns=["price"])
+        np.testing.assert_array_equal(booster.predict(features), expected.predict(features))
+
+        binning.forget()
+        assert not os.path.exists(path)
+
+
+class TestEarlyStopping:
+    """Tests for finding the number of boosting rounds on the most recent days."""
+
+    def test_rounds_from_validation(self, monkeypatch):
+        """Test that a full fit stops adding trees once they don't help on the held out days, and uses all rows."""
+        monkeypatch.setattr(training, "VALIDATION_DAYS", 7)
+        traindata = _traindata()
+
+        used, model = training.fit(traindata, 1)
+
+        assert model.num_trees() < training.round_budget(None)
+        assert model.num_trees() != training.DEFAULT_ROUNDS
+        assert len(used) == len(traindata) - 1
+
+    def test_previous_rounds_limit_budget(self, monkeypatch):
+        """Test that the previous number of rounds, with some room to grow, bounds the next search."""
+        monkeypatch.setattr(training, "VALIDATION_DAYS", 7)
+        _, model = training.fit(_traindata(), 1, rounds=4)
+
+        assert model.num_trees() <= training.round_budget(4) == 16
+
+    def test_without_validation(self, monkeypatch):
+        """Test that without validation days, the given or default number of rounds is used."""
+        monkeypatch.setattr(training, "VALIDATION_DAYS", 0)
+        traindata = _traindata()
+
+        assert training.fit(traindata, 1)[1].num_trees() == training.DEFAULT_ROUNDS
+        assert training.fit(traindata, 1, rounds=30)[1].num_trees() == 30
+
+
+class TestTimeBox:
+    """Tests for training budgets."""
+
+    def test_stops_boosting_when_out_of_time(self, monkeypatch):
+        """Test that boosting stops once the budget is used up, and the trees so far are kept."""
+        monkeypatch.setattr(training, "VALIDATION_DAYS", 0)
+        timebox = TimeBox(1e-9)
+
+        _, model = training.fit(_traindata(), 1, timebox=timebox)
+
+        assert timebox.expired
+        assert model.num_trees() == 1
+
+    def test_out_of_time_during_validation(self, monkeypatch):
+        """Test that running out of time while searching the number of rounds marks the model as well."""
+        monkeypatch.setattr(training, "VALIDATION_DAYS", 7)
+        timebox = TimeBox(1e-9)
+
+        _, model = training.fit(_traindata(), 1, timebox=timebox)
+
+        assert timebox.expired
+        assert model.num_trees() == 1
+
+    def test_enough_time(self):
+        """Test that a training within its budget is not marked."""
+        timebox = TimeBox(600)
+
+        training.fit(_traindata(), 1, timebox=timebox)
+
+        assert not timebox.expired
+
+    def test_budgets_per_region(self, monkeypatch):
+        """Test that region budgets override the default, and 0 means no limit."""
+        monkeypatch.setattr(training, "TRAINING_BUDGETS", training.parse_budgets("60, se1=20,DE=0"))
+
+        assert training.training_budget("AT") == 60
+        assert training.training_budget("SE1") == 20
+        assert training.training_budget("DE") is None
+        assert training.parse_budgets("") == {}
+
+    @pytest.mark.parametrize("setting", ["SE1", "60,SE1=abc", "=20"])
+    def test_malformed_budgets(self, setting):
+        """Test that a malformed budget names the setting and the entry."""
+        with pytest.raises(ValueError, match=r"EPEXPREDICTOR_TRAINING_BUDGET.*'(SE1|SE1=abc|=20)'"):
+            training.parse_budgets(setting)
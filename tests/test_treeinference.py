@@ -0,0 +1,103 @@
+"""Tests for predictor.model.treeinference module."""
+
+import gc
+import os
+import shutil
+
+import lightgbm as lgb
+import numpy as np
+import pandas as pd
+import pytest
+
+from predictor.model import treeinference
+from predictor.model.treeinference import FlatForest, compile_booster, compile_forest
+
+needs_compiler = pytest.mark.skipif(shutil.which(treeinference.CC) is None, reason="no C compiler")
+
+
+def _model(params=None, rows=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    features = pd.DataFrame(rng.normal(size=(rows, 5)), columns=["wind", "temp", "load", "gasprice", "holiday"])
+    features.loc[features.index % 7 == 0, "temp"] = np.nan
+    features.loc[features.index % 5 == 0, "load"] = 0.0
+    labels = 3 * features["wind"] - features["load"] + np.sin(features["temp"].fillna(0) * 3)
+    booster = lgb.train({"verbosity": -1, "num_threads": 1} | (params or {}), lgb.Dataset(features, label=labels), num_boost_round=30)
+    return booster, features
+
+
+class TestFlatForest:
+    """Tests for flattening LightGBM models."""
+
+    def test_structure(self):
+        """Test that every tree has a root and all leaves are reachable."""
+        booster, _ = _model()
+
+        forest = FlatForest.from_booster(booster)
+
+        assert len(forest.roots) == booster.num_trees()
+        assert forest.feature_names == ["wind", "temp", "load", "gasprice", "holiday"]
+        children = np.concatenate([forest.left, forest.right, forest.roots])
+        assert sorted(~children[children < 0]) == list(range(len(forest.leaf_value)))
+
+    def test_unsupported_models(self):
+        """Test that models the C code can't evaluate are rejected."""
+        rng = np.random.default_rng(0)
+        features = pd.DataFrame({"day": rng.integers(0, 7, 1000), "wind": rng.normal(size=1000)})
+        labels = features["day"].isin([5, 6]) * 3.0 + features["wind"]
+        categorical = lgb.train({"verbosity": -1}, lgb.Dataset(features, label=labels, categorical_feature=["day"]), num_boost_round=5)
+        with pytest.raises(ValueError):
+            FlatForest.from_booster(categorical)
+
+        poisson = lgb.train({"verbosity": -1, "objective": "poisson"}, lgb.Dataset(features, label=labels.abs()), num_boost_round=5)
+        with pytest.raises(ValueError):
+            FlatForest.from_booster(poisson)
+
+
+@needs_compiler
+class TestCompiledForest:
+    """Tests for compiled tree inference."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("params", [{}, {"zero_as_missing": True}, {"use_missing": False}])
+    async def test_parity(self, params):
+        """Test that the compiled model predicts exactly like Booster.predict, missing values and zeros included."""
+        booster, features = _model(params)
+        compiled = await compile_forest(FlatForest.from_booster(booster))
+
+        np.testing.assert_array_equal(compiled.predict(features.to_numpy()), booster.predict(features))
+
+    @pytest.mark.asyncio
+    async def test_memory_layouts(self):
+        """Test that row-major, column-major and strided arrays give the same predictions."""
+        booster, features = _model()
+        compiled = await compile_forest(FlatForest.from_booster(booster))
+        values = features.to_numpy()
+
+        expected = booster.predict(values)
+        np.testing.assert_array_equal(compiled.predict(np.asfortranarray(values)), expected)
+        np.testing.assert_array_equal(compiled.predict(np.ascontiguousarray(values)), expected)
+        np.testing.assert_array_equal(compiled.predict(values[::2]), expected[::2])
+        assert len(compiled.predict(values[:0])) == 0
+        with pytest.raises(ValueError):
+            compiled.predict(values[:, :3])
+
+    @pytest.mark.asyncio
+    async def test_library_removed_with_model(self):
+        """Test that the temporary directory of the library goes away with the compiled model."""
+        booster, _ = _model()
+        compiled = await compile_forest(FlatForest.from_booster(booster))
+        directory = compiled.directory
+        assert os.path.isdir(directory)
+
+        del compiled
+        gc.collect()
+
+        assert not os.path.exists(directory)
+
+    @pytest.mark.asyncio
+    async def test_falls_back_without_compiler(self, monkeypatch):
+        """Test that a missing compiler means predicting with LightGBM, not failing."""
+        monkeypatch.setattr(treeinference, "CC", "/nonexistent/cc")
+        booster, _ = _model()
+
+        assert await compile_booster(booster) is None
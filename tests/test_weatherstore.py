@@ -7,6 +7,7 @@ from unittest.mock import AsyncMock, MagicMock, patch
 import pandas as pd
 import pytest
 
+from predictor.model import http
 from predictor.model.weatherstore import WeatherStore
 
 
@@ -82,9 +83,10 @@ class TestWeatherStoreFetchMissingData:
             for _ in sample_region.latitudes
         ]
 
-        with patch("aiohttp.ClientSession") as mock_session:
+        with patch("predictor.model.http.get_session") as mock_session:
             mock_response = AsyncMock()
             mock_response.status = 200
+            mock_response.headers = {}
             # The code uses resp.text() then json.loads(), so return a JSON string
             mock_response.text = AsyncMock(return_value=json.dumps(mock_response_data))
 
@@ -94,8 +96,6 @@ class TestWeatherStoreFetchMissingData:
 
             mock_session_instance = MagicMock()
             mock_session_instance.get = MagicMock(return_value=mock_context)
-            mock_session_instance.__aenter__ = AsyncMock(return_value=mock_session_instance)
-            mock_session_instance.__aexit__ = AsyncMock(return_value=None)
 
             mock_session.return_value = mock_session_instance
 
@@ -108,6 +108,37 @@ class TestWeatherStoreFetchMissingData:
             # Verify a request was made
             assert mock_session_instance.get.called
 
+    @pytest.mark.asyncio
+    async def test_cache_read_once(self, sample_region, temp_storage_dir, monkeypatch):
+        """Test that a query missing in the response cache reads the cache once, and is stored for the next one."""
+        monkeypatch.setenv("EPEXPREDICTOR_HTTP_CACHE_DIR", temp_storage_dir)
+        monkeypatch.delenv("EPEXPREDICTOR_HTTP_CACHE_MODE", raising=False)
+        reads = []
+        read_cache = http._read_cache
+        monkeypatch.setattr(http, "_read_cache", lambda key: reads.append(key) or read_cache(key))
+        store = WeatherStore(sample_region)
+        response = [{"minutely_15": {"time": ["2025-11-01T00:00"], "wind_speed_80m": [5.0], "temperature_2m": [10.0],
+                                     "global_tilted_irradiance": [100.0], "pressure_msl": [1013.0], "relative_humidity_2m": [75.0]}}
+                    for _ in sample_region.latitudes]
+
+        with patch("predictor.model.http.get_session") as mock_session:
+            mock_response = AsyncMock()
+            mock_response.status = 200
+            mock_response.headers = {}
+            mock_response.text = AsyncMock(return_value=json.dumps(response))
+            mock_context = AsyncMock()
+            mock_context.__aenter__ = AsyncMock(return_value=mock_response)
+            mock_context.__aexit__ = AsyncMock(return_value=None)
+            mock_session.return_value = MagicMock(get=MagicMock(return_value=mock_context))
+
+            day = datetime(2025, 11, 1, tzinfo=timezone.utc)
+            await store.fetch_range(day, day)
+            assert len(reads) == 1
+            await store.fetch_range(day, day)
+
+            assert len(reads) == 2
+            assert mock_session.return_value.get.call_count == 1
+
 
 class TestWeatherStoreMissingRanges:
     """Tests for gen_missing_date_ranges method."""
@@ -0,0 +1,121 @@
+"""Tests for predictor.model.workers module."""
+
+import asyncio
+import logging
+import threading
+import time
+from contextvars import ContextVar
+
+import pytest
+
+from predictor.model.workers import LoopLagMonitor, WorkerPool
+
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class TestWorkerPool:
+    """Tests for the bounded CPU worker pool."""
+
+    @pytest.mark.asyncio
+    async def test_runs_off_the_loop_thread(self):
+        """Test that work runs in a worker thread and sees the caller's context variables."""
+        pool = WorkerPool(2)
+        request_id.set("abc")
+
+        thread, seen = await pool.run(lambda: (threading.get_ident(), request_id.get()))
+
+        assert thread != threading.get_ident()
+        assert seen == "abc"
+        pool.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_bounded(self):
+        """Test that at most the configured number of jobs run at once and the rest queue."""
+        pool = WorkerPool(2)
+        running = []
+        peak = []
+
+        def job():
+            running.append(1)
+            peak.append(len(running))
+            time.sleep(0.02)
+            running.pop()
+
+        await asyncio.gather(*[pool.run(job) for _ in range(6)])
+
+        assert max(peak) == 2
+        stats = pool.stats()
+        assert stats["runtime"]["count"] == 6
+        assert stats["queued"] == 0 and stats["running"] == 0
+        pool.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_errors_propagate(self):
+        """Test that exceptions reach the caller and are counted."""
+        pool = WorkerPool(1)
+
+        def fail():
+            raise ValueError("broken")
+
+        with pytest.raises(ValueError):
+            await pool.run(fail)
+        assert pool.stats()["runtime"]["failures"] == 1
+        pool.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_loop_stays_responsive(self):
+        """Test that the event loop keeps running while a worker is busy."""
+        pool = WorkerPool(1)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        await pool.run(time.sleep, 0.2)
+        task.cancel()
+
+        assert ticks >= 5
+        pool.shutdown()
+
+
+class TestLoopLagMonitor:
+    """Tests for the event loop watchdog."""
+
+    @pytest.mark.asyncio
+    async def test_reports_blocking_code(self, caplog):
+        """Test that a blocked loop is logged once with the task and stack that block it."""
+        monitor = LoopLagMonitor(threshold=0.1, interval=0.02)
+        monitor.start()
+
+        def crunch_numbers():
+            time.sleep(0.4)
+
+        async def handler():
+            crunch_numbers()
+
+        with caplog.at_level(logging.WARNING, logger="predictor.model.workers"):
+            await asyncio.create_task(handler(), name="slow-handler")
+            await asyncio.sleep(0.05)
+        await monitor.stop()
+
+        assert monitor.stalls == 1
+        assert monitor.max_lag > 0.3
+        assert "slow-handler" in caplog.text
+        assert "crunch_numbers" in caplog.text
+
+    @pytest.mark.asyncio
+    async def test_quiet_when_loop_runs(self, caplog):
+        """Test that nothing is reported while the loop keeps up."""
+        monitor = LoopLagMonitor(threshold=1.0, interval=0.05)
+        monitor.start()
+
+        with caplog.at_level(logging.WARNING, logger="predictor.model.workers"):
+            await asyncio.sleep(0.3)
+        await monitor.stop()
+
+        assert monitor.stalls == 0
+        assert caplog.text == ""